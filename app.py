@@ -1,7 +1,10 @@
+import os
+import time
+import uuid
 import streamlit as st
 import config
 import auth 
-import generator_engine as engine
+# 生成引擎 (generator_engine / jobs / pipeline ...) 登入後才載入：新 worker 的登入畫面不必等它們匯入
 
 # --- 1. 初始化頁面 ---
 config.setup_page()
@@ -9,7 +12,8 @@ config.setup_page()
 # ==========================================
 # 👇 CSS 優化
 # ==========================================
-st.markdown("""
+# Streamlit 每次 rerun 都會重建整個頁面，沒有再輸出的元素會被移除，所以 CSS 每次都要送出 (字串本身只建立一次)
+PAGE_CSS = """
     <style>
     .stDeployButton {display:none;}
     #MainMenu {visibility: hidden;}
@@ -27,7 +31,8 @@ st.markdown("""
         width: 100%;
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+st.markdown(PAGE_CSS, unsafe_allow_html=True)
 
 # ==========================================
 # 👇 核心：狀態初始化 & 回呼函式 (Callbacks)
@@ -39,7 +44,10 @@ keys_to_init = [
     "trigger_blueprint", "trigger_structure", 
     "project_name", "project_desc",
     "questions", "result_files", "structure_res",
-    "ans_fe", "ans_be", "ans_db"
+    "ans_fe", "ans_be", "ans_db",
+    "interview_token", "blueprint_token", "jobs_restored",
+    "full_requirements", "trigger_document",
+    "similar_offer", "similar_choice", "project_id"
 ]
 for key in keys_to_init:
     if key not in st.session_state:
@@ -47,19 +55,338 @@ for key in keys_to_init:
         elif key == "workflow_stage": st.session_state[key] = 0
         else: st.session_state[key] = None # 其他設為 None 或 False
 
-# 2. 定義按鈕的回呼函式 (Click Handlers)
+# 2. 背景工作以 session_id 為 key；放在網址參數裡，重新整理或斷線重連後仍是同一個 id
+if "sid" not in st.query_params:
+    st.query_params["sid"] = uuid.uuid4().hex
+session_id = st.query_params["sid"]
+POLL_INTERVAL = 1.0  # 輪詢背景工作的間隔 (秒)
+
+def poll_job_later():
+    """背景工作尚未完成：稍等一下再 rerun，script thread 不會被整個生成過程卡住"""
+    time.sleep(POLL_INTERVAL)
+    st.rerun()
+
+# 3. 定義按鈕的回呼函式 (Click Handlers)
 def on_click_blueprint():
     st.session_state.trigger_blueprint = True
 
 def on_click_structure():
     st.session_state.trigger_structure = True
 
+def on_click_regenerate(name):
+    st.session_state.trigger_document = name
+
+def on_click_similar(choice):
+    """
+    找到相似構想時的選擇：reuse 直接使用先前的問卷、open 直接開啟先前的藍圖 (不耗額度)；
+    draft 以先前的問卷為草稿重新分析、fresh 忽略 (這兩個需要送出工作，交給主畫面處理)
+    """
+    offer = st.session_state.similar_offer
+    results = offer["results"]
+    if choice == "reuse":
+        # 完全相同的構想：重新開啟原本的專案；只是相似的構想才為它建立新專案、沿用問卷
+        if offer["similarity"] >= 1.0 and reopen_project(results.get("project")):
+            return
+        if not st.session_state.project_id:
+            new_project(st.session_state.project_name, st.session_state.project_desc)
+        st.session_state.questions = save_artifacts("questions", results["interview"])
+        engine.remember_project(st.session_state.project_name, st.session_state.project_desc,
+                                st.session_state.project_id, owner=session_id)
+        st.session_state.workflow_stage = 1
+    elif choice == "open":
+        if reopen_project(results["blueprint"].get("project_id")):
+            return
+        # 專案已經不在專案庫：用記下的藍圖重新建立一份
+        st.session_state.project_name = offer["project_name"]
+        st.session_state.project_desc = offer["project_desc"]
+        new_project(offer["project_name"], offer["project_desc"])
+        if results.get("interview"):
+            st.session_state.questions = save_artifacts("questions", results["interview"])
+        st.session_state.result_files = save_artifacts("files", results["blueprint"]["files"])
+        st.session_state.full_requirements = results["blueprint"]["full_requirements"]
+        project_store.store.set_requirements(st.session_state.project_id, st.session_state.full_requirements)
+        st.session_state.workflow_stage = 2
+    else:
+        st.session_state.similar_choice = choice
+        return
+    st.session_state.similar_offer = None
+
+def on_answer_change():
+    # 回答改變後，進行中的藍圖與預先生成的架構都不再適用
+    pipeline.cancel(session_id, st.session_state.blueprint_token)
+    st.session_state.blueprint_token = None
+    jobs.manager.cancel_session(session_id, "structure")
+
 def on_click_reset():
+    jobs.manager.cancel_session(session_id)
     st.session_state.workflow_stage = 0
     # 清空相關資料
-    for k in ["questions", "result_files", "structure_res", "ans_fe", "ans_be", "ans_db"]:
+    for k in ["questions", "result_files", "structure_res", "ans_fe", "ans_be", "ans_db",
+              "interview_token", "blueprint_token", "full_requirements", "similar_offer", "similar_choice",
+              "project_id"]:
         st.session_state[k] = None
 
+def owns_project(project_id):
+    """專案庫以 session_id (網址上的 sid) 區分擁有者：只能開啟自己建立的專案"""
+    project = project_store.store.get_project(project_id) if project_id else None
+    return project is not None and project["session_id"] == session_id
+
+def on_click_open_project(project_id):
+    """從專案庫重新開啟：只取回 handle，文件要顯示時才讀取，不需要呼叫 API"""
+    if not owns_project(project_id):
+        return
+    on_click_reset()
+    load_project(project_id)
+
+def reopen_project(project_id):
+    """自己的專案還在專案庫時重新開啟並回傳 True (別人的專案由呼叫端另外建立一份)"""
+    if not owns_project(project_id):
+        return False
+    on_click_open_project(project_id)
+    return True
+
+def load_project(project_id):
+    """把專案庫中的專案載入 session_state (不動背景工作)，依已有的文件決定停在哪個階段"""
+    store = project_store.store
+    project = store.get_project(project_id)
+    st.session_state.project_id = project_id
+    st.session_state.project_name = project["name"]
+    st.session_state.project_desc = project["description"]
+    st.session_state.full_requirements = project["full_requirements"]
+    st.session_state.questions = store.artifacts(project_id, "questions")
+    st.session_state.result_files = store.artifacts(project_id, "files")
+    st.session_state.structure_res = store.artifacts(project_id, "structure")
+    if st.session_state.result_files:
+        st.session_state.workflow_stage = 2
+    elif st.session_state.questions:
+        st.session_state.workflow_stage = 1
+    else:
+        st.session_state.workflow_stage = 0
+
+def new_project(project_name, project_desc):
+    st.session_state.project_id = project_store.store.create(project_name, project_desc, session_id)
+    return st.session_state.project_id
+
+def save_artifacts(kind, data):
+    """生成結果存進專案庫，session_state 只留 handle (還沒有專案就先建立)"""
+    if not st.session_state.project_id:
+        new_project(st.session_state.project_name, st.session_state.project_desc)
+    return project_store.store.save(st.session_state.project_id, kind, data)
+
+def restore_from_jobs():
+    """
+    重新連線 (新的 Streamlit session) 時，把同一個 session_id 最近的專案接回來：
+    工作 meta 記著專案 id，已經存進專案庫的結果直接從專案庫重新開啟 (包含 Stage 2 重新生成過的文件)；
+    只有結果還沒存進專案庫的工作才填回 token，讓 Stage 0 / Stage 1 的輪詢邏輯接手。
+    """
+    candidates = [j for j in (jobs.manager.latest(session_id, "interview"), jobs.manager.latest(session_id, "blueprint"))
+                  if j is not None]
+    if not candidates:
+        return
+    job = max(candidates, key=lambda j: j.created)
+    project_id = job.meta.get("project_id")
+    if project_id and project_store.store.get_project(project_id) is not None:
+        load_project(project_id)
+    elif job.kind == "interview":
+        st.session_state.project_name = job.meta.get("project_name")
+        st.session_state.project_desc = job.meta.get("project_desc")
+    else:
+        return
+    if job.kind == "interview" and not st.session_state.questions:
+        st.session_state.interview_token = job.token
+    elif job.kind == "blueprint" and not st.session_state.result_files:
+        st.session_state.blueprint_token = job.token
+        st.session_state.full_requirements = job.meta.get("full_requirements")
+
+def start_interview(api_key, draft=None, regenerate=False):
+    """
+    送出問卷工作；專案在這裡建立一次 (重試沿用同一個)，專案 id 記在工作的 meta。
+    regenerate=True：使用者在相似構想提示中選擇重新分析 (不使用快取的問卷)
+    """
+    created = None
+    if not st.session_state.project_id:
+        created = new_project(st.session_state.project_name, st.session_state.project_desc)
+    try:
+        job = pipeline.submit_interview(
+            session_id, st.session_state.project_name, st.session_state.project_desc, api_key, draft,
+            project_id=st.session_state.project_id, regenerate=regenerate,
+        )
+        # 相同的工作已經在進行：沿用它的專案，剛建立的空專案不需要
+        if job.meta.get("project_id") and job.meta["project_id"] != st.session_state.project_id:
+            if created:
+                project_store.store.delete(created)
+            st.session_state.project_id = job.meta["project_id"]
+        st.session_state.interview_token = job.token
+    except jobs.QueueFull as e:
+        st.error(str(e))
+
+def show_generation_error(result):
+    """生成失敗的提示；時間預算用完 (_deadline) 代表模型目前都很慢，提示稍後再試而不是設定有問題"""
+    if result.get("_deadline"):
+        st.warning(f"⏱️ {result['error']}，請稍後再試一次")
+    else:
+        st.error(result["error"])
+
+def show_queue_status(job):
+    """工作還沒開始生成時顯示排隊位置 (背景工作佇列，或是等待 API 額度)"""
+    position = jobs.manager.queue_position(job)
+    if position:
+        st.caption(f"🧵 排隊中：前面還有 {position - 1} 個工作")
+        return
+    position = rate_limiter.limiter.queue_position(session_id)
+    if position:
+        st.caption(f"🚦 等待 API 額度：目前排在第 {position} 位")
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+def render_admin_panel():
+    """管理者監控面板：各生成功能 / 模型的 p50、p95 延遲與 fallback 率 (ADMIN_PANEL = true 才顯示)"""
+    with st.expander("📈 效能監控"):
+        summary = telemetry.ring.summary()
+        if not summary["generators"]:
+            st.caption("尚無生成紀錄")
+        else:
+            st.markdown("**生成功能**")
+            st.dataframe([{
+                "功能": row["generator"], "次數": row["calls"],
+                "p50": _seconds(row["p50"]), "p95": _seconds(row["p95"]),
+                "fallback": f"{row['fallback_rate']:.0%}", "錯誤": f"{row['error_rate']:.0%}",
+                "快取": f"{row['cache_hit_rate']:.0%}",
+            } for row in summary["generators"]], hide_index=True)
+            st.markdown("**模型**")
+            st.dataframe([{
+                "模型": row["model"], "嘗試": row["attempts"], "成功率": f"{row['success_rate']:.0%}",
+                "p50": _seconds(row["p50"]), "p95": _seconds(row["p95"]),
+                "狀態": ", ".join(f"{k}×{v}" for k, v in row["statuses"].items()),
+            } for row in summary["models"]], hide_index=True)
+        cache_stats = engine.response_cache.cache.snapshot()
+        st.caption(f"🗃️ 回應快取：命中率 {cache_stats['hit_rate']:.0%}，{cache_stats['entries']} 筆")
+        limit_stats = rate_limiter.limiter.snapshot()
+        st.caption(f"🚦 限流{'' if limit_stats['limited'] else ' (未設定上限)'}：{limit_stats['keys']} 組 Key，排隊中 {limit_stats['waiting']}，"
+                   f"曾等待 {limit_stats['waited']} 次 (共 {limit_stats['wait_seconds']:.0f} 秒)，"
+                   f"改用其他模型 {limit_stats['rejected']} 次")
+        store_stats = project_store.store.snapshot()
+        st.caption(f"📚 專案庫：{store_stats['projects']} 個專案，讀取 {store_stats['reads']} 次 "
+                   f"(記憶體命中 {store_stats['cache_hits']})，寫入 {store_stats['writes']} 份 "
+                   f"(重複內容 {store_stats['dedup']})")
+        recovery = engine.recovery_snapshot()
+        st.caption(f"🩹 本機修復：省下 {recovery['avoided']} 次重新生成 "
+                   f"({', '.join(f'{k}×{v}' for k, v in recovery['by_kind'].items()) or '尚無'})")
+        timeouts = {m: engine.adaptive_timeout(m) for m in engine.model_health.registry.ordered(engine.MODEL_TIERS)[:3]}
+        st.caption("⏱️ 時間預算：" + "，".join(f"{k} {v:.0f}s" for k, v in engine.DEADLINES.items() if v)
+                   + "；單次逾時 " + "，".join(f"{m} {t:.0f}s" for m, t in timeouts.items()))
+        flight_stats = engine.single_flight.group.snapshot()
+        st.caption(f"🛫 合併請求：{flight_stats['calls']} 次呼叫只送出 {flight_stats['upstream']} 次 "
+                   f"(省下 {flight_stats['shared']} 次，進行中 {flight_stats['in_flight']})")
+        similar_stats = engine.similarity_index.index.snapshot()
+        st.caption(f"🔁 相似構想：{similar_stats['entries']} 筆，查詢 {similar_stats['queries']} 次，"
+                   f"找到 {similar_stats['matches']} 次")
+        job_stats = jobs.manager.metrics()
+        st.caption(f"🧵 工作：完成 {job_stats['done']}，失敗 {job_stats['failed']}，拒絕 {job_stats['rejected']}")
+
+# ==========================================
+# 👇 引擎設定：每個 process 只套用一次
+# ==========================================
+def secrets_version():
+    """secrets 檔案的修改時間：setup_engine 的快取 key (檔案改了才重新讀取設定，平常 rerun 只做幾次 stat)"""
+    stamps = []
+    for path in st.get_option("secrets.files"):
+        try:
+            stamps.append(os.path.getmtime(path))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+def engine_settings():
+    """從 secrets 整理出各元件的設定 (只在 setup_engine 內讀取一次)"""
+    secrets = st.secrets
+    settings = {
+        # 共用 HTTP 連線池大小 (keep-alive，所有 session 共用)
+        "pool": {"pool_size": secrets.get("HTTP_POOL_SIZE", None)},
+        # 競速模式 (選用)：RACE_FANOUT >= 2 時同時詢問多個模型，RACE_HEDGE_AFTER 秒後才補發備援
+        "racing": {"fanout": secrets.get("RACE_FANOUT", 0), "hedge_after": secrets.get("RACE_HEDGE_AFTER", None)},
+        # 共用限流 (選用)：RATE_LIMIT_RPM = 每組 Key 每個模型每分鐘請求數，超過就排隊
+        # (RATE_LIMIT_MAX_WAIT 秒內等不到才換模型)；沒設定時不限流
+        "rate_limit": {
+            "keys": list(secrets.get("GOOGLE_API_KEYS", [])),
+            "rpm": secrets.get("RATE_LIMIT_RPM", None),
+            "model_rpm": secrets.get("RATE_LIMIT_MODEL_RPM", None),
+            "burst": secrets.get("RATE_LIMIT_BURST", 5),
+            "max_wait": secrets.get("RATE_LIMIT_MAX_WAIT", 20),
+        },
+        # 回應快取：CACHE_BACKEND = memory / sqlite / dir
+        "cache": {
+            "backend": secrets.get("CACHE_BACKEND", "memory"),
+            "path": secrets.get("CACHE_PATH", None),
+            "ttl": secrets.get("CACHE_TTL", 24 * 3600),
+            "max_entries": secrets.get("CACHE_MAX_ENTRIES", 256),
+        },
+        # prompt 輸入的 token 預算 (選用)：CONTEXT_BUDGETS = {structure = 3000, blueprint = 4000}
+        "context": {"budgets": secrets.get("CONTEXT_BUDGETS", None),
+                    "model_budgets": secrets.get("CONTEXT_MODEL_BUDGETS", None)},
+        # 結構化輸出：STRUCTURED_OUTPUT = false 時改回一般文字回應 (本機修復仍然有效)
+        "structured": {"enabled": secrets.get("STRUCTURED_OUTPUT", True),
+                       "sections": secrets.get("STRUCTURED_SECTIONS", True)},
+        # 時間預算：TIMEOUT_DEADLINES = {interview = 45, blueprint = 240} (秒)，單次逾時依模型 p95 延遲自動調整
+        "timeouts": {
+            "deadlines": secrets.get("TIMEOUT_DEADLINES", None),
+            "min_timeout": secrets.get("TIMEOUT_MIN", None),
+            "max_timeout": secrets.get("TIMEOUT_MAX", None),
+            "multiplier": secrets.get("TIMEOUT_MULTIPLIER", None),
+        },
+        # 相同請求同時送出時共用一次上游呼叫 (SINGLE_FLIGHT = false 關閉)
+        "single_flight": {"enabled": secrets.get("SINGLE_FLIGHT", True)},
+        # 相似構想索引：相似度超過 SIMILARITY_THRESHOLD 時提供先前的問卷 / 藍圖
+        "similarity": {
+            "threshold": secrets.get("SIMILARITY_THRESHOLD", 0.6),
+            "max_entries": secrets.get("SIMILARITY_MAX_ENTRIES", 1000),
+            "max_age": secrets.get("SIMILARITY_MAX_AGE", 7 * 24 * 3600),
+        },
+        # 專案庫：生成的文件存在 PROJECT_STORE_PATH (SQLite + 壓縮檔)，session_state 只留 handle
+        "store": {"root": secrets.get("PROJECT_STORE_PATH", None), "cache_size": secrets.get("PROJECT_STORE_CACHE", 64)},
+        # 背景工作上限：同時執行數 / 排隊上限 / 每個 session 同時進行數
+        "jobs": {
+            "max_workers": secrets.get("JOB_WORKERS", 4),
+            "max_queue": secrets.get("JOB_MAX_QUEUE", 64),
+            "max_per_session": secrets.get("JOB_MAX_PER_SESSION", 3),
+        },
+        # 效能量測 (選用)：TELEMETRY_JSONL = 事件記錄檔路徑，METRICS_PORT = Prometheus /metrics 埠號
+        # (預設只聽 127.0.0.1，METRICS_HOST = "0.0.0.0" 才開放給其他機器)
+        "telemetry": {"jsonl": secrets.get("TELEMETRY_JSONL", None), "metrics_port": secrets.get("METRICS_PORT", None),
+                      "metrics_host": secrets.get("METRICS_HOST", "127.0.0.1")},
+    }
+    return settings
+
+@st.cache_resource(show_spinner=False)
+def setup_engine(version):
+    """
+    連線池、限流器、快取、專案庫、背景工作池都是整個 process 共用的物件：
+    secrets 檔案沒有變動 (version 相同) 就只讀取、套用一次，之後的 rerun 與新 session 直接沿用
+    """
+    import generator_engine as engine
+    import jobs
+    import project_store
+    import telemetry
+
+    settings = engine_settings()
+    engine.transport.configure_pool(**settings["pool"])
+    engine.configure_racing(**settings["racing"])
+    engine.configure_rate_limit(**settings["rate_limit"])
+    engine.configure_cache(**settings["cache"])
+    engine.configure_context(**settings["context"])
+    engine.configure_structured_output(**settings["structured"])
+    engine.configure_timeouts(**settings["timeouts"])
+    engine.configure_single_flight(**settings["single_flight"])
+    engine.configure_similarity(**settings["similarity"])
+    store = settings["store"]
+    project_store.configure(store["root"] or project_store.DEFAULT_ROOT, cache_size=store["cache_size"])
+    jobs.configure(**settings["jobs"])
+    telemetry.enable_jsonl(settings["telemetry"]["jsonl"])
+    if settings["telemetry"]["metrics_port"]:
+        telemetry.start_metrics_server(int(settings["telemetry"]["metrics_port"]), host=settings["telemetry"]["metrics_host"])
+    return settings
+
 # ==========================================
 # 👇 簡易登入系統
 # ==========================================
@@ -83,8 +410,22 @@ if not st.session_state.logged_in:
 
 else:
     # 🔓 解鎖後的主程式
-    api_key = st.secrets.get("GOOGLE_API_KEY", "")
-    engine.configure_genai(api_key)
+    import generator_engine as engine
+    import jobs
+    import pipeline
+    import project_store
+    import rate_limiter
+    import telemetry
+
+    setup_engine(secrets_version())
+    # 多組 API Key (選用)：GOOGLE_API_KEYS = ["key1", "key2", ...]，請求依剩餘額度分散到各組 Key
+    api_keys = list(st.secrets.get("GOOGLE_API_KEYS", []))
+    api_key = st.secrets.get("GOOGLE_API_KEY", "") or (api_keys[0] if api_keys else "")
+    if not st.session_state.jobs_restored:
+        # 每個 session 只做一次：記下 API Key、接回之前的背景工作
+        st.session_state.jobs_restored = True
+        engine.configure_genai(api_key)
+        restore_from_jobs()
 
     # ==========================================
     # 👇 側邊欄：功能中控台
@@ -92,6 +433,10 @@ else:
     with st.sidebar:
         st.success("歡迎光臨，軟體架構師")
         st.info("💡 模式：HTTP 直連 (雙語版)") 
+        st.toggle("⚡ 管線模式 (SPEC 完成即預先生成架構)", value=True, key="pipeline_mode")
+        st.toggle("🧩 平行模式 (四份文件各自同時生成)", value=False, key="parallel_mode")
+        job_stats = jobs.manager.metrics()
+        st.caption(f"🧵 背景工作：執行中 {job_stats['running']} / {job_stats['max_workers']}，排隊 {job_stats['queued']}")
         
         st.markdown("---")
         st.markdown("### 🛠️ 專案控制台")
@@ -107,15 +452,36 @@ else:
         
         # Button 3: 下載文件
         if st.session_state.workflow_stage == 2 and st.session_state.result_files:
-            zip_data = engine.create_zip_download(st.session_state.result_files)
-            st.download_button("3. 下載完整文件包 (.zip)", data=zip_data, file_name="project.zip", mime="application/zip")
+            # 打包結果依內容快取：rerun 時內容沒變就不會重新壓縮；架構圖產出也一併打包
+            fmt = st.selectbox("打包格式", list(engine.export_builder.FORMATS), key="export_format",
+                               format_func=lambda f: {"zip": "ZIP", "zip-store": "ZIP (不壓縮)", "tar.gz": "tar.gz"}[f])
+            mime, ext = engine.export_builder.FORMATS[fmt]
+            # 按下下載才讀取文件並打包 (平常 rerun 不必把整個專案載入)
+            files, structure = st.session_state.result_files, st.session_state.structure_res
+            st.download_button(f"3. 下載完整文件包 ({ext})", file_name=f"project{ext}", mime=mime,
+                               data=lambda: engine.create_zip_download(files, structure, fmt))
         else:
             st.button("3. 下載完整文件包 (.zip)", disabled=True, key="btn_dl_fake")
 
         # Button 4: 新專案
         st.markdown("---")
         st.button("🔄 開啟新專案", type="primary", on_click=on_click_reset)
+
+        # 專案庫：之前生成過的專案 (可搜尋名稱、構想與文件內容)，開啟不需要再呼叫 API
+        with st.expander("📚 專案庫"):
+            query = st.text_input("搜尋", key="project_query", placeholder="名稱、構想或文件內容")
+            projects = project_store.store.list_projects(query, limit=10, session_id=session_id)
+            if not projects:
+                st.caption("找不到專案" if query else "尚無專案")
+            for project in projects:
+                updated = time.strftime("%m/%d %H:%M", time.localtime(project["updated"]))
+                st.button(f"{project['name']} · {updated}", key=f"open_{project['id']}",
+                          help=project["description"][:200], on_click=on_click_open_project, args=(project["id"],),
+                          disabled=project["id"] == st.session_state.project_id)
         
+        if st.secrets.get("ADMIN_PANEL", False):
+            render_admin_panel()
+
         # 登出放在最下面
         st.markdown("---")
         if st.button("🔒 登出系統"):
@@ -135,6 +501,8 @@ else:
     # 🔄 智慧引導流程 (Main Workflow)
     # ----------------------------------------------------
 
+    needs_poll = False  # 有背景工作還沒完成時，畫面畫完後再輪詢
+
     # === Stage 0: 構想輸入 ===
     if st.session_state.workflow_stage == 0:
         st.info("👋 歡迎！請在下方告訴我您的初步構想，我會協助您釐清規格。")
@@ -146,16 +514,55 @@ else:
                                   value="我想做一個網站，可以自動把文章變成中英對照的電子書，還要有語音朗讀功能。")
             
             if st.form_submit_button("🤖 開始諮詢 (AI 分析需求)"):
-                with st.spinner("正在分析您的點子並設計問卷..."):
-                    questions = engine.generate_interview_questions(p_name, p_desc)
-                    if "error" in questions:
-                        st.error(questions["error"])
-                    else:
-                        st.session_state.project_name = p_name
-                        st.session_state.project_desc = p_desc
-                        st.session_state.questions = questions
-                        st.session_state.workflow_stage = 1
-                        st.rerun()
+                st.session_state.project_name = p_name
+                st.session_state.project_desc = p_desc
+                # 先找相似的先前構想，有的話讓使用者選擇沿用、當草稿或忽略
+                st.session_state.similar_offer = engine.find_similar_project(p_name, p_desc, owner=session_id)
+                if not st.session_state.similar_offer:
+                    start_interview(api_key)
+
+        if st.session_state.similar_choice:
+            choice = st.session_state.similar_choice
+            offer = st.session_state.similar_offer
+            st.session_state.similar_choice = None
+            st.session_state.similar_offer = None
+            start_interview(api_key, offer["results"].get("interview") if choice == "draft" else None, regenerate=True)
+
+        offer = st.session_state.similar_offer
+        if offer:
+            results = offer["results"]
+            st.info(f"🔁 找到相似的先前構想「{offer['project_name']}」(相似度 {offer['similarity']:.0%})")
+            st.caption(offer["project_desc"])
+            c1, c2, c3, c4 = st.columns(4)
+            c1.button("⚡ 直接使用先前的問卷", disabled="interview" not in results,
+                      on_click=on_click_similar, args=("reuse",))
+            c2.button("📄 開啟先前的藍圖", disabled="blueprint" not in results,
+                      on_click=on_click_similar, args=("open",))
+            c3.button("✏️ 以它為草稿重新分析", disabled="interview" not in results,
+                      on_click=on_click_similar, args=("draft",))
+            c4.button("🆕 忽略，重新分析", on_click=on_click_similar, args=("fresh",))
+
+        job = jobs.manager.get(session_id, st.session_state.interview_token) if st.session_state.interview_token else None
+        if job is not None:
+            if not job.is_finished():
+                st.info("⏳ 正在分析您的點子並設計問卷...")
+                show_queue_status(job)
+                needs_poll = True
+            else:
+                st.session_state.interview_token = None
+                questions = job.result or {"error": job.error or "問卷生成已取消"}
+                if "error" in questions:
+                    show_generation_error(questions)
+                else:
+                    # 專案在送出工作時就建立了；結果存進同一個專案
+                    st.session_state.project_id = job.meta.get("project_id") or st.session_state.project_id
+                    st.session_state.questions = save_artifacts("questions", questions)
+                    engine.remember_interview(st.session_state.project_name, st.session_state.project_desc,
+                                              questions, owner=session_id)
+                    engine.remember_project(st.session_state.project_name, st.session_state.project_desc,
+                                            st.session_state.project_id, owner=session_id)
+                    st.session_state.workflow_stage = 1
+                    st.rerun()
 
     # === Stage 1: AI 訪談問卷 ===
     elif st.session_state.workflow_stage == 1:
@@ -168,57 +575,147 @@ else:
         c_q1, c_q2, c_q3 = st.columns(3)
         with c_q1:
             st.markdown(f"**🔹 前端/介面：**\n{q_data.get('q_frontend', '無問題')}")
-            st.text_area("您的回答 (Frontend)", key="ans_fe", height=150)
+            st.text_area("您的回答 (Frontend)", key="ans_fe", height=150, on_change=on_answer_change)
         with c_q2:
             st.markdown(f"**🔹 後端/邏輯：**\n{q_data.get('q_backend', '無問題')}")
-            st.text_area("您的回答 (Backend)", key="ans_be", height=150)
+            st.text_area("您的回答 (Backend)", key="ans_be", height=150, on_change=on_answer_change)
         with c_q3:
             st.markdown(f"**🔹 資料/儲存：**\n{q_data.get('q_database', '無問題')}")
-            st.text_area("您的回答 (Database)", key="ans_db", height=150)
+            st.text_area("您的回答 (Database)", key="ans_db", height=150, on_change=on_answer_change)
             
-        # 觸發邏輯
+        # 觸發邏輯：送出背景工作 (管線模式會在 SPEC 完成時自動送出架構工作)
         if st.session_state.trigger_blueprint:
+            st.session_state.trigger_blueprint = False
             ans_fe = st.session_state.get("ans_fe", "")
             ans_be = st.session_state.get("ans_be", "")
             ans_db = st.session_state.get("ans_db", "")
             
-            full_req = f"""
-            專案名稱：{st.session_state.project_name}
-            原始構想：{st.session_state.project_desc}
-            【訪談回答】：
-            1. 前端：{ans_fe}
-            2. 後端：{ans_be}
-            3. 資料庫：{ans_db}
-            """
-            with st.spinner("AI 正在根據訪談結果撰寫規格書 (這可能需要 30 秒)..."):
-                res = engine.generate_blueprint(full_req)
-                if "error" in res:
-                    st.error(res["error"])
-                    st.session_state.trigger_blueprint = False
-                else:
-                    st.session_state.result_files = res
-                    st.session_state.workflow_stage = 2
-                    st.session_state.trigger_blueprint = False
-                    st.rerun()
+            full_req = pipeline.build_requirements(
+                st.session_state.project_name, st.session_state.project_desc, ans_fe, ans_be, ans_db
+            )
+            try:
+                job = pipeline.submit_blueprint(
+                    session_id, full_req, api_key, st.session_state.pipeline_mode, st.session_state.parallel_mode,
+                    project_id=st.session_state.project_id,
+                )
+                st.session_state.blueprint_token = job.token
+                st.session_state.full_requirements = full_req
+            except jobs.QueueFull as e:
+                st.error(str(e))
+
+        job = jobs.manager.get(session_id, st.session_state.blueprint_token) if st.session_state.blueprint_token else None
+        if job is not None and not job.is_finished():
+            # 串流內容一邊生成一邊顯示，每個檔案收完就標示完成
+            st.markdown("---")
+            st.markdown("### ✍️ 規格書即時生成中...")
+            show_queue_status(job)
+            progress = job.progress
+            files = progress.get("files", {})
+            completed = progress.get("completed", [])
+            for tab, fname in zip(st.tabs(["README", "SPEC", "REPORT", "TODO"]), engine.BLUEPRINT_FILES):
+                with tab:
+                    if fname in completed:
+                        st.caption("✅ 完成")
+                    elif fname in files:
+                        st.caption("⏳ 生成中...")
+                    else:
+                        st.caption("⌛ 等待中")
+                    if fname in files:
+                        st.markdown(files[fname])
+            needs_poll = True
+        elif job is not None:
+            st.session_state.blueprint_token = None
+            res = job.result or {"error": job.error or "藍圖生成已取消"}
+            if "error" in res:
+                show_generation_error(res)
+            else:
+                st.session_state.project_id = job.meta.get("project_id") or st.session_state.project_id
+                engine.remember_blueprint(st.session_state.project_name, st.session_state.project_desc,
+                                          st.session_state.full_requirements, res, st.session_state.project_id,
+                                          owner=session_id)
+                st.session_state.result_files = save_artifacts("files", res)
+                project_store.store.set_requirements(st.session_state.project_id, st.session_state.full_requirements)
+                st.session_state.workflow_stage = 2
+                st.rerun()
 
     # === Stage 2: 結果展示 ===
     elif st.session_state.workflow_stage == 2:
         res = st.session_state.result_files
         
         st.subheader("📄 規格藍圖預覽")
-        t1, t2, t3, t4 = st.tabs(["README", "SPEC", "REPORT", "TODO"])
-        with t1: st.markdown(res.get("README.md", ""))
-        with t2: st.markdown(res.get("SPEC.md", ""))
-        with t3: st.markdown(res.get("REPORT.md", ""))
-        with t4: st.markdown(res.get("TODOLIST.md", ""))
+        if res.get("_cache_hit"):
+            st.caption("⚡ 快取命中：相同需求先前已生成過，未消耗 API 額度")
+        if res.get("_race"):
+            race = res["_race"]
+            st.caption(f"🏁 競速模式：{race['winner']} 勝出 (耗時 {race['wall_time']} 秒，約節省 {race['saved']} 秒)")
+
+        # 單一文件重新生成：只重做這一份，其他文件與架構圖不受影響
+        full_req = st.session_state.full_requirements
+        if st.session_state.trigger_document:
+            name = st.session_state.trigger_document
+            st.session_state.trigger_document = None
+            try:
+                pipeline.submit_document(session_id, full_req, name, api_key)
+            except jobs.QueueFull as e:
+                st.error(str(e))
+
+        # 先採用已完成的單一文件工作 (只更新那一份，不必讀取其他文件)
+        regenerating = set()
+        for fname in engine.BLUEPRINT_FILES:
+            d_job = jobs.manager.get(session_id, pipeline.document_token(full_req, fname)) if full_req else None
+            if d_job is None:
+                continue
+            if not d_job.is_finished():
+                regenerating.add(fname)
+                continue
+            jobs.manager.discard(session_id, d_job.token)
+            d_res = d_job.result or {"error": d_job.error or "重新生成已取消"}
+            if "error" in d_res:
+                show_generation_error(d_res)
+            else:
+                meta = {k: v for k, v in res.meta.items() if k not in ("_cache_hit", "_errors")}
+                errors = {k: v for k, v in res.get("_errors", {}).items() if k != fname}
+                if errors:
+                    meta["_errors"] = errors
+                res = save_artifacts("files", {fname: d_res[fname], **meta})
+                st.session_state.result_files = res
+
+        # 一次只顯示 (也只讀取) 選取的文件
+        labels = dict(zip(engine.BLUEPRINT_FILES, ["README", "SPEC", "REPORT", "TODO"]))
+        fname = st.radio("文件", engine.BLUEPRINT_FILES, key="doc_view", horizontal=True, label_visibility="collapsed",
+                         format_func=lambda f: labels[f] + (" ⏳" if f in regenerating else ""))
+        if fname in regenerating:
+            st.info(f"⏳ {fname} 重新生成中...")
+            show_queue_status(jobs.manager.get(session_id, pipeline.document_token(full_req, fname)))
+        if regenerating:
+            needs_poll = True
+        if res.get(fname, "").startswith("⚠️"):
+            st.warning("這份文件生成遺失，可以按下方按鈕單獨重新生成")
+        st.markdown(res.get(fname, ""))
+        st.button("🔄 重新生成這份文件", key=f"regen_{fname}", disabled=not full_req or fname in regenerating,
+                  on_click=on_click_regenerate, args=(fname,))
         
+        # 架構工作的 token 由 README + SPEC 決定：管線模式預先送出的工作會直接被沿用
         if st.session_state.trigger_structure:
-            with st.spinner("正在繪製架構圖..."):
-                context = res.get("README.md", "") + "\n" + res.get("SPEC.md", "")
-                struct_res = engine.generate_structure(context)
-                st.session_state.structure_res = struct_res
-                st.session_state.trigger_structure = False
-                st.rerun()
+            st.session_state.trigger_structure = False
+            existing = jobs.manager.get(session_id, pipeline.structure_token(res))
+            try:
+                pipeline.submit_structure(
+                    session_id, res, api_key,
+                    regenerate=existing is not None and existing.is_finished() and bool(st.session_state.structure_res),
+                )
+                st.session_state.structure_res = None
+            except jobs.QueueFull as e:
+                st.error(str(e))
+
+        s_job = jobs.manager.get(session_id, pipeline.structure_token(res))
+        if s_job is not None and not st.session_state.structure_res:
+            if not s_job.is_finished():
+                st.info("⏳ 架構圖生成中，完成後會自動顯示...")
+                show_queue_status(s_job)
+                needs_poll = True
+            elif s_job.status == jobs.DONE and s_job.result:
+                st.session_state.structure_res = save_artifacts("structure", s_job.result)
         
         if st.session_state.get("structure_res"):
             st.markdown("---")
@@ -239,3 +736,6 @@ else:
                         st.markdown(f"```mermaid\n{mermaid}\n```")
                     else:
                         st.warning("流程圖生成失敗")
+
+    if needs_poll:
+        poll_job_later()
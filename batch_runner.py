@@ -0,0 +1,391 @@
+"""
+批次模式：不經過網頁介面，一次替大量專案構想產生藍圖。
+
+每個專案依序跑 問卷 -> 藍圖 -> 架構 (generator_engine)，多個專案同時進行 (--concurrency)。
+輸入 JSONL 或 CSV，欄位：name, description, 以及選填的 frontend / backend / database 回答。
+沒填的回答交給 AI 依需求自行決定。問卷預設不跑 (批次模式沒有人回答)；
+加上 --with-questions 時會產生問卷，沒填的欄位把問題一併寫進需求，讓藍圖照著問卷的面向處理。
+
+輸出：
+    <out>/<專案 id>/README.md ... FLOW.mermaid、state.json (每個階段完成就寫入)、questions.json (--with-questions)
+    <out>/checkpoint.jsonl   每個完成 / 失敗的專案一行；重新執行時已完成的專案直接略過
+    <out>/summary.json       吞吐量與各階段延遲
+
+用法：
+    GOOGLE_API_KEY=... python batch_runner.py ideas.jsonl --out batch_out --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import export_builder
+import generator_engine as engine
+import pipeline
+import rate_limiter
+import section_parser
+import telemetry
+import transport
+
+DEFAULT_ANSWER = "(未指定，請依專案需求自行決定最合適的方案)"
+STAGES = ("interview", "blueprint", "structure")
+CHECKPOINT_FILE = "checkpoint.jsonl"
+
+
+class StageFailed(Exception):
+    """某個生成階段回傳了錯誤結果"""
+
+
+# ==========================================
+# 👇 讀取輸入
+# ==========================================
+def _normalize(row):
+    name = (row.get("name") or row.get("project_name") or "").strip()
+    desc = (row.get("description") or row.get("project_desc") or "").strip()
+    if not name or not desc:
+        return None
+    return {
+        "name": name,
+        "description": desc,
+        "answers": {k: (row.get(k) or "").strip() for k in ("frontend", "backend", "database")},
+    }
+
+
+def load_projects(path):
+    """讀取 JSONL / CSV；缺少名稱或描述的列會被略過"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    projects = [p for p in (_normalize(row) for row in rows) if p]
+    for project in projects:
+        project["id"] = project_id(project["name"], project["description"])
+    return projects
+
+
+def project_id(name, description):
+    """資料夾名稱：可讀的名稱 + 內容雜湊 (同名不同構想不會互相覆蓋)"""
+    slug = re.sub(r"[^\w\-]+", "-", name, flags=re.UNICODE).strip("-")[:40] or "project"
+    digest = hashlib.sha256(f"{name}\0{description}".encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}"
+
+
+# ==========================================
+# 👇 狀態與 checkpoint
+# ==========================================
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _load_state(project_dir):
+    try:
+        with open(os.path.join(project_dir, "state.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_checkpoint(out_dir):
+    """已經成功完成的專案 id"""
+    done = set()
+    try:
+        with open(os.path.join(out_dir, CHECKPOINT_FILE), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 上次中斷時寫到一半的行
+                if record.get("status") == "ok":
+                    done.add(record["id"])
+    except OSError:
+        pass
+    return done
+
+
+# ==========================================
+# 👇 單一專案
+# ==========================================
+def _check(kind, result):
+    if "error" in result:
+        raise StageFailed(f"{kind}: {result['error']}")
+    if kind == "structure" and str(result.get("STRUCTURE.txt", "")).startswith(("Error:", "Key Error")):
+        raise StageFailed(f"structure: {result['STRUCTURE.txt']}")
+    return result
+
+
+def _unanswered(question):
+    """沒填的回答交給 AI 決定；有問卷時附上問題"""
+    return f"{DEFAULT_ANSWER}，請特別考量：{question}" if question else DEFAULT_ANSWER
+
+
+def _output_path(project_dir, name):
+    """專案資料夾內的輸出路徑；檔名來自模型回應，不是單純檔名或解析後跑到資料夾外就拒絕寫入"""
+    root = os.path.realpath(project_dir)
+    path = os.path.realpath(os.path.join(root, name))
+    if not section_parser.is_safe_name(name) or not path.startswith(root + os.sep):
+        raise StageFailed(f"export: 不安全的檔名 {name!r}")
+    return path
+
+
+def _project_steps(project, out_dir, archive=None, with_questions=False):
+    """
+    一個專案的流程 (同步與 asyncio 版本共用)：需要呼叫模型時 yield (階段, 參數)，由執行端送回生成結果。
+    每個階段完成就寫入 state.json，中斷後重新執行會從上次完成的階段接著做。最後 return checkpoint 紀錄。
+    """
+    project_dir = os.path.join(out_dir, project["id"])
+    os.makedirs(project_dir, exist_ok=True)
+    state = _load_state(project_dir)
+    state.setdefault("project", {k: project[k] for k in ("name", "description", "answers")})
+    timings = state.setdefault("timings", {})
+
+    def save():
+        _write_atomic(os.path.join(project_dir, "state.json"), json.dumps(state, ensure_ascii=False, indent=2))
+
+    answers = dict(project["answers"])
+    if with_questions and "questions" not in state:
+        started = time.monotonic()
+        if all(answers.values()):
+            state["questions"] = None  # 回答都有了，不需要問卷
+        else:
+            state["questions"] = _check("interview", (yield "interview", (project["name"], project["description"])))
+        timings["interview"] = round(time.monotonic() - started, 3)
+        save()
+    questions = state.get("questions") or {}
+    if questions:
+        _write_atomic(os.path.join(project_dir, "questions.json"),
+                      json.dumps(questions, ensure_ascii=False, indent=2))
+
+    if "blueprint" not in state:
+        requirements = pipeline.build_requirements(project["name"], project["description"], *(
+            answers[field] or _unanswered(questions.get(f"q_{field}")) for field in ("frontend", "backend", "database")
+        ))
+        started = time.monotonic()
+        state["blueprint"] = _check("blueprint", (yield "blueprint", (requirements,)))
+        timings["blueprint"] = round(time.monotonic() - started, 3)
+        save()
+
+    if "structure" not in state:
+        started = time.monotonic()
+        state["structure"] = _check("structure", (yield "structure", (pipeline.structure_context(state["blueprint"]),)))
+        timings["structure"] = round(time.monotonic() - started, 3)
+        save()
+
+    files = export_builder.collect_files(state["blueprint"], state["structure"])
+    for name, content in files.items():
+        _write_atomic(_output_path(project_dir, name), content)
+    if archive:
+        ext = export_builder.FORMATS[archive][1]
+        export_builder.builder.write(os.path.join(project_dir, f"{project['id']}{ext}"), files, archive)
+
+    return {
+        "id": project["id"], "name": project["name"], "status": "ok",
+        "model": state["blueprint"].get("_model_used"), "timings": timings,
+        "latency": round(sum(timings.values()), 3), "files": len(files),
+    }
+
+
+def run_project(project, out_dir, api_key, archive=None, parallel=False, with_questions=False):
+    """跑完一個專案的各個階段 (with_questions=True 時才產生問卷)，回傳 checkpoint 紀錄"""
+    generators = {
+        "interview": engine.generate_interview_questions,
+        "blueprint": engine.generate_blueprint_parallel if parallel else engine.generate_blueprint,
+        "structure": engine.generate_structure,
+    }
+    steps = _project_steps(project, out_dir, archive, with_questions)
+    result = None
+    while True:
+        try:
+            stage, args = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        result = generators[stage](*args, api_key=api_key)
+
+
+async def arun_project(project, out_dir, api_key, archive=None, with_questions=False):
+    """
+    run_project 的 asyncio 版本：等待模型回應時不佔用 thread，一個 event loop 就能同時跑大量專案。
+    藍圖以單一請求生成 (不支援 parallel)。
+    """
+    generators = {
+        "interview": engine.agenerate_interview_questions,
+        "blueprint": engine.agenerate_blueprint,
+        "structure": engine.agenerate_structure,
+    }
+    steps = _project_steps(project, out_dir, archive, with_questions)
+    result = None
+    while True:
+        try:
+            stage, args = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        result = await generators[stage](*args, api_key=api_key)
+
+
+# ==========================================
+# 👇 批次執行
+# ==========================================
+def _percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]  # noqa: E731
+    return {"p50": pick(50), "p95": pick(95), "max": ordered[-1]}
+
+
+def _failed(project, error):
+    return {"id": project["id"], "name": project["name"], "status": "failed", "error": transport.redact(error)}
+
+
+async def _arun_all(pending, out_dir, api_key, concurrency, archive, with_questions, record):
+    """asyncio 模式：最多 concurrency 個專案同時在途，全部在同一個 thread 的 event loop 上"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def work(project):
+        async with semaphore:
+            try:
+                with rate_limiter.session(project["id"]):
+                    return await arun_project(project, out_dir, api_key, archive, with_questions)
+            except Exception as e:
+                return _failed(project, e)
+
+    try:
+        for finished in asyncio.as_completed([work(project) for project in pending]):
+            record(await finished)
+    finally:
+        await transport.close_async_client()
+
+
+def run_batch(projects, out_dir, api_key, concurrency=4, archive=None, progress=None, parallel=False,
+              with_questions=False, use_async=False):
+    """
+    concurrency：同時進行的專案數 (每個專案一次只有一個請求在途；parallel=True 時藍圖階段最多四個)。
+    with_questions：先產生問卷，沒填的回答改以問卷的問題引導藍圖。
+    use_async：改用 asyncio + aiohttp，等待回應時不佔用 thread (concurrency 可以設得比 thread 數大很多)。
+    progress(record, finished, total)：每個專案結束時呼叫。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    done = load_checkpoint(out_dir)
+    pending = [p for p in projects if p["id"] not in done]
+    checkpoint_lock = threading.Lock()
+    records = []
+    started = time.monotonic()
+
+    def record(entry):
+        with checkpoint_lock:
+            with open(os.path.join(out_dir, CHECKPOINT_FILE), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            records.append(entry)
+            if progress:
+                progress(entry, len(records), len(pending))
+
+    def work(project):
+        try:
+            # 以專案為單位公平排隊，避免少數專案的重試把額度吃光
+            with rate_limiter.session(project["id"]):
+                return run_project(project, out_dir, api_key, archive, parallel, with_questions)
+        except Exception as e:
+            return _failed(project, e)
+
+    if use_async:
+        if parallel:
+            raise ValueError("asyncio 模式不支援 parallel")
+        asyncio.run(_arun_all(pending, out_dir, api_key, concurrency, archive, with_questions, record))
+        return _summary(projects, pending, records, concurrency, started, out_dir)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch")
+    try:
+        futures = [pool.submit(work, project) for project in pending]
+        for future in as_completed(futures):
+            record(future.result())
+    except KeyboardInterrupt:
+        # 已完成的專案都寫進 checkpoint 了，下次執行會接著做
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return _summary(projects, pending, records, concurrency, started, out_dir)
+
+
+def _summary(projects, pending, records, concurrency, started, out_dir):
+    wall_time = time.monotonic() - started
+    ok = [r for r in records if r["status"] == "ok"]
+    summary = {
+        "total": len(projects),
+        "skipped": len(projects) - len(pending),
+        "ok": len(ok),
+        "failed": len(records) - len(ok),
+        "concurrency": concurrency,
+        "wall_time": round(wall_time, 3),
+        "throughput_per_min": round(len(ok) / wall_time * 60, 2) if wall_time else None,
+        "latency": _percentiles([r["latency"] for r in ok]),
+        "stages": {stage: _percentiles([r["timings"][stage] for r in ok if stage in r["timings"]]) for stage in STAGES},
+        "models": telemetry.ring.summary()["models"],
+        "failures": [{"id": r["id"], "error": r["error"]} for r in records if r["status"] != "ok"],
+    }
+    _write_atomic(os.path.join(out_dir, "summary.json"), json.dumps(summary, ensure_ascii=False, indent=2))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="專案清單 (.jsonl 或 .csv)")
+    parser.add_argument("--out", default="batch_out", help="輸出資料夾")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY", ""), help="預設讀取環境變數 GOOGLE_API_KEY")
+    parser.add_argument("--api-keys", default=os.environ.get("GOOGLE_API_KEYS", ""),
+                        help="多組 API Key (逗號分隔，預設讀取環境變數 GOOGLE_API_KEYS)")
+    parser.add_argument("--rpm", type=int, default=rate_limiter.DEFAULT_RPM,
+                        help="每組 Key 每個模型每分鐘請求數 (預設不限流)")
+    parser.add_argument("--parallel", action="store_true", help="藍圖的四份文件各自一個請求同時生成")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="改用 asyncio 同時進行所有專案 (等待回應時不佔用 thread；需要 aiohttp，不支援 --parallel)")
+    parser.add_argument("--with-questions", action="store_true",
+                        help="先產生問卷，沒填的回答改以問卷的問題引導藍圖 (每個專案多一次請求)")
+    parser.add_argument("--archive", choices=sorted(export_builder.FORMATS), help="另外打包成壓縮檔")
+    parser.add_argument("--cache", default="sqlite", choices=["memory", "sqlite", "dir"], help="回應快取後端")
+    parser.add_argument("--cache-path", help="快取檔案 / 資料夾 (預設放在輸出資料夾內)")
+    parser.add_argument("--base-url", help="改用其他 API 位址 (例如 benchmarks/mock_gemini_server.py)")
+    parser.add_argument("--pool-size", type=int, help="HTTP 連線池大小 (預設至少等於 concurrency)")
+    args = parser.parse_args(argv)
+
+    api_keys = [k.strip() for k in args.api_keys.split(",") if k.strip()]
+    args.api_key = args.api_key or (api_keys[0] if api_keys else "")
+    if not args.api_key:
+        parser.error("缺少 API Key：請設定 GOOGLE_API_KEY 或使用 --api-key")
+    if args.use_async and args.parallel:
+        parser.error("--async 不支援 --parallel")
+    projects = load_projects(args.input)
+    if not projects:
+        parser.error("輸入檔沒有任何有效的專案 (需要 name 與 description 欄位)")
+
+    os.makedirs(args.out, exist_ok=True)
+    transport.configure_pool(pool_size=max(args.pool_size or 0, args.concurrency, 1), base_url=args.base_url)
+    cache_path = args.cache_path
+    if cache_path is None and args.cache != "memory":
+        cache_path = os.path.join(args.out, "response_cache.sqlite3" if args.cache == "sqlite" else ".response_cache")
+    engine.configure_cache(backend=args.cache, path=cache_path)
+    engine.configure_rate_limit(keys=api_keys, rpm=args.rpm)
+
+    def progress(record, finished, total):
+        mark = "✅" if record["status"] == "ok" else "❌"
+        detail = f"{record['latency']}s" if record["status"] == "ok" else record["error"]
+        print(f"[{finished}/{total}] {mark} {record['name']} ({detail})", file=sys.stderr, flush=True)
+
+    summary = run_batch(projects, args.out, args.api_key, args.concurrency, args.archive, progress, args.parallel,
+                        args.with_questions, args.use_async)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+generator_engine 的離線基準測試 (搭配 mock_gemini_server，不耗真實額度)
+
+涵蓋：
+- fallback：前 N 個模型回 503 時 call_gemini_api_robust 的成本 (cold = 健康度登錄表清空，warm = 登錄表已記住)
+- generators：generate_interview_questions / generate_blueprint / generate_blueprint_stream / generate_structure 端到端
+- parsing：section_parser (同 bench_section_parser.py)
+- export：create_zip_download (cold = 新的打包快取，warm = 內容未變)
+
+用法：
+    python benchmarks/bench_engine.py --repeat 10 --latency const:0.02 --output bench.json
+    python benchmarks/bench_engine.py --baseline bench.json --tolerance 0.25   # p50 變慢超過 25% 時 exit 1
+結果以 JSON 輸出到 stdout (或 --output 指定的檔案)。
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_section_parser  # noqa: E402
+import export_builder  # noqa: E402
+import generator_engine as engine  # noqa: E402
+import model_health  # noqa: E402
+import rate_limiter  # noqa: E402
+import response_cache  # noqa: E402
+import transport  # noqa: E402
+from mock_gemini_server import MockGeminiServer  # noqa: E402
+
+API_KEY = "mock-key"
+REQUIREMENTS = (
+    "專案：雙語電子書產生器\n構想：把網路文章轉成中英對照電子書\n"
+    "前端：網頁版，支援手機\n後端：Python API\n資料庫：PostgreSQL\n"
+)
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]  # noqa: E731
+    return {
+        "n": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 6),
+        "p50": round(pick(50), 6),
+        "p95": round(pick(95), 6),
+        "min": round(ordered[0], 6),
+        "max": round(ordered[-1], 6),
+    }
+
+
+def _timed(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def _fresh_state():
+    """每次量測都從同樣的起點開始：沒有快取、登錄表沒有任何紀錄、限流器不限流且沒有排隊或暫停"""
+    response_cache.cache.clear()
+    model_health.registry.reset()
+    rate_limiter.configure(rpm=None).reset()
+
+
+def bench_fallback(server, depths, repeat):
+    results = []
+    for depth in depths:
+        failing = engine.MODEL_CANDIDATES[:depth]
+        server.faults = {model: {"status": 503, "rate": 1.0} for model in failing}
+        call = lambda: engine.call_gemini_api_robust("ping", API_KEY)  # noqa: E731
+
+        server.reset_stats()
+        cold = _timed(call, repeat, setup=model_health.registry.reset)
+        cold_requests = sum(sum(s.values()) for s in server.snapshot().values())
+
+        model_health.registry.reset()
+        call()
+        server.reset_stats()
+        warm = _timed(call, repeat)
+        warm_requests = sum(sum(s.values()) for s in server.snapshot().values())
+
+        results.append({
+            "failing_models": depth,
+            "cold": cold,
+            "warm": warm,
+            "requests_per_call": {"cold": cold_requests / repeat, "warm": warm_requests / repeat},
+        })
+    server.faults = {}
+    return results
+
+
+def bench_generators(repeat):
+    context = REQUIREMENTS * 4
+
+    def stream():
+        for state in engine.generate_blueprint_stream(REQUIREMENTS, api_key=API_KEY):
+            if state["done"]:
+                return state["result"]
+
+    cases = {
+        "interview": lambda: engine.generate_interview_questions("電子書", "中英對照", api_key=API_KEY),
+        "blueprint": lambda: engine.generate_blueprint(REQUIREMENTS, api_key=API_KEY),
+        "blueprint_stream": stream,
+        "structure": lambda: engine.generate_structure(context, api_key=API_KEY),
+    }
+    results = {}
+    for name, fn in cases.items():
+        result = fn()
+        if "error" in result or str(result.get("STRUCTURE.txt", "")).startswith("Error"):
+            raise RuntimeError(f"{name} 失敗: {result}")
+        results[name] = {"cold": _timed(fn, repeat, setup=_fresh_state), "cached": _timed(fn, repeat)}
+    return results
+
+
+def bench_export(sizes, repeat):
+    results = []
+    for size_kb in sizes:
+        text = bench_section_parser.synthetic_response(size_kb, extra_files=0)
+        files = {name: content for name, content in
+                 ((n, text[s:e]) for n, s, e in engine.section_parser.iter_sections(text))}
+        structure = {k: files.pop(k) for k in engine.STRUCTURE_FILES}
+        row = {"size_kb": size_kb}
+        for fmt in ("zip", "zip-store", "tar.gz"):
+            def fresh_builder():
+                export_builder.builder = export_builder.ExportBuilder()
+            build = lambda: engine.create_zip_download(files, structure, fmt)  # noqa: E731
+            row[fmt] = {"cold": _timed(build, repeat, setup=fresh_builder), "warm": _timed(build, repeat)}
+        results.append(row)
+    return results
+
+
+def run(args):
+    server = MockGeminiServer(
+        latency=args.latency, response_kb=args.response_kb, chunk_chars=args.chunk_chars, seed=args.seed,
+    ).start()
+    previous_base = transport.POOL_SETTINGS["base_url"]
+    transport.configure_pool(base_url=server.base_url)
+    response_cache.configure(backend="memory")
+    try:
+        report = {
+            "benchmark": "engine",
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {
+                "repeat": args.repeat, "latency": args.latency, "response_kb": args.response_kb,
+                "chunk_chars": args.chunk_chars,
+            },
+            "fallback": bench_fallback(server, args.fallback_depths, args.repeat),
+            "generators": bench_generators(args.repeat),
+            "parsing": bench_section_parser.run(args.parse_sizes, args.repeat)["results"],
+            "export": bench_export(args.export_sizes, args.repeat),
+        }
+    finally:
+        transport.configure_pool(base_url=previous_base)
+        server.stop()
+    return report
+
+
+def _flatten(node, prefix=""):
+    """把報告攤平成 {"路徑": p50}，用來和 baseline 比較"""
+    flat = {}
+    if isinstance(node, dict):
+        if "p50" in node and "n" in node:
+            flat[prefix] = node["p50"]
+            return flat
+        for key, value in node.items():
+            flat.update(_flatten(value, f"{prefix}/{key}" if prefix else str(key)))
+    elif isinstance(node, list):
+        for item in node:
+            label = next((f"{k}={item[k]}" for k in ("failing_models", "size_kb") if isinstance(item, dict) and k in item), None)
+            flat.update(_flatten(item, f"{prefix}[{label}]" if label else prefix))
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    """p50 比 baseline 慢超過 tolerance (比例) 的項目"""
+    current, previous = _flatten(report), _flatten(baseline)
+    regressions = []
+    for key, value in sorted(current.items()):
+        before = previous.get(key)
+        if before and value > before * (1 + tolerance):
+            regressions.append({"metric": key, "baseline_p50": before, "p50": value, "ratio": round(value / before, 2)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", default="const:0.01", help="假伺服器延遲分布 (見 mock_gemini_server.py)")
+    parser.add_argument("--response-kb", type=float, default=16)
+    parser.add_argument("--chunk-chars", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fallback-depths", type=int, nargs="+", default=[0, 2, 5])
+    parser.add_argument("--parse-sizes", type=int, nargs="+", default=[16, 256])
+    parser.add_argument("--export-sizes", type=int, nargs="+", default=[16, 1024])
+    parser.add_argument("--baseline", help="之前的結果 JSON；比較 p50 是否退步")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--output", help="輸出 JSON 檔案路徑 (預設 stdout)")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
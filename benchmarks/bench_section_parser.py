@@ -0,0 +1,122 @@
+"""
+`====FILE:` 區塊解析器的微基準測試
+
+比較舊版「每個檔案各跑一次 re.search (DOTALL + lookahead)」與
+section_parser 的單次掃描 (str / bytes+memoryview / 串流) 在大型合成回應上的耗時。
+
+用法：
+    python benchmarks/bench_section_parser.py --sizes 64 512 4096 --repeat 5
+結果以 JSON 輸出到 stdout (或 --output 指定的檔案)。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import section_parser  # noqa: E402
+
+EXPECTED = ["README.md", "SPEC.md", "REPORT.md", "TODOLIST.md", "STRUCTURE.txt", "FLOW.mermaid"]
+
+# 舊版 generate_blueprint / generate_structure 的寫法 (每個預期檔案一個正規表示式)
+LEGACY_PATTERNS = {
+    name: re.compile(r"====FILE: " + re.escape(name) + r"====\n(.*?)(?====FILE:|$)", re.DOTALL)
+    for name in EXPECTED
+}
+
+_FILLER = [
+    "## 系統架構 System Architecture\n",
+    "使用者可以上傳文章並自動轉換為中英對照電子書。Users upload articles and get bilingual e-books.\n",
+    "```mermaid\ngraph TD\n  A[Client] --> B[API]\n  B --> C[(DB)]\n```\n",
+    "- [ ] 建立資料庫結構 Create database schema\n",
+    "| 欄位 Field | 型別 Type |\n|---|---|\n| id | int |\n",
+]
+
+
+def synthetic_response(size_kb, extra_files=2, seed=0):
+    """產生約 size_kb KB 的回應，包含預期檔案與幾個額外檔案"""
+    rng = random.Random(seed)
+    names = EXPECTED + [f"EXTRA_{i}.md" for i in range(extra_files)]
+    per_file = max(1, size_kb * 1024 // len(names))
+    parts = ["好的，以下是您要求的文件：\n"]
+    for name in names:
+        parts.append(f"====FILE: {name}====\n")
+        written = 0
+        while written < per_file:
+            line = rng.choice(_FILLER)
+            parts.append(line)
+            written += len(line.encode("utf-8"))
+    return "".join(parts)
+
+
+def legacy_parse(text):
+    result = {}
+    for name, pattern in LEGACY_PATTERNS.items():
+        match = pattern.search(text)
+        result[name] = match.group(1).strip() if match else None
+    return result
+
+
+def streaming_parse(text, chunk_size=256):
+    parser = section_parser.StreamingSectionParser()
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+    parser.close()
+    return parser.sections()
+
+
+def _best_of(fn, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(sizes, repeat):
+    results = []
+    for size_kb in sizes:
+        text = synthetic_response(size_kb)
+        data = text.encode("utf-8")
+        timings = {
+            "legacy_regex": _best_of(legacy_parse, text, repeat),
+            "single_pass_str": _best_of(section_parser.parse_sections, text, repeat),
+            "single_pass_bytes": _best_of(section_parser.parse_sections, data, repeat),
+            "streaming": _best_of(streaming_parse, text, repeat),
+        }
+        results.append({
+            "size_kb": size_kb,
+            "chars": len(text),
+            "sections": len(section_parser.parse_sections(text)),
+            "seconds": {k: round(v, 6) for k, v in timings.items()},
+            "speedup_vs_regex": {
+                k: round(timings["legacy_regex"] / v, 2) if v else None
+                for k, v in timings.items() if k != "legacy_regex"
+            },
+        })
+    return {"benchmark": "section_parser", "repeat": repeat, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 256, 4096], help="回應大小 (KB)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="輸出 JSON 檔案路徑 (預設 stdout)")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
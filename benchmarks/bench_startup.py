@@ -0,0 +1,137 @@
+"""
+冷啟動與 rerun 的基準測試 (每次量測都開新的 Python process，不需要 API Key)
+
+涵蓋：
+- imports：python -X importtime 量到的模組累計匯入時間，以及整個 process 的 wall time
+- first_paint：新 process 中第一次執行 app.py 的時間 (login = 登入畫面，main = 已登入的主畫面)
+- rerun：同一個 process 之後每次 rerun 的時間 (設定已套用、模組都已載入)
+
+用法：
+    python benchmarks/bench_startup.py --repeat 5 --output startup.json
+    python benchmarks/bench_startup.py --baseline startup.json --tolerance 0.25   # p50 變慢超過 25% 時 exit 1
+結果以 JSON 輸出到 stdout (或 --output 指定的檔案)。
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_engine import compare, summarize  # noqa: E402
+
+# 在子 process 裡執行：回傳第一次 run 與之後每次 rerun 的秒數
+_PAINT_SCRIPT = r"""
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+at.secrets["APP_PASSWORD"] = "bench"
+at.secrets["GOOGLE_API_KEY"] = "bench-key"
+at.secrets["PROJECT_STORE_PATH"] = sys.argv[2]
+at.query_params["sid"] = "bench"
+if sys.argv[3] == "main":
+    at.session_state["logged_in"] = True
+first = time.perf_counter()
+at.run()
+painted = time.perf_counter()
+if at.exception:
+    raise SystemExit(str(at.exception))
+reruns = []
+for _ in range(int(sys.argv[4])):
+    t = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - t)
+print(json.dumps({"first_run": painted - first, "total": painted - started,
+                  "harness": imported - started, "reruns": reruns}))
+"""
+
+
+def _python(args, **kwargs):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True, **kwargs)
+
+
+def import_time(module):
+    """回傳 (模組累計匯入秒數, process wall time)"""
+    started = time.perf_counter()
+    result = _python(["-X", "importtime", "-c", f"import {module}"])
+    wall = time.perf_counter() - started
+    pattern = re.compile(rf"^import time:\s+\d+ \|\s+(\d+) \|\s*{re.escape(module)}$")
+    for line in result.stderr.splitlines():
+        match = pattern.match(line)
+        if match:
+            return int(match.group(1)) / 1e6, wall
+    raise RuntimeError(f"importtime 輸出中找不到 {module}")
+
+
+def bench_imports(modules, repeat):
+    report = {}
+    for module in modules:
+        cumulative, wall = [], []
+        for _ in range(repeat):
+            c, w = import_time(module)
+            cumulative.append(c)
+            wall.append(w)
+        report[module] = {"cumulative": summarize(cumulative), "process": summarize(wall)}
+    return report
+
+
+def bench_paint(page, repeat, reruns):
+    first, total, rerun = [], [], []
+    with tempfile.TemporaryDirectory() as store:
+        for _ in range(repeat):
+            result = _python(["-c", _PAINT_SCRIPT, os.path.join(ROOT, "app.py"), store, page, str(reruns)])
+            sample = json.loads(result.stdout.strip().splitlines()[-1])
+            first.append(sample["first_run"])
+            total.append(sample["total"])
+            rerun.extend(sample["reruns"])
+    return {"first_paint": summarize(first), "process_to_paint": summarize(total), "rerun": summarize(rerun)}
+
+
+def run(args):
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat, "reruns": args.reruns,
+        },
+        "imports": bench_imports(args.modules, args.repeat),
+        "pages": {page: bench_paint(page, args.repeat, args.reruns) for page in args.pages},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="每項量測開幾次新的 process")
+    parser.add_argument("--reruns", type=int, default=5, help="每個 process 第一次執行後再 rerun 幾次")
+    parser.add_argument("--modules", nargs="+", default=["generator_engine", "pipeline", "batch_runner"])
+    parser.add_argument("--pages", nargs="+", choices=["login", "main"], default=["login", "main"])
+    parser.add_argument("--baseline", help="之前的結果 JSON；比較 p50 是否退步")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--output", help="輸出 JSON 檔案路徑 (預設 stdout)")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
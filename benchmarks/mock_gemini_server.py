@@ -0,0 +1,274 @@
+"""
+本機假 Gemini API (generativelanguage.googleapis.com 的替身)，跑基準測試不耗真實額度。
+
+支援：
+- generateContent / streamGenerateContent?alt=sse
+- 可設定的延遲分布：const:秒 / uniform:下限:上限 / lognormal:中位數:sigma / exp:平均
+- 依模型注入 404 / 429 / 503 (可設定機率與 Retry-After)
+- 超大回應 (--response-kb) 與串流分段大小 (--chunk-chars)
+- generationConfig.responseSchema：文件類回應改成 {"files": [{"name", "content"}]} JSON
+- 格式差一點的回應 (--malformed 機率)：JSON 多逗號 / 前後說明文字、區塊標記寫歪，用來量測本機修復
+
+依 prompt 內容回應：問卷 (JSON)、藍圖 (四個 ====FILE: 區塊)、架構 (STRUCTURE.txt + FLOW.mermaid)。
+
+用法：
+    python benchmarks/mock_gemini_server.py --port 8765 --latency lognormal:0.8:0.4 \\
+        --fault gemini-3-pro-preview=404 --fault gemini-2.5-pro=429:0.5
+    # 然後在 app 或腳本中：transport.configure_pool(base_url="http://127.0.0.1:8765/v1beta/models")
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_FILLER = [
+    "## 系統架構 System Architecture\n",
+    "使用者可以上傳文章並自動轉換為中英對照電子書。Users upload articles and get bilingual e-books.\n",
+    "```mermaid\ngraph TD\n  A[Client] --> B[API]\n  B --> C[(DB)]\n```\n",
+    "- [ ] 建立資料庫結構 Create database schema\n",
+    "| 欄位 Field | 型別 Type |\n|---|---|\n| id | int |\n",
+]
+BLUEPRINT_FILES = ["README.md", "SPEC.md", "REPORT.md", "TODOLIST.md"]
+STRUCTURE_FILES = ["STRUCTURE.txt", "FLOW.mermaid"]
+
+
+def parse_latency(spec):
+    """延遲分布字串 -> 取樣函式 (秒)"""
+    kind, _, args = (spec or "const:0").partition(":")
+    values = [float(v) for v in args.split(":") if v]
+    if kind == "const":
+        return lambda rng: values[0] if values else 0.0
+    if kind == "uniform":
+        low, high = values
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    if kind == "exp":
+        mean, = values
+        return lambda rng: rng.expovariate(1.0 / mean)
+    raise ValueError(f"不支援的延遲分布: {spec}")
+
+
+def parse_fault(spec):
+    """'模型=狀態碼[:機率[:Retry-After]]' -> (模型, {"status", "rate", "retry_after"})"""
+    model, _, rule = spec.partition("=")
+    parts = rule.split(":")
+    fault = {"status": int(parts[0]), "rate": float(parts[1]) if len(parts) > 1 else 1.0}
+    if len(parts) > 2:
+        fault["retry_after"] = parts[2]
+    return model, fault
+
+
+def _sections(names, size_bytes, rng):
+    per_file = max(1, size_bytes // len(names))
+    parts = ["好的，以下是您要求的文件：\n"]
+    for name in names:
+        parts.append(f"====FILE: {name}====\n")
+        written = 0
+        while written < per_file:
+            line = rng.choice(_FILLER)
+            parts.append(line)
+            written += len(line.encode("utf-8"))
+    return "".join(parts)
+
+
+def _malform(text, rng):
+    """把回應弄成「差一點」的格式 (模型常見的失誤)"""
+    if text.lstrip().startswith("{"):
+        return "好的，以下是結果：\n```json\n" + text.rstrip("}") + ",\n}\n```\n希望有幫助！"
+    return text.replace("====FILE: ", rng.choice(["==== FILE: ", "**====FILE: ", "=== File："]))
+
+
+def response_text(prompt, response_kb, rng, structured=False, malformed=0.0):
+    """依 prompt 判斷是哪一種生成功能，產生對應格式的回應"""
+    if "q_frontend" in prompt:
+        text = json.dumps({
+            "q_frontend": "您希望使用者在哪些裝置上操作？",
+            "q_backend": "需要哪些帳號與權限管理？",
+            "q_database": "資料需要保存多久？",
+        }, ensure_ascii=False)
+    else:
+        names = STRUCTURE_FILES if "STRUCTURE.txt" in prompt else BLUEPRINT_FILES
+        text = _sections(names, int(response_kb * 1024), rng)
+        if structured:
+            from_sections = [{"name": n, "content": c} for n, c in _split(text)]
+            text = json.dumps({"files": from_sections}, ensure_ascii=False)
+    if malformed and rng.random() < malformed:
+        text = _malform(text, rng)
+    return text
+
+
+def _split(text):
+    parts = text.split("====FILE: ")[1:]
+    return [tuple(part.split("====\n", 1)) for part in parts]
+
+
+class MockGeminiServer:
+    """
+    latency：延遲分布字串 (見 parse_latency)，faults：{模型: {"status", "rate", "retry_after"}}
+    response_kb：藍圖 / 架構回應的大小，chunk_chars：串流每個事件的字數，chunk_delay：事件間隔秒數
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency="const:0", faults=None,
+                 response_kb=8, chunk_chars=256, chunk_delay=0.0, seed=0, malformed=0.0):
+        self.latency = parse_latency(latency)
+        self.faults = dict(faults or {})
+        self.response_kb = response_kb
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.malformed = malformed
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = defaultdict(lambda: defaultdict(int))   # model -> status -> 次數
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1beta/models"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="mock-gemini")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats.clear()
+
+    def snapshot(self):
+        with self._stats_lock:
+            return {model: dict(statuses) for model, statuses in self.stats.items()}
+
+    def _count(self, model, status):
+        with self._stats_lock:
+            self.stats[model][status] += 1
+
+    def _sample(self, fn):
+        with self._rng_lock:
+            return fn(self._rng)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive，才量得到連線池的效果
+            disable_nagle_algorithm = True  # 標頭與內容分開寫出，避免 Nagle + delayed ACK 多出約 40ms
+
+            def _send(self, status, body, content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                model, _, method = url.path.rsplit("/", 1)[-1].partition(":")
+                prompt = "".join(
+                    part.get("text", "")
+                    for content in request.get("contents", []) for part in content.get("parts", [])
+                )
+
+                time.sleep(server._sample(server.latency))
+
+                fault = server.faults.get(model)
+                if fault and server._sample(lambda rng: rng.random()) < fault["rate"]:
+                    server._count(model, fault["status"])
+                    headers = {"Retry-After": fault["retry_after"]} if fault.get("retry_after") else None
+                    error = {"error": {"code": fault["status"], "message": f"mock fault for {model}"}}
+                    self._send(fault["status"], json.dumps(error).encode(), headers=headers)
+                    return
+
+                schema = request.get("generationConfig", {}).get("responseSchema", {})
+                structured = "files" in schema.get("properties", {})
+                text = server._sample(
+                    lambda rng: response_text(prompt, server.response_kb, rng, structured, server.malformed)
+                )
+                usage = {
+                    "promptTokenCount": len(prompt) // 4,
+                    "candidatesTokenCount": len(text) // 4,
+                    "totalTokenCount": (len(prompt) + len(text)) // 4,
+                }
+                server._count(model, 200)
+                if method == "streamGenerateContent" and parse_qs(url.query).get("alt") == ["sse"]:
+                    self._stream(text, usage)
+                else:
+                    body = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}],
+                            "usageMetadata": usage}
+                    self._send(200, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+            def _stream(self, text, usage):
+                # 使用 chunked 傳輸，逐個 SSE 事件送出
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                step = max(1, server.chunk_chars)
+                for i in range(0, len(text), step):
+                    event = {"candidates": [{"content": {"parts": [{"text": text[i:i + step]}], "role": "model"}}]}
+                    if i + step >= len(text):
+                        event["usageMetadata"] = usage
+                    data = ("data: " + json.dumps(event, ensure_ascii=False) + "\r\n\r\n").encode("utf-8")
+                    self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                    if server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="const:0.05", help="延遲分布，例如 lognormal:0.8:0.4")
+    parser.add_argument("--fault", action="append", default=[], help="模型=狀態碼[:機率[:Retry-After]]，可重複")
+    parser.add_argument("--response-kb", type=float, default=8)
+    parser.add_argument("--chunk-chars", type=int, default=256)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--malformed", type=float, default=0.0, help="回應格式寫歪的機率 (0~1)")
+    args = parser.parse_args(argv)
+
+    server = MockGeminiServer(
+        args.host, args.port, args.latency, dict(parse_fault(f) for f in args.fault),
+        args.response_kb, args.chunk_chars, args.chunk_delay, malformed=args.malformed,
+    )
+    print(f"Mock Gemini API: {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
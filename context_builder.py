@@ -0,0 +1,244 @@
+import math
+import re
+import threading
+from functools import lru_cache
+
+# ==========================================
+# 👇 依 token 預算組裝 prompt 內容 (取代直接截斷字元)
+# ==========================================
+# 原本 generate_structure 直接取 context_text[:6000]：中英混合文件的字數和 token 數差很多，
+# 而且常常把 SPEC 從某個章節中間切斷、Mermaid 圖只剩一半。
+# 這裡先在本機估算 token，把文件切成章節 / Mermaid 區塊，依重要性排序後在預算內挑選，
+# 最後按原本順序組回去。內容沒超過預算時原文照送 (快取 key 不變)；組裝結果會被記住。
+
+# 各生成功能的輸入預算 (token)；MODEL_BUDGETS 可再針對個別模型設定上限，取兩者較小值
+BUDGETS = {"structure": 3000, "blueprint": 4000}
+MODEL_BUDGETS = {}
+_settings_lock = threading.Lock()
+
+TRUNCATED_MARK = "…(略)"
+OMITTED_NOTE = "(部分章節因長度限制省略)"
+MIN_TRUNCATE = 96  # 剩餘預算少於這個數就不再截斷章節塞進去
+
+_CJK = re.compile(r"[\u2e80-\u9fff\u3000-\u303f\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+_HEADING = re.compile(r"^(#{1,6})\s+(.*)$", re.MULTILINE)
+_FENCE = re.compile(r"^```[^\n]*\n.*?^```[ \t]*$", re.MULTILINE | re.DOTALL)
+_FIELD = re.compile(r"^[ \t]*(?:\d+\.\s*)?[^\n：:]{1,16}[：:]", re.MULTILINE)
+
+# 架構相關的章節優先保留
+KEYWORDS = (
+    "架構", "architecture", "api", "資料", "data", "模組", "module", "流程", "flow", "功能", "feature",
+    "技術", "stack", "schema", "部署", "deploy", "元件", "component", "介面", "interface",
+)
+
+
+def estimate_tokens(text):
+    """粗估 token 數：中日韓文字約一字一 token，其餘約四個字元一 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def budget(kind, models=()):
+    """生成功能的預算，再以候選模型中最小的模型上限為準 (同一個 prompt 會沿 fallback 鏈送出)"""
+    with _settings_lock:
+        limits = [BUDGETS.get(kind, BUDGETS["structure"])]
+        limits += [MODEL_BUDGETS[m] for m in models if m in MODEL_BUDGETS]
+    return min(limits)
+
+
+def configure(budgets=None, model_budgets=None):
+    """調整預算 (app.py 每次 rerun 都會呼叫；設定有變動才清除已記住的結果)"""
+    changed = False
+    with _settings_lock:
+        for target, values in ((BUDGETS, budgets), (MODEL_BUDGETS, model_budgets)):
+            for key, value in dict(values or {}).items():
+                if target.get(key) != int(value):
+                    target[key] = int(value)
+                    changed = True
+    if changed:
+        _pack_document.cache_clear()
+        _pack_fields.cache_clear()
+
+
+# ==========================================
+# 👇 文件：章節與 Mermaid 區塊
+# ==========================================
+class _Chunk:
+    __slots__ = ("index", "section", "heading", "text", "kind", "tokens", "score")
+
+    def __init__(self, index, section, heading, text, kind):
+        self.index = index
+        self.section = section
+        self.heading = heading
+        self.text = text
+        self.kind = kind
+        self.tokens = estimate_tokens(text)
+        self.score = 0.0
+
+
+def _heading_starts(text):
+    """標題所在位置；``` 區塊內 # 開頭的行 (程式碼註解) 不算標題，沒關上的區塊一路算到文件結尾"""
+    starts, pos, fenced = [], 0, False
+    for line in text.splitlines(keepends=True):
+        if line.startswith("```"):
+            fenced = not fenced
+        elif not fenced and _HEADING.match(line):
+            starts.append(pos)
+        pos += len(line)
+    return starts
+
+
+def _split_document(text):
+    """依標題切章節，章節內的 ``` 區塊 (Mermaid 等) 獨立成塊，不會被切開"""
+    starts = _heading_starts(text)
+    bounds = ([0] if not starts or starts[0] > 0 else []) + starts + [len(text)]
+    chunks = []
+    for section, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        block = text[start:end]
+        match = _HEADING.match(block)
+        heading = match.group(0) + "\n" if match else ""
+        body = block[len(heading):] if match else block
+        pos = 0
+        for fence in _FENCE.finditer(body):
+            if body[pos:fence.start()].strip():
+                chunks.append(_Chunk(len(chunks), section, heading, body[pos:fence.start()], "text"))
+            chunks.append(_Chunk(len(chunks), section, heading, fence.group(0) + "\n", "diagram"))
+            pos = fence.end() + 1
+        if body[pos:].strip() or not chunks or chunks[-1].section != section:
+            chunks.append(_Chunk(len(chunks), section, heading, body[pos:], "text"))
+    return chunks
+
+
+def _score(chunk, heading_level):
+    heading = chunk.heading.lower()
+    score = {"diagram": 3.0, "text": 1.0}[chunk.kind]
+    if not chunk.heading:
+        score += 1.0            # 標題之前的前言 (專案名稱、摘要)
+    elif heading_level <= 2:
+        score += 0.5
+    if any(k in heading for k in KEYWORDS):
+        score += 1.5
+    return score + 1.0 / (1 + 0.05 * chunk.index)   # 越前面越重要
+
+
+def _truncate(text, max_tokens):
+    """在行的邊界截斷到 max_tokens 以內"""
+    kept, used = [], estimate_tokens(TRUNCATED_MARK)
+    for line in text.splitlines(keepends=True):
+        cost = estimate_tokens(line)
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "".join(kept).rstrip() + "\n" + TRUNCATED_MARK + "\n" if kept else ""
+
+
+@lru_cache(maxsize=256)
+def _pack_document(text, max_tokens):
+    chunks = _split_document(text)
+    for chunk in chunks:
+        match = _HEADING.match(chunk.heading)
+        chunk.score = _score(chunk, len(match.group(1)) if match else 0)
+
+    selected = {}               # index -> 實際放入的文字
+    opened = set()              # 已計入標題成本的章節
+    used = estimate_tokens(OMITTED_NOTE)
+    for chunk in sorted(chunks, key=lambda c: (-c.score, c.index)):
+        heading_cost = 0 if chunk.section in opened else estimate_tokens(chunk.heading)
+        remaining = max_tokens - used - heading_cost
+        if chunk.tokens <= remaining:
+            selected[chunk.index] = chunk.text
+        elif chunk.kind == "text" and remaining >= MIN_TRUNCATE:
+            # Mermaid 圖截斷就不能用了，只有一般文字才截斷
+            selected[chunk.index] = _truncate(chunk.text, remaining)
+        else:
+            continue
+        used += heading_cost + estimate_tokens(selected[chunk.index])
+        opened.add(chunk.section)
+
+    parts, current = [], None
+    for chunk in chunks:
+        if chunk.index not in selected:
+            continue
+        if chunk.section != current:
+            parts.append(chunk.heading)
+            current = chunk.section
+        parts.append(selected[chunk.index])
+    parts.append("\n" + OMITTED_NOTE + "\n")
+    return "".join(parts)
+
+
+def pack_document(text, kind="structure", models=()):
+    """
+    Markdown 文件 (README + SPEC) 依預算挑選章節；沒超過預算就原文回傳。
+    優先順序：Mermaid 等程式碼區塊 > 架構 / API / 資料相關章節 > 前言 > 其他，同分時越前面越優先。
+    """
+    limit = budget(kind, models)
+    if estimate_tokens(text) <= limit:
+        return text
+    return _pack_document(text, limit)
+
+
+# ==========================================
+# 👇 訪談紀錄：每個欄位公平分配預算
+# ==========================================
+def _split_fields(text):
+    """依「標籤：」開頭的行切欄位 (專案名稱、原始構想、各題回答)"""
+    starts = [m.start() for m in _FIELD.finditer(text)]
+    bounds = ([0] if not starts or starts[0] > 0 else []) + starts + [len(text)]
+    return [text[s:e] for s, e in zip(bounds, bounds[1:])]
+
+
+@lru_cache(maxsize=256)
+def _pack_fields(text, max_tokens):
+    fields = _split_fields(text)
+    costs = [estimate_tokens(f) for f in fields]
+    # water-filling：短的欄位完整保留，剩下的預算平均分給較長的欄位
+    shares = [0] * len(fields)
+    remaining, pending = max_tokens, sorted(range(len(fields)), key=lambda i: costs[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending[0]
+        if costs[i] <= share:
+            shares[i] = costs[i]
+            remaining -= costs[i]
+            pending.pop(0)
+        else:
+            for j in pending:
+                shares[j] = share
+            break
+    parts = []
+    for field, cost, share in zip(fields, costs, shares):
+        parts.append(field if cost <= share else _truncate_field(field, share))
+    return "".join(parts)
+
+
+def _truncate_field(field, max_tokens):
+    """欄位太長：保留開頭到預算為止 (以字元逐步截斷，回答常常只有一行)"""
+    mark_cost = estimate_tokens(TRUNCATED_MARK)
+    lo, hi = 0, len(field)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(field[:mid]) + mark_cost <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return field[:lo].rstrip() + TRUNCATED_MARK + "\n"
+
+
+def pack_requirements(text, kind="blueprint", models=()):
+    """訪談紀錄 (專案名稱、構想、回答) 超過預算時，每個欄位公平截斷；沒超過就原文回傳"""
+    limit = budget(kind, models)
+    if estimate_tokens(text) <= limit:
+        return text
+    return _pack_fields(text, limit)
+
+
+def stats():
+    """已記住的組裝結果 (命中 / 未命中次數)"""
+    return {
+        "document": _pack_document.cache_info()._asdict(),
+        "requirements": _pack_fields.cache_info()._asdict(),
+    }
@@ -0,0 +1,270 @@
+import hashlib
+import struct
+import tarfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import section_parser
+
+# ==========================================
+# 👇 文件打包 (ZIP / tar.gz) — 依內容雜湊快取
+# ==========================================
+# Streamlit 每次 rerun 都會重新執行 create_zip_download；原本每次都把所有文件重新壓縮。
+# 這裡自己寫 ZIP 格式：每個檔案壓縮後的資料依 (檔名, 內容雜湊, 壓縮方式) 快取，
+# 整包結果也依內容雜湊快取。內容沒變就直接回傳同一份 bytes，只有改過的檔案才重新壓縮。
+# 也可以邊產生邊輸出 (iter_zip / iter_tar_gz)，大型多專案打包不必整包放進記憶體。
+
+ZIP_STORED, ZIP_DEFLATED = 0, 8
+COMPRESSION_METHODS = {"deflate": ZIP_DEFLATED, "store": ZIP_STORED}
+FORMATS = {
+    "zip": ("application/zip", ".zip"),
+    "zip-store": ("application/zip", ".zip"),
+    "tar.gz": ("application/gzip", ".tar.gz"),
+}
+
+STRUCTURE_FILES = ("STRUCTURE.txt", "FLOW.mermaid")
+
+# 固定時間戳記：相同內容永遠產生相同的壓縮檔 (快取與雜湊才有意義)
+_DOS_TIME = 0
+_DOS_DATE = ((2025 - 1980) << 9) | (1 << 5) | 1
+_TAR_MTIME = time.mktime((2025, 1, 1, 0, 0, 0, 0, 0, -1))
+_UTF8_FLAG = 0x0800
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+
+def collect_files(result_files, structure_res=None):
+    """
+    整理要匯出的檔案：藍圖文件 + 架構產出 (STRUCTURE.txt / FLOW.mermaid)。
+    以底線開頭的 key (例如 _model_used) 是內部資訊，不會被打包；
+    不是單純檔名的 key (含路徑、..，例如舊版專案庫留下的) 也略過，避免 zip-slip。
+    """
+    files = OrderedDict()
+    for name, content in (result_files or {}).items():
+        if section_parser.is_safe_name(name) and isinstance(content, str):
+            files[name] = content
+    for name, content in (structure_res or {}).items():
+        if not section_parser.is_safe_name(name) or not isinstance(content, str):
+            continue
+        # 架構結果若帶有與藍圖重複的區塊，以藍圖為準
+        if name in STRUCTURE_FILES or name not in files:
+            files[name] = content
+    return files
+
+
+def bundle(projects):
+    """多專案打包：{資料夾名稱: files} -> {"資料夾/檔名": 內容}"""
+    files = OrderedDict()
+    for folder, project_files in projects.items():
+        for name, content in project_files.items():
+            files[f"{folder}/{name}"] = content
+    return files
+
+
+def check_member(name):
+    """壓縮檔成員名稱：相對路徑、以 / 分隔，每一層都必須是單純的檔名 (不能是絕對路徑或 ..)"""
+    parts = name.split("/")
+    if not all(section_parser.is_safe_name(part) for part in parts):
+        raise ValueError(f"不安全的壓縮檔成員名稱: {name!r}")
+    return name
+
+
+class _Entry:
+    """一個已壓縮好的 ZIP 項目 (可跨不同壓縮檔重複使用)"""
+
+    __slots__ = ("name", "method", "crc", "size", "data")
+
+    def __init__(self, name, method, crc, size, data):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.size = size
+        self.data = data
+
+
+class _ChunkSink:
+    """給 tarfile 串流模式寫入用的暫存區；每寫完一個檔案就把累積的 bytes 交出去"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ExportBuilder:
+    """
+    max_archives：保留幾份完整壓縮檔 (每個 session 通常只需要最新的一份)
+    max_entries：保留幾個已壓縮的檔案項目
+    """
+
+    def __init__(self, max_archives=32, max_entries=512, level=6):
+        self.max_archives = max_archives
+        self.max_entries = max_entries
+        self.level = level
+        self._lock = threading.Lock()
+        self._archives = OrderedDict()
+        self._entries = OrderedDict()
+        self.stats = {"archive_hits": 0, "archive_misses": 0, "entries_compressed": 0, "entries_reused": 0}
+
+    # ---------- 快取 ----------
+    def _lru_get(self, cache, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _lru_put(self, cache, key, value, limit):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _content_hash(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def _entry(self, name, content, method):
+        data = content.encode("utf-8") if isinstance(content, str) else bytes(content)
+        key = (name, self._content_hash(data), method)
+        entry = self._lru_get(self._entries, key)
+        if entry is not None:
+            self._count("entries_reused")
+            return entry
+        if method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+        else:
+            payload = data
+        entry = _Entry(name.encode("utf-8"), method, zlib.crc32(data), len(data), payload)
+        self._lru_put(self._entries, key, entry, self.max_entries)
+        self._count("entries_compressed")
+        return entry
+
+    # ---------- ZIP ----------
+    def iter_zip(self, files, compression="deflate"):
+        """逐段產生 ZIP 內容 (不需要把整個壓縮檔放進記憶體)"""
+        method = COMPRESSION_METHODS[compression]
+        central = []
+        offset = 0
+        for name, content in files.items():
+            entry = self._entry(check_member(name), content, method)
+            if offset > _ZIP32_LIMIT or entry.size > _ZIP32_LIMIT or len(entry.data) > _ZIP32_LIMIT:
+                raise ValueError("壓縮檔超過 4GB，請分批打包")
+            header = struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, 20, _UTF8_FLAG, entry.method, _DOS_TIME, _DOS_DATE,
+                entry.crc, len(entry.data), entry.size, len(entry.name), 0,
+            )
+            central.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | 20, 20, _UTF8_FLAG, entry.method,
+                _DOS_TIME, _DOS_DATE, entry.crc, len(entry.data), entry.size, len(entry.name),
+                0, 0, 0, 0, 0o100644 << 16, offset,
+            ) + entry.name)
+            yield header + entry.name
+            yield entry.data
+            offset += len(header) + len(entry.name) + len(entry.data)
+        if len(central) > 0xFFFF:
+            raise ValueError("檔案數量超過 65535，請分批打包")
+        directory = b"".join(central)
+        yield directory
+        yield struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(directory), offset, 0)
+
+    def build_zip(self, files, compression="deflate"):
+        """回傳完整 ZIP bytes；內容與壓縮方式都沒變時直接回傳快取"""
+        digest = hashlib.sha256(compression.encode())
+        for name, content in files.items():
+            data = content.encode("utf-8") if isinstance(content, str) else bytes(content)
+            digest.update(name.encode("utf-8") + b"\0" + self._content_hash(data).encode() + b"\0")
+        key = digest.hexdigest()
+
+        archive = self._lru_get(self._archives, key)
+        if archive is not None:
+            self._count("archive_hits")
+            return archive
+        self._count("archive_misses")
+        archive = b"".join(self.iter_zip(files, compression))
+        self._lru_put(self._archives, key, archive, self.max_archives)
+        return archive
+
+    # ---------- tar.gz ----------
+    def iter_tar_gz(self, files):
+        """逐段產生 tar.gz 內容 (tarfile 串流模式，每個檔案寫完就輸出)"""
+        sink = _ChunkSink()
+        with tarfile.open(fileobj=sink, mode="w|gz") as tar:
+            for name, content in files.items():
+                data = content.encode("utf-8") if isinstance(content, str) else bytes(content)
+                info = tarfile.TarInfo(check_member(name))
+                info.size = len(data)
+                info.mtime = _TAR_MTIME
+                info.mode = 0o644
+                tar.addfile(info, _BytesReader(data))
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+
+    # ---------- 共用入口 ----------
+    def iter_archive(self, files, fmt="zip"):
+        if fmt == "zip":
+            return self.iter_zip(files, "deflate")
+        if fmt == "zip-store":
+            return self.iter_zip(files, "store")
+        if fmt == "tar.gz":
+            return self.iter_tar_gz(files)
+        raise ValueError(f"不支援的格式: {fmt}")
+
+    def build(self, files, fmt="zip"):
+        if fmt == "zip":
+            return self.build_zip(files, "deflate")
+        if fmt == "zip-store":
+            return self.build_zip(files, "store")
+        return b"".join(self.iter_archive(files, fmt))
+
+    def write(self, path, files, fmt="zip"):
+        """串流寫入檔案，回傳寫入的 bytes 數"""
+        written = 0
+        with open(path, "wb") as f:
+            for chunk in self.iter_archive(files, fmt):
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update(archives=len(self._archives), entries=len(self._entries))
+        return stats
+
+
+class _BytesReader:
+    """tarfile.addfile 需要的最小 file-like 物件 (避免再複製一份 BytesIO)"""
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        chunk = self._view[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return bytes(chunk)
+
+
+# 全域唯一的打包器 (整個 process 共用快取)
+builder = ExportBuilder()
@@ -1,15 +1,27 @@
-import requests
-import re
-import streamlit as st
-import json
-import zipfile
-import io
 import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import model_health
+import transport
+import section_parser
+import response_cache
+import export_builder
+import telemetry
+import context_builder
+import rate_limiter
+import similarity_index
+import json_repair
+import single_flight
 
+# streamlit 只有這兩個函式用到，等到真的呼叫才載入：
+# batch_runner、benchmark 與背景 worker 匯入引擎時不必先付出載入 streamlit 的時間
 def configure_genai(api_key):
+    import streamlit as st
     st.session_state.api_key_proxy = api_key
 
 def get_api_key():
+    import streamlit as st
     api_key = st.session_state.get("api_key_proxy", "")
     if not api_key:
         api_key = st.secrets.get("GOOGLE_API_KEY", "")
@@ -18,77 +30,744 @@ def get_api_key():
 # ==========================================
 # 👇 核心修復：整合超級模型白名單 (確保連線成功率)
 # ==========================================
-def call_gemini_api_robust(prompt_text, api_key):
-    """
-    策略：依照「智力高 -> 速度快 -> 穩定備用」的順序嘗試所有可用模型。
-    只要清單中任何一個能通，程式就會成功！
-    """
-    # 這是根據您 Colab 查詢結果整理的超級白名單
-    model_candidates = [
-        # --- Tier 1: 神級模型 (最新最強，優先嘗試) ---
+# 這是根據您 Colab 查詢結果整理的超級白名單
+# 順序即預設優先權：「智力高 -> 速度快 -> 穩定備用」
+MODEL_TIERS = [
+    # --- Tier 1: 神級模型 (最新最強，優先嘗試) ---
+    [
         "gemini-3-pro-preview",
         "gemini-2.5-pro",
         "gemini-2.5-pro-preview-tts",
-        
-        # --- Tier 2: 2.0 強力實驗版 ---
+    ],
+    # --- Tier 2: 2.0 強力實驗版 ---
+    [
         "gemini-2.0-pro-exp-02-05",
         "gemini-2.0-pro-exp",
         "gemini-exp-1206",
-        
-        # --- Tier 3: 極速 Flash 系列 (速度快、額度較高) ---
+    ],
+    # --- Tier 3: 極速 Flash 系列 (速度快、額度較高) ---
+    [
         "gemini-2.5-flash",
         "gemini-2.0-flash",
-        "gemini-2.0-flash-exp", 
+        "gemini-2.0-flash-exp",
         "gemini-2.0-flash-001",
         "gemini-flash-latest",
-        
-        # --- Tier 4: 輕量版 (Lite & Gemma) ---
+    ],
+    # --- Tier 4: 輕量版 (Lite & Gemma) ---
+    [
         "gemini-2.5-flash-lite",
         "gemini-2.0-flash-lite-preview-02-05",
         "gemma-3-27b-it", # Google 最強開源模型
-        
-        # --- Tier 5: 保底舊版 (最後防線) ---
+    ],
+    # --- Tier 5: 保底舊版 (最後防線) ---
+    [
         "gemini-pro-latest",
-        "gemini-pro"
-    ]
+        "gemini-pro",
+    ],
+]
+MODEL_CANDIDATES = [m for tier in MODEL_TIERS for m in tier]
+
+# ==========================================
+# 👇 結構化輸出 (responseSchema)：直接要求模型回傳符合格式的 JSON
+# ==========================================
+STRUCTURED_SETTINGS = {"enabled": True, "sections": True}
+
+INTERVIEW_KEYS = ("q_frontend", "q_backend", "q_database")
+INTERVIEW_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {k: {"type": "STRING"} for k in INTERVIEW_KEYS},
+    "required": list(INTERVIEW_KEYS),
+    "propertyOrdering": list(INTERVIEW_KEYS),
+}
+# ====FILE: 區塊協定的 JSON 版本 (非串流的藍圖 / 單一文件 / 架構)
+SECTIONS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "files": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"name": {"type": "STRING"}, "content": {"type": "STRING"}},
+                "required": ["name", "content"],
+                "propertyOrdering": ["name", "content"],
+            },
+        },
+    },
+    "required": ["files"],
+}
+
+def configure_structured_output(enabled=True, sections=True):
+    """enabled：問卷使用 responseSchema；sections：非串流的文件生成也改用 JSON 結構 (串流版維持區塊標記)"""
+    STRUCTURED_SETTINGS["enabled"] = bool(enabled)
+    STRUCTURED_SETTINGS["sections"] = bool(enabled and sections)
+
+def _supports_schema(model_name):
+    """Gemma 與舊版 gemini-pro 不支援 responseSchema (送了會回 400)"""
+    return not (model_name.startswith("gemma") or model_name == "gemini-pro")
+
+def _payload(prompt_text, model_name="", schema=None):
+    payload = {"contents": [{"parts": [{"text": prompt_text}]}]}
+    if schema is not None and STRUCTURED_SETTINGS["enabled"] and _supports_schema(model_name):
+        payload["generationConfig"] = {"responseMimeType": "application/json", "responseSchema": schema}
+    return payload
+
+def _sections_schema():
+    return SECTIONS_SCHEMA if STRUCTURED_SETTINGS["sections"] else None
+
+def _handle_response(model_name, status_code, headers, body, elapsed, prompt_text="", mode="sync", api_key=None):
+    """
+    依照 HTTP 狀態碼更新健康度登錄表 (同步、非同步版本共用)，並記錄一筆 attempt 量測。
+    429 只暫停這組 Key 的額度；所有 Key 都被限流時才讓登錄表冷卻整個模型。
+    回傳 (res_json, None) 代表成功；(None, 錯誤訊息) 代表這個模型這次不能用。
+    """
+    # 成功回傳
+    if status_code == 200:
+        model_health.registry.record_success(model_name, elapsed)
+        telemetry.record_attempt(
+            model_name, status_code, elapsed, len(prompt_text), _response_chars(body),
+            usage=telemetry.usage_tokens(body), mode=mode,
+        )
+        return body, None
+
+    # 遇到 404/429/503 就記錄並換下一個 (登錄表會讓之後的呼叫直接跳過)
+    if status_code in [404, 429, 503]:
+        retry_after = model_health.parse_retry_after(headers.get("Retry-After"))
+        if status_code == 429 and api_key:
+            rate_limiter.limiter.penalize(api_key, model_name, retry_after)
+        if status_code != 429 or not api_key or rate_limiter.limiter.exhausted(model_name, api_key):
+            model_health.registry.record_status(model_name, status_code, retry_after, api_key)
+        error = f"Error {status_code}: {model_name}"
+    else:
+        model_health.registry.record_failure(model_name)
+        error = f"Error {status_code}: {body}"
+    telemetry.record_attempt(model_name, status_code, elapsed, len(prompt_text), error=error, mode=mode)
+    return None, error
+
+def _describe(error):
+    """例外 -> 可以顯示與記錄的文字 (遮蔽 API Key)"""
+    return transport.redact(error)
+
+def _record_exception(model_name, error, elapsed, prompt_text, mode="sync"):
+    """連線逾時、斷線等沒有 HTTP 狀態碼的失敗"""
+    model_health.registry.record_failure(model_name, error)
+    telemetry.record_attempt(model_name, "exception", elapsed, len(prompt_text), error=_describe(error), mode=mode)
+
+def _record_cancelled(model_name, elapsed, prompt_text):
+    """回應已經不需要 (競速輸家 / 使用者取消)：模型本身是正常的，延遲照樣記入登錄表"""
+    model_health.registry.record_success(model_name, elapsed)
+    telemetry.record_attempt(model_name, "cancelled", elapsed, len(prompt_text), error="已取消")
+
+def _response_chars(res_json):
+    try:
+        return len(_response_text(res_json))
+    except (KeyError, IndexError, TypeError):
+        return 0
+
+def _throttled(model_name, error, prompt_text, mode="sync"):
+    """限流器判斷這個模型短時間內沒有額度：不送請求、不影響健康度，直接換下一個模型"""
+    telemetry.record_attempt(model_name, "throttled", 0.0, len(prompt_text), error=error, mode=mode)
+    return None, str(error)
+
+# ==========================================
+# 👇 自適應逾時 & 總時間預算 (Deadline)
+# ==========================================
+# 原本每個模型固定等 60 秒、例外就換下一個，最壞情況是整份白名單 x 60 秒。
+# 現在單次逾時依這個模型最近的 p95 延遲決定 (有上下限)，每次生成呼叫另有總時間預算：
+# 預算快用完時不再嘗試新的模型，直接丟出 DeadlineExceeded 讓 UI 提示。
+TIMEOUT_SETTINGS = {
+    "default": 60.0,        # 延遲紀錄還不夠時的單次逾時 (原本的固定值)
+    "min": 8.0,             # 單次逾時下限
+    "max": 120.0,           # 單次逾時上限
+    "multiplier": 2.0,      # 單次逾時 = p95 x multiplier
+    "min_samples": 5,       # 至少幾筆成功紀錄才採用 p95
+    "min_attempt": 3.0,     # 剩餘預算少於這個秒數就不再嘗試新的模型
+}
+# 各生成功能的總時間預算 (秒)：問卷要快，藍圖內容多可以等比較久
+DEADLINES = {"interview": 45.0, "blueprint": 240.0, "document": 150.0, "structure": 120.0, "generate": 180.0}
+
+class DeadlineExceeded(Exception):
+    """這次生成的總時間預算用完，fallback 鏈提早停止 (不再嘗試剩下的模型)"""
+
+    def __init__(self, seconds, last_error=""):
+        message = f"超過 {seconds:.0f} 秒的時間預算，已停止嘗試其他模型"
+        super().__init__(f"{message}。最後錯誤: {last_error}" if last_error else message)
+        self.seconds = seconds
+        self.last_error = last_error
+
+class Deadline:
+    """一次生成呼叫的總期限；seconds 為 None 代表不限時"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = None if seconds is None else time.monotonic() + seconds
+        self.attempts = 0       # 已經實際送出的請求數
+
+    def remaining(self):
+        return None if self.expires is None else max(0.0, self.expires - time.monotonic())
+
+    def check(self, last_error=""):
+        """
+        剩餘時間已經不夠再試一個模型時丟出 DeadlineExceeded。
+        第一次嘗試一定放行 (單次逾時會被夾在剩餘預算內)，否則比 min_attempt 短的預算一個請求都送不出去。
+        """
+        remaining = self.remaining()
+        if self.attempts and remaining is not None and remaining < TIMEOUT_SETTINGS["min_attempt"]:
+            raise DeadlineExceeded(self.seconds, last_error)
+
+    def start_attempt(self):
+        self.attempts += 1
+
+def configure_timeouts(deadlines=None, min_timeout=None, max_timeout=None, multiplier=None):
+    """
+    deadlines：{生成功能: 秒數} (覆寫預設值，0 代表不限時；少於 min_attempt 的值會提高到 min_attempt)；
+    其餘調整單次逾時的計算方式
+    """
+    for kind, seconds in (deadlines or {}).items():
+        DEADLINES[kind] = max(float(seconds), TIMEOUT_SETTINGS["min_attempt"]) if seconds else None
+    for name, value in (("min", min_timeout), ("max", max_timeout), ("multiplier", multiplier)):
+        if value:
+            TIMEOUT_SETTINGS[name] = float(value)
+
+def _deadline(kind):
+    return Deadline(DEADLINES.get(kind, DEADLINES["generate"]))
+
+def adaptive_timeout(model_name):
+    """依這個模型最近的 p95 延遲決定單次逾時；紀錄不夠時使用預設值"""
+    settings = TIMEOUT_SETTINGS
+    p95 = model_health.registry.latency_percentile(model_name, 95, settings["min_samples"])
+    if p95 is None:
+        return settings["default"]
+    return min(settings["max"], max(settings["min"], p95 * settings["multiplier"]))
+
+def _attempt_timeout(model_name, deadline=None):
+    """單次逾時不超過剩下的總時間預算"""
+    timeout = adaptive_timeout(model_name)
+    remaining = deadline.remaining() if deadline is not None else None
+    # 排隊等額度可能用掉大部分預算；至少留 1 秒給請求本身 (超出預算的時間因此有上限)
+    return timeout if remaining is None else min(timeout, max(remaining, 1.0))
+
+def _too_slow(model_name, deadline):
+    """這個模型平常 (p50) 就比剩下的預算慢：跳過，留時間給後面較快的模型"""
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is None:
+        return False
+    p50 = model_health.registry.latency_percentile(model_name, 50, TIMEOUT_SETTINGS["min_samples"])
+    return p50 is not None and p50 > remaining
+
+def _acquire_key(model_name, api_key, cancel_event=None, deadline=None):
+    """排隊取得這個模型的請求額度；設定多組 Key 時回傳剩餘額度最多的 Key"""
+    max_wait = deadline.remaining() if deadline is not None else None
+    try:
+        return rate_limiter.limiter.acquire(model_name, api_key, cancel_event, max_wait)
+    except InterruptedError:
+        raise GenerationCancelled("生成已取消")
+
+def _attempt_model(model_name, prompt_text, api_key, timeout=None, cancel_event=None, schema=None, deadline=None):
+    """
+    對單一模型送出一次請求 (走共用連線池)，並把結果回報給健康度登錄表。
+    timeout 沒指定時使用自適應逾時 (不超過 deadline 剩下的時間)。
+    cancel_event 被設定時：還沒送出就不送；回應標頭回來時直接關閉連線不讀內容，丟出 GenerationCancelled。
+    """
+    try:
+        api_key = _acquire_key(model_name, api_key, cancel_event, deadline)
+    except rate_limiter.RateLimited as e:
+        return _throttled(model_name, e, prompt_text)
+    _check_cancelled(cancel_event)
+    if deadline is not None:
+        deadline.start_attempt()
+    timeout = timeout or _attempt_timeout(model_name, deadline)
+    started = time.monotonic()
+    try:
+        response = transport.post_json(model_name, api_key, _payload(prompt_text, model_name, schema),
+                                       timeout=timeout, stream=True)
+        with response:
+            if cancel_event is not None and cancel_event.is_set() and response.status_code == 200:
+                _record_cancelled(model_name, time.monotonic() - started, prompt_text)
+                raise GenerationCancelled("生成已取消")
+            body = response.json() if response.status_code == 200 else response.text
+        return _handle_response(
+            model_name, response.status_code, response.headers, body, time.monotonic() - started, prompt_text,
+            api_key=api_key,
+        )
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        _record_exception(model_name, e, time.monotonic() - started, prompt_text)
+        return None, _describe(e)
+
+async def _attempt_model_async(model_name, prompt_text, api_key, timeout=None, schema=None, deadline=None):
+    """_attempt_model 的 asyncio 版本"""
+    try:
+        max_wait = deadline.remaining() if deadline is not None else None
+        api_key = await rate_limiter.limiter.acquire_async(model_name, api_key, max_wait)
+    except rate_limiter.RateLimited as e:
+        return _throttled(model_name, e, prompt_text, "async")
+    if deadline is not None:
+        deadline.start_attempt()
+    timeout = timeout or _attempt_timeout(model_name, deadline)
+    started = time.monotonic()
+    try:
+        client = transport.get_async_client()
+        status_code, headers, body = await client.post_json(
+            model_name, api_key, _payload(prompt_text, model_name, schema), timeout=timeout
+        )
+        return _handle_response(
+            model_name, status_code, headers, body, time.monotonic() - started, prompt_text, "async", api_key
+        )
+    except Exception as e:
+        _record_exception(model_name, e, time.monotonic() - started, prompt_text, "async")
+        return None, _describe(e)
+
+class GenerationCancelled(Exception):
+    """呼叫端已經不需要這個結果 (例如使用者重設專案或修改了回答)"""
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled("生成已取消")
+
+def _all_failed(model_candidates, last_error, deadline=None, skipped=0):
+    """整條 fallback 鏈都失敗；有模型因為時間預算被跳過時視為 DeadlineExceeded"""
+    if skipped and deadline is not None:
+        return DeadlineExceeded(deadline.seconds, last_error)
+    return Exception(f"所有 {len(model_candidates)} 個模型皆嘗試失敗。最後錯誤: {last_error}")
+
+def call_gemini_api_robust(prompt_text, api_key, cancel_event=None, schema=None, deadline=None):
+    """
+    策略：依照「智力高 -> 速度快 -> 穩定備用」的順序嘗試所有可用模型。
+    只要清單中任何一個能通，程式就會成功！
+    模型健康度登錄表會記住 404 (依 Key) / 429 / 503，下一次呼叫直接跳過，冷卻結束再放回。
+    cancel_event 被設定時，在下一次嘗試之前就停止 (已送出的請求無法中斷，結果會被丟棄)。
+    schema：要求結構化輸出的 responseSchema (不支援的模型照常送出一般請求)。
+    deadline：總時間預算 (Deadline)；用完時丟出 DeadlineExceeded，平常就比剩餘時間慢的模型直接跳過。
+    """
+    model_candidates = model_health.registry.ordered(MODEL_TIERS, api_key)
 
     last_error = ""
+    skipped = 0
     for model_name in model_candidates:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
-        headers = {"Content-Type": "application/json"}
-        data = {"contents": [{"parts": [{"text": prompt_text}]}]}
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=60)
-            
-            # 成功回傳
-            if response.status_code == 200:
-                return response.json(), model_name
-            
-            # 遇到 404/429/503 就換下一個
-            if response.status_code in [404, 429, 503]:
-                # print(f"⚠️ 模型 {model_name} 跳過 ({response.status_code})") # 除錯用
-                time.sleep(0.1)
+        _check_cancelled(cancel_event)
+        if deadline is not None:
+            deadline.check(last_error)
+            if _too_slow(model_name, deadline):
+                skipped += 1
+                continue
+        res_json, error = _attempt_model(model_name, prompt_text, api_key, cancel_event=cancel_event, schema=schema,
+                                         deadline=deadline)
+        if error is None:
+            return res_json, model_name
+        last_error = error
+
+    raise _all_failed(model_candidates, last_error, deadline, skipped)
+
+async def call_gemini_api_robust_async(prompt_text, api_key, schema=None, deadline=None):
+    """call_gemini_api_robust 的 asyncio 版本 (同樣的 fallback 順序、健康度登錄表與時間預算)"""
+    model_candidates = model_health.registry.ordered(MODEL_TIERS, api_key)
+
+    last_error = ""
+    skipped = 0
+    for model_name in model_candidates:
+        if deadline is not None:
+            deadline.check(last_error)
+            if _too_slow(model_name, deadline):
+                skipped += 1
+                continue
+        res_json, error = await _attempt_model_async(model_name, prompt_text, api_key, schema=schema,
+                                                     deadline=deadline)
+        if error is None:
+            return res_json, model_name
+        last_error = error
+
+    raise _all_failed(model_candidates, last_error, deadline, skipped)
+
+def call_gemini_api_stream(prompt_text, api_key, deadline=None):
+    """
+    串流版 fallback 鏈 (streamGenerateContent)：收到第一段文字之前失敗都可以換下一個模型，
+    一旦開始輸出內容就固定使用該模型。逐段產生 (model_name, text_chunk)。
+    deadline 只限制「換模型」：開始輸出之後就讓它寫完 (逾時改為兩段內容之間的最長間隔)。
+    """
+    model_candidates = model_health.registry.ordered(MODEL_TIERS, api_key)
+
+    last_error = ""
+    skipped = 0
+    for model_name in model_candidates:
+        if deadline is not None:
+            deadline.check(last_error)
+            if _too_slow(model_name, deadline):
+                skipped += 1
                 continue
-                
-            last_error = f"Error {response.status_code}: {response.text}"
-            
+        try:
+            key = _acquire_key(model_name, api_key, deadline=deadline)
+        except rate_limiter.RateLimited as e:
+            _, last_error = _throttled(model_name, e, prompt_text, "stream")
+            continue
+        if deadline is not None:
+            deadline.start_attempt()
+        started = time.monotonic()
+        try:
+            response = transport.open_stream(model_name, key, _payload(prompt_text),
+                                             timeout=_attempt_timeout(model_name, deadline))
         except Exception as e:
-            last_error = str(e)
+            _record_exception(model_name, e, time.monotonic() - started, prompt_text, "stream")
+            last_error = _describe(e)
             continue
-            
-    raise Exception(f"所有 {len(model_candidates)} 個模型皆嘗試失敗。最後錯誤: {last_error}")
+
+        with response:
+            if response.status_code != 200:
+                _, last_error = _handle_response(
+                    model_name, response.status_code, response.headers, response.text,
+                    time.monotonic() - started, prompt_text, "stream", key,
+                )
+                continue
+
+            streamed = 0
+            usage = {}
+            try:
+                for text in transport.iter_stream_text(response, usage):
+                    streamed += len(text)
+                    yield model_name, text
+            except Exception as e:
+                _record_exception(model_name, e, time.monotonic() - started, prompt_text, "stream")
+                if streamed:
+                    # 內容已經送出一半，不能無聲地換模型重來
+                    raise
+                last_error = _describe(e)
+                continue
+
+            elapsed = time.monotonic() - started
+            model_health.registry.record_success(model_name, elapsed)
+            telemetry.record_attempt(
+                model_name, 200, elapsed, len(prompt_text), streamed,
+                usage=telemetry.usage_tokens({"usageMetadata": usage}), mode="stream",
+            )
+            return
+
+    raise _all_failed(model_candidates, last_error, deadline, skipped)
 
 # ==========================================
-# 👇 功能 1: AI 需求分析師 (生成問卷)
+# 👇 競速模式 (Hedged Requests)：用額度換取尾端延遲
 # ==========================================
-def generate_interview_questions(project_name, project_desc):
+# 預設關閉；由 app.py 依照 secrets 設定開啟 (整個 process 共用)
+RACE_SETTINGS = {"enabled": False, "fanout": 2, "hedge_after": None}
+
+def configure_racing(fanout=0, hedge_after=None):
     """
-    根據用戶模糊的描述，生成 3 個引導式問題
+    fanout <= 1 代表關閉競速模式。
+    hedge_after = None：同時送給前 fanout 個健康模型。
+    hedge_after = 秒數：先送第一個，超過這個秒數還沒回應才補送下一個 (備援請求)。
     """
-    api_key = get_api_key()
-    if not api_key: return {"error": "API Key 遺失"}
+    RACE_SETTINGS["enabled"] = bool(fanout and fanout > 1)
+    RACE_SETTINGS["fanout"] = max(1, int(fanout or 1))
+    RACE_SETTINGS["hedge_after"] = hedge_after
+
+def call_gemini_api_racing(prompt_text, api_key, fanout=2, hedge_after=None, cancel_event=None, schema=None,
+                           deadline=None):
+    """
+    同時 (或延遲補發) 對多個候選模型送出同一個 prompt，第一個成功的 200 勝出，其餘取消：
+    還在排隊 (限流器 / thread pool) 的輸家不再送出；已送出的輸家在回應標頭回來時直接關閉連線，
+    不讀取內容 (Gemini 在生成完成前不會回應，因此已在上游生成中的請求無法提早中斷)。
+    失敗的請求會由下一個候選模型遞補，所以 fallback 能力與循序版本相同。
+    deadline 用完時不再等待在途的請求，直接丟出 DeadlineExceeded。
+    回傳 (res_json, model_name, report)，report 記錄勝出模型與估計省下的時間。
+    """
+    candidates = model_health.registry.ordered(MODEL_TIERS, api_key)
+    if deadline is not None:
+        # 平常就比總預算慢的模型不列入 (全部都太慢時維持原本的順序)
+        candidates = [m for m in candidates if not _too_slow(m, deadline)] or candidates
+    fanout = max(1, min(fanout, len(candidates)))
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=fanout, thread_name_prefix="gemini-race")
+    race_over = threading.Event()   # 比賽結束 (有勝出者、全部失敗或呼叫端取消)：輸家看到就停止
+
+    pending = {}    # future -> (model_name, 發送時間)
+    finished = {}   # model_name -> 花費秒數 (已失敗的請求)
+    next_idx = 0
+    last_error = ""
+
+    def launch():
+        nonlocal next_idx
+        model_name = candidates[next_idx]
+        next_idx += 1
+        # 複製 contextvars，讓 worker thread 的 attempt 記錄掛在目前的 generation span 底下
+        future = pool.submit(contextvars.copy_context().run, _attempt_model, model_name, prompt_text, api_key,
+                             cancel_event=race_over, schema=schema, deadline=deadline)
+        pending[future] = (model_name, time.monotonic())
+
+    try:
+        first_wave = fanout if hedge_after is None else 1
+        while next_idx < min(first_wave, len(candidates)):
+            launch()
+
+        while pending:
+            _check_cancelled(cancel_event)
+            remaining = deadline.remaining() if deadline is not None else None
+            if remaining == 0.0:
+                raise DeadlineExceeded(deadline.seconds, last_error)
+            hedge_in = None
+            if hedge_after is not None and len(pending) < fanout and next_idx < len(candidates):
+                last_launch = max(t for _, t in pending.values())
+                hedge_in = max(0.0, hedge_after - (time.monotonic() - last_launch))
+            timeout = hedge_in
+            if cancel_event is not None:
+                # 可取消時每 0.5 秒醒來檢查一次
+                timeout = 0.5 if timeout is None else min(timeout, 0.5)
+            if remaining is not None:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if hedge_in is not None and timeout == hedge_in and not _out_of_time(deadline):
+                    # 超過 hedge_after 仍無回應：補發備援請求
+                    launch()
+                continue
+
+            for future in done:
+                model_name, sent_at = pending.pop(future)
+                res_json, error = future.result()
+                if error is None:
+                    elapsed = time.monotonic() - sent_at
+                    report = _race_report(candidates, model_name, elapsed, finished, pending, started)
+                    return res_json, model_name, report
+                finished[model_name] = time.monotonic() - sent_at
+                last_error = error
+                # 失敗就由下一個候選遞補，維持同時在途的請求數 (剩餘預算不夠就不再補)
+                if next_idx < len(candidates) and not _out_of_time(deadline):
+                    launch()
+    finally:
+        # 輸家：尚未開始的直接取消；已送出的在回應回來時關閉連線 (仍會回報健康度登錄表)
+        race_over.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if _out_of_time(deadline):
+        raise DeadlineExceeded(deadline.seconds, last_error)
+    raise Exception(f"所有 {len(candidates)} 個模型皆嘗試失敗。最後錯誤: {last_error}")
+
+def _out_of_time(deadline):
+    """競速模式補發 / 遞補前的檢查 (第一波請求一定會送出，與 Deadline.check 相同)"""
+    remaining = deadline.remaining() if deadline is not None else None
+    return remaining is not None and remaining < TIMEOUT_SETTINGS["min_attempt"]
+
+def _race_report(candidates, winner, winner_latency, finished, pending, started):
+    """
+    估計循序模式要花多少時間：排在勝出者前面的模型，
+    已失敗的用實際耗時、仍在跑的用 p50 (至少是目前已等待的時間)，最後再加上勝出者本身的延遲。
+    """
+    now = time.monotonic()
+    in_flight = {name: now - sent_at for name, sent_at in pending.values()}
+    sequential = winner_latency
+    for name in candidates[:candidates.index(winner)]:
+        if name in finished:
+            sequential += finished[name]
+        elif name in in_flight:
+            p50 = model_health.registry.latency_percentile(name, 50) or 0.0
+            sequential += max(in_flight[name], p50)
+    wall_time = now - started
+    return {
+        "winner": winner,
+        "launched": list(finished) + list(in_flight) + [winner],
+        "wall_time": round(wall_time, 3),
+        "saved": round(max(0.0, sequential - wall_time), 3),
+    }
+
+# ==========================================
+# 👇 Single-flight：同時送出的相同請求共用一次上游呼叫
+# ==========================================
+SINGLE_FLIGHT_SETTINGS = {"enabled": True}
+
+def configure_single_flight(enabled=True):
+    SINGLE_FLIGHT_SETTINGS["enabled"] = bool(enabled)
+
+def _call_upstream(prompt_text, api_key, cancel_event=None, schema=None, deadline=None):
+    """依照設定選擇循序 fallback 或競速模式，回傳 (res_json, model_name, race_report)"""
+    if RACE_SETTINGS["enabled"]:
+        return call_gemini_api_racing(
+            prompt_text, api_key,
+            fanout=RACE_SETTINGS["fanout"],
+            hedge_after=RACE_SETTINGS["hedge_after"],
+            cancel_event=cancel_event,
+            schema=schema,
+            deadline=deadline,
+        )
+    res_json, model_name = call_gemini_api_robust(prompt_text, api_key, cancel_event, schema, deadline)
+    return res_json, model_name, None
+
+def _call_model(prompt_text, api_key, cancel_event=None, schema=None, kind="generate"):
+    """
+    所有生成功能的共同入口：回傳 (res_json, model_name, race_report)；循序模式的 race_report 為 None。
+    相同 kind + prompt (+ API Key) 的請求正在進行中時直接等它的結果 (single-flight)，不再另外送出。
+    kind 同時決定總時間預算 (DEADLINES)，用完時丟出 DeadlineExceeded。
+    """
+    deadline = _deadline(kind)
+    if not SINGLE_FLIGHT_SETTINGS["enabled"]:
+        res_json, model_name, race = _call_upstream(prompt_text, api_key, cancel_event, schema, deadline)
+        shared = False
+    else:
+        # 不同 API Key 的帳號權限 / 額度不同，不能共用結果 (make_key 只保存雜湊)
+        key = single_flight.make_key(kind, prompt_text, schema is not None, RACE_SETTINGS["enabled"], api_key)
+        try:
+            (res_json, model_name, race), shared = single_flight.group.do(
+                key, lambda flight_cancel: _call_upstream(prompt_text, api_key, flight_cancel, schema, deadline),
+                cancel_event,
+            )
+        except InterruptedError:
+            raise GenerationCancelled("生成已取消")
+    telemetry.annotate(model=model_name, coalesced=shared)
+    if race:
+        telemetry.annotate(race_saved=race["saved"])
+    return res_json, model_name, race
+
+def _response_text(res_json):
+    return res_json['candidates'][0]['content']['parts'][0]['text']
+
+def _failure(error, message=None):
+    """生成失敗的回傳值；時間預算用完時加上 _deadline (預算秒數)，UI 以不同方式提示"""
+    message = _describe(message or error)
+    telemetry.fail(message)
+    result = {"error": message}
+    if isinstance(error, DeadlineExceeded):
+        telemetry.annotate(deadline_exceeded=True)
+        result["_deadline"] = error.seconds
+    return result
+
+# ==========================================
+# 👇 本機修復：格式差一點的回應直接修好，不必重新生成
+# ==========================================
+RECOVERY_STATS = {}     # 生成功能 -> 靠本機修復救回 (省下一次重新生成) 的次數
+_recovery_lock = threading.Lock()
+
+def _recovered(kind):
+    with _recovery_lock:
+        RECOVERY_STATS[kind] = RECOVERY_STATS.get(kind, 0) + 1
+    telemetry.annotate(repaired=True)
+
+def recovery_snapshot():
+    """{"avoided": 總共省下的重新生成次數, "by_kind": {...}, "json": json_repair 統計}"""
+    with _recovery_lock:
+        by_kind = dict(RECOVERY_STATS)
+    return {"avoided": sum(by_kind.values()), "by_kind": by_kind, "json": json_repair.snapshot()}
+
+def _json_sections(text):
+    """結構化輸出的 {"files": [{"name", "content"}]} -> {檔名: 內容}；不是這種格式回傳 None"""
+    if '"files"' not in text and not text.lstrip().startswith(("{", "[", "```")):
+        return None
+    try:
+        data, repaired = json_repair.loads(text)
+    except json_repair.RepairFailed:
+        return None
+    entries = data.get("files") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return None
+    sections = {}
+    for entry in entries:
+        if isinstance(entry, dict) and entry.get("name") and isinstance(entry.get("content"), str):
+            sections.setdefault(entry["name"].strip(), entry["content"].strip())
+    return (sections, repaired) if sections else None
 
-    prompt = f"""
+def _parse_sections(text, expected, kind):
+    """
+    文件類回應 -> {檔名: 內容}：結構化 JSON 或 ====FILE: 區塊都接受。
+    預期的檔案有缺時，先在本機修正寫歪的區塊標記再解析一次；因此補齊的話算是省下一次重新生成。
+    """
+    structured = _json_sections(text)
+    if structured is not None:
+        sections, repaired = structured
+        if repaired and all(k in sections for k in expected):
+            _recovered(kind)
+        return sections
+    sections = section_parser.parse_sections(text)
+    missing = [k for k in expected if k not in sections]
+    if missing:
+        fixed_text, _ = section_parser.normalize_markers(text, expected)
+        fixed = section_parser.parse_sections(fixed_text)
+        if sum(k in fixed for k in missing):
+            if all(k in fixed for k in expected):
+                _recovered(kind)
+            return fixed
+    return sections
+
+def configure_rate_limit(keys=(), rpm=rate_limiter.DEFAULT_RPM, model_rpm=None,
+                         burst=rate_limiter.DEFAULT_BURST, max_wait=rate_limiter.DEFAULT_MAX_WAIT):
+    """
+    共用限流器：keys 為多組 API Key (依剩餘額度分配)，rpm 為每組 Key 每個模型的每分鐘請求數 (None = 不限流)，
+    model_rpm 針對個別模型覆寫，max_wait 為單一模型最多排隊秒數 (超過就換下一個模型)
+    """
+    return rate_limiter.configure(keys=keys, rpm=rpm, model_rpm=model_rpm, burst=burst, max_wait=max_wait)
+
+# ==========================================
+# 👇 回應快取 (相同 prompt 直接回傳，不耗額度)
+# ==========================================
+def configure_cache(backend="memory", path=None, ttl=24 * 3600, max_entries=256):
+    """backend: memory (記憶體 LRU) / sqlite (單一檔案) / dir (一個 key 一個檔案)"""
+    return response_cache.configure(backend=backend, path=path, ttl=ttl, max_entries=max_entries)
+
+def _cache_lookup(kind, prompt_text):
+    hit = response_cache.cache.get(kind, prompt_text)
+    telemetry.annotate(cache_hit=hit is not None)
+    if hit is None:
+        return None
+    result = dict(hit)
+    result["_cache_hit"] = True
+    return result
+
+def _cache_store(kind, prompt_text, result):
+    """只存完整成功的結果；錯誤或缺檔的結果不存，避免把一次失敗固定下來"""
+    stored = {k: v for k, v in result.items() if k not in ("_race", "_cache_hit")}
+    response_cache.cache.put(kind, prompt_text, stored)
+
+def configure_context(budgets=None, model_budgets=None):
+    """
+    prompt 輸入的 token 預算，例如 budgets={"structure": 3000, "blueprint": 4000}；
+    model_budgets 針對個別模型再設上限 (取候選模型中最小的)
+    """
+    context_builder.configure(budgets, model_budgets)
+
+# ==========================================
+# 👇 相似構想：換句話說的構想直接沿用 / 當作草稿
+# ==========================================
+def configure_similarity(threshold=0.6, max_entries=1000, max_age=7 * 24 * 3600):
+    """threshold：相似度門檻 (0~1)，max_entries / max_age：索引保留的筆數與秒數"""
+    return similarity_index.configure(threshold=threshold, max_entries=max_entries, max_age=max_age)
+
+def find_similar_project(project_name, project_desc, owner=None):
+    """
+    找出 owner (app 的 session_id) 先前相似的構想：{"similarity", "project_name", "project_desc", "results"}，
+    results 可能有 "interview" (問卷) 與 "blueprint" ({"files", "full_requirements"})；沒有就回傳 None。
+    其他擁有者的構想不會出現 (內容是別人的專案)。
+    """
+    return similarity_index.index.query(project_name, project_desc, owner=owner)
+
+def _public(result):
+    return {k: v for k, v in result.items() if not k.startswith("_")}
+
+def remember_interview(project_name, project_desc, questions, owner=None):
+    """問卷生成後記下來，之後 owner 輸入相似的構想可以直接沿用或當作草稿"""
+    if "error" not in questions:
+        similarity_index.index.add(project_name, project_desc, "interview", _public(questions), owner)
+
+def remember_blueprint(project_name, project_desc, full_requirements, files, project_id=None, owner=None):
+    """藍圖完整生成後記下來，之後相似的構想可以直接開啟 (project_id：專案庫中的專案，開啟時直接重新開啟它)"""
+    if _blueprint_complete(files) and not files.get("_errors"):
+        similarity_index.index.add(project_name, project_desc, "blueprint",
+                                   {"files": _public(files), "full_requirements": full_requirements,
+                                    "project_id": project_id}, owner)
+
+def remember_project(project_name, project_desc, project_id, owner=None):
+    """記下這個構想對應的專案 (完全相同的構想再次輸入時重新開啟它，而不是複製一份)"""
+    similarity_index.index.add(project_name, project_desc, "project", project_id, owner)
+
+# ==========================================
+# 👇 功能 1: AI 需求分析師 (生成問卷)
+# ==========================================
+def _draft_section(draft):
+    if not draft:
+        return ""
+    lines = "\n".join(f"    - {draft[k]}" for k in ("q_frontend", "q_backend", "q_database") if draft.get(k))
+    return f"""
+    以下是先前一個相似構想的問題，請以此為草稿，依照本專案的差異調整 (適用的可以沿用)：
+{lines}
+    """
+
+def _interview_prompt(project_name, project_desc, draft=None):
+    return f"""
     你是一位資深產品經理。使用者想要開發一個軟體，但他只知道大概的想法。
     
     專案名稱：{project_name}
@@ -101,7 +780,7 @@ def generate_interview_questions(project_name, project_desc):
     3. 資料儲存 (Data)
     
     請務必使用「繁體中文」提問，問題要簡單易懂，適合新手回答。
-    
+    {_draft_section(draft)}
     【請嚴格依照 JSON 格式輸出，不要有 Markdown 標記】：
     {{
         "q_frontend": "你的前端問題...",
@@ -109,28 +788,66 @@ def generate_interview_questions(project_name, project_desc):
         "q_database": "你的資料庫問題..."
     }}
     """
-    
+
+def _parse_interview(res_json):
+    # 結構化輸出通常直接是合法 JSON；不是的話 (說明文字、多餘逗號、被截斷...) 在本機修復
+    questions, repaired = json_repair.loads_object(_response_text(res_json), INTERVIEW_KEYS)
+    if repaired:
+        _recovered("interview")
+    return questions
+
+@telemetry.traced("interview")
+def generate_interview_questions(project_name, project_desc, api_key=None, draft=None, regenerate=False):
+    """
+    根據用戶模糊的描述，生成 3 個引導式問題
+    draft：相似構想先前的問卷，當作草稿讓模型調整 (find_similar_project 找到的結果)
+    regenerate=True 時略過快取 (使用者選擇重新分析)，新的結果仍會寫回快取。
+    """
+    api_key = api_key or get_api_key()
+    if not api_key: return {"error": "API Key 遺失"}
+
+    prompt = _interview_prompt(project_name, project_desc, draft)
+    cached = None if regenerate else _cache_lookup("interview", prompt)
+    if cached:
+        return cached
+
     try:
-        res_json, _ = call_gemini_api_robust(prompt, api_key)
-        text = res_json['candidates'][0]['content']['parts'][0]['text']
-        # 清理 JSON 字串 (避免 AI 加上 ```json ...)
-        text = text.replace("```json", "").replace("```", "").strip()
-        return json.loads(text)
+        res_json, _, _ = _call_model(prompt, api_key, schema=INTERVIEW_SCHEMA, kind="interview")
+        questions = _parse_interview(res_json)
+        _cache_store("interview", prompt, questions)
+        return questions
     except Exception as e:
-        return {"error": f"問卷生成失敗: {str(e)}"}
+        return _failure(e, f"問卷生成失敗: {str(e)}")
+
+@telemetry.traced("interview")
+async def agenerate_interview_questions(project_name, project_desc, api_key=None, draft=None):
+    """generate_interview_questions 的 asyncio 版本"""
+    api_key = api_key or get_api_key()
+    if not api_key: return {"error": "API Key 遺失"}
+
+    prompt = _interview_prompt(project_name, project_desc, draft)
+    cached = _cache_lookup("interview", prompt)
+    if cached:
+        return cached
+
+    try:
+        res_json, model = await call_gemini_api_robust_async(prompt, api_key, INTERVIEW_SCHEMA, _deadline("interview"))
+        telemetry.annotate(model=model)
+        questions = _parse_interview(res_json)
+        _cache_store("interview", prompt, questions)
+        return questions
+    except Exception as e:
+        return _failure(e, f"問卷生成失敗: {str(e)}")
 
 # ==========================================
 # 👇 功能 2: 生成藍圖 (雙語版)
 # ==========================================
-def generate_blueprint(full_requirements):
-    api_key = get_api_key()
-    if not api_key: return {"error": "API Key 遺失"}
-
-    prompt_text = f"""
+def _blueprint_prompt(full_requirements):
+    return f"""
     你是一位菁英軟體架構師。請根據以下完整的訪談需求，生成標準的軟體開發文件。
     
     【需求訪談紀錄】：
-    {full_requirements}
+    {context_builder.pack_requirements(full_requirements, "blueprint", MODEL_CANDIDATES)}
 
     【輸出要求】：
     1. **請務必使用「繁體中文 (Traditional Chinese) + 英文 (English)」雙語對照。**
@@ -146,37 +863,252 @@ def generate_blueprint(full_requirements):
     ====FILE: TODOLIST.md====
     (內容...)
     """
-    
+
+BLUEPRINT_FILES = ["README.md", "SPEC.md", "REPORT.md", "TODOLIST.md"]
+
+def _blueprint_files(sections):
+    """
+    補齊四個預期檔案 (缺少的標示遺失)，模型多給的額外檔案也一併保留；
+    額外檔名不是單純檔名 (含路徑、.. 等) 的直接丟棄，不會進到畫面、專案庫與匯出檔
+    """
+    files = {k: sections.get(k, f"⚠️ {k} 生成遺失") for k in BLUEPRINT_FILES}
+    for k, v in sections.items():
+        if section_parser.is_safe_name(k):
+            files.setdefault(k, v)
+    return files
+
+def _parse_blueprint(res_json):
+    return _blueprint_files(_parse_sections(_response_text(res_json), BLUEPRINT_FILES, "blueprint"))
+
+def _blueprint_complete(files):
+    return all(not files[k].startswith("⚠️") for k in BLUEPRINT_FILES)
+
+@telemetry.traced("blueprint")
+def generate_blueprint(full_requirements, api_key=None):
+    api_key = api_key or get_api_key()
+    if not api_key: return {"error": "API Key 遺失"}
+
+    prompt_text = _blueprint_prompt(full_requirements)
+    cached = _cache_lookup("blueprint", prompt_text)
+    if cached: return cached
+
+    try:
+        res_json, model, race = _call_model(prompt_text, api_key, schema=_sections_schema(), kind="blueprint")
+        files = _parse_blueprint(res_json)
+        files["_model_used"] = model
+        if _blueprint_complete(files):
+            _cache_store("blueprint", prompt_text, files)
+        if race:
+            files["_race"] = race
+        return files
+    except Exception as e:
+        return _failure(e)
+
+def generate_blueprint_stream(full_requirements, api_key=None, on_file_complete=None):
+    """
+    串流版 generate_blueprint：每收到一段內容就產生一次進度 dict
+    {"files": 目前內容, "completed": 已收完的檔名, "model": 模型, "done": False}。
+    最後一次 done=True，"result" 為與 generate_blueprint 相同格式的結果。
+    on_file_complete(name, completed_files)：每個檔案區塊結束時呼叫 (例如 SPEC 一完成就預先生成架構)。
+    """
+    state = {"files": {}, "completed": [], "model": None, "done": False, "result": None}
+    api_key = api_key or get_api_key()
+    if not api_key:
+        state.update(done=True, result={"error": "API Key 遺失"})
+        yield state
+        return
+
+    with telemetry.span("blueprint", mode="stream"):
+        prompt_text = _blueprint_prompt(full_requirements)
+        cached = _cache_lookup("blueprint", prompt_text)
+        if cached:
+            # 快取命中：直接給出完整結果，不必再串流
+            files = {k: cached[k] for k in BLUEPRINT_FILES}
+            state.update(files=files, completed=list(files), model=cached.get("_model_used"), done=True, result=cached)
+        else:
+            parser = section_parser.StreamingSectionParser()
+            state["completed"] = parser.completed
+            raw = []
+            try:
+                for model_name, chunk in call_gemini_api_stream(prompt_text, api_key, _deadline("blueprint")):
+                    if state["model"] is None:
+                        telemetry.annotate(model=model_name)
+                    state["model"] = model_name
+                    raw.append(chunk)
+                    events = parser.feed(chunk)
+                    touched = {event[1] for event in events}
+                    if touched:
+                        for name in filter(section_parser.is_safe_name, touched):
+                            state["files"][name] = parser.text(name)
+                        _notify_completed(events, parser, on_file_complete)
+                        yield state
+                events = parser.close()
+                for name in filter(section_parser.is_safe_name, {event[1] for event in events}):
+                    state["files"][name] = parser.text(name)
+                _notify_completed(events, parser, on_file_complete)
+
+                sections = parser.sections()
+                if any(k not in sections for k in BLUEPRINT_FILES):
+                    # 有檔案沒出現 (通常是標記寫歪)：用完整回應在本機修復一次
+                    sections = _parse_sections("".join(raw), BLUEPRINT_FILES, "blueprint")
+                files = _blueprint_files(sections)
+                files["_model_used"] = state["model"]
+                if _blueprint_complete(files):
+                    _cache_store("blueprint", prompt_text, files)
+                result = files
+            except Exception as e:
+                result = _failure(e)
+            state.update(done=True, result=result)
+
+    # 最後一次 yield 放在 span 外：呼叫端拿到結果後直接關閉 generator 不算取消
+    yield state
+
+def _notify_completed(events, parser, on_file_complete):
+    if on_file_complete is None:
+        return
+    for event in events:
+        if event[0] == "end":
+            completed = {name: parser.text(name).strip() for name in parser.completed
+                         if section_parser.is_safe_name(name)}
+            on_file_complete(event[1], completed)
+
+@telemetry.traced("blueprint")
+async def agenerate_blueprint(full_requirements, api_key=None):
+    """generate_blueprint 的 asyncio 版本"""
+    api_key = api_key or get_api_key()
+    if not api_key: return {"error": "API Key 遺失"}
+
+    prompt_text = _blueprint_prompt(full_requirements)
+    cached = _cache_lookup("blueprint", prompt_text)
+    if cached: return cached
+
     try:
-        res_json, model = call_gemini_api_robust(prompt_text, api_key)
-        text = res_json['candidates'][0]['content']['parts'][0]['text']
-        
-        files = {}
-        patterns = {
-            "README.md": r"====FILE: README\.md====\n(.*?)(?====FILE:|$)",
-            "SPEC.md": r"====FILE: SPEC\.md====\n(.*?)(?====FILE:|$)",
-            "REPORT.md": r"====FILE: REPORT\.md====\n(.*?)(?====FILE:|$)",
-            "TODOLIST.md": r"====FILE: TODOLIST\.md====\n(.*?)(?====FILE:|$)",
-        }
-        for k, v in patterns.items():
-            match = re.search(v, text, re.DOTALL)
-            files[k] = match.group(1).strip() if match else f"⚠️ {k} 生成遺失"
-            
+        res_json, model = await call_gemini_api_robust_async(prompt_text, api_key, _sections_schema(),
+                                                    _deadline("blueprint"))
+        telemetry.annotate(model=model)
+        files = _parse_blueprint(res_json)
         files["_model_used"] = model
+        if _blueprint_complete(files):
+            _cache_store("blueprint", prompt_text, files)
         return files
     except Exception as e:
-        return {"error": str(e)}
+        return _failure(e)
 
 # ==========================================
-# 👇 功能 3: 生成結構圖 (雙語版)
+# 👇 功能 2b: 平行模式 (每份文件各自一個請求) & 單一文件重新生成
 # ==========================================
-def generate_structure(context_text):
-    api_key = get_api_key()
-    if not api_key: return {"STRUCTURE.txt": "Key Error", "FLOW.mermaid": ""}
+DOCUMENT_GUIDES = {
+    "README.md": "專案簡介、核心功能、技術選型與快速開始",
+    "SPEC.md": "系統規格：功能需求、資料模型、API 設計，並包含 Mermaid 架構圖",
+    "REPORT.md": "可行性與技術評估報告：風險、成本、時程與建議",
+    "TODOLIST.md": "開發待辦清單：依開發階段分組的 checkbox 任務",
+}
 
-    prompt = f"""
+def _document_prompt(full_requirements, name):
+    return f"""
+    你是一位菁英軟體架構師。請根據以下完整的訪談需求，撰寫軟體開發文件中的 {name}。
+    
+    【需求訪談紀錄】：
+    {context_builder.pack_requirements(full_requirements, "blueprint", MODEL_CANDIDATES)}
+
+    【輸出要求】：
+    1. **請務必使用「繁體中文 (Traditional Chinese) + 英文 (English)」雙語對照。**
+    2. 內容：{DOCUMENT_GUIDES.get(name, name)}。
+    3. 只輸出這一份文件，不要包含其他文件。
+    
+    【請嚴格依照以下格式輸出】：
+    ====FILE: {name}====
+    (內容...)
+    """
+
+def _parse_document(res_json, name):
+    text = _response_text(res_json)
+    sections = _parse_sections(text, [name], "document")
+    if name in sections:
+        return sections[name]
+    # 模型省略了區塊標記：整份回應就是文件內容
+    return text.strip()
+
+def generate_document(full_requirements, name, api_key=None, cancel_event=None, regenerate=False):
+    """
+    單獨生成一份藍圖文件，回傳 {name: 內容, "_model_used": 模型}。
+    regenerate=True 時略過快取 (使用者要求重新生成)，新的結果仍會寫回快取。
+    """
+    api_key = api_key or get_api_key()
+    if not api_key: return {"error": "API Key 遺失"}
+
+    prompt_text = _document_prompt(full_requirements, name)
+    with telemetry.span("document", document=name, regenerate=regenerate):
+        cached = None if regenerate else _cache_lookup("document", prompt_text)
+        if cached: return cached
+
+        try:
+            res_json, model, _ = _call_model(prompt_text, api_key, cancel_event, _sections_schema(), "document")
+            content = _parse_document(res_json, name)
+            if not content:
+                raise Exception(f"{name} 內容為空")
+            result = {name: content, "_model_used": model}
+            _cache_store("document", prompt_text, result)
+            return result
+        except Exception as e:
+            return _failure(e)
+
+def generate_blueprint_parallel(full_requirements, api_key=None, on_file_complete=None, on_progress=None,
+                                cancel_event=None):
+    """
+    平行模式：四份文件各自一個請求同時送出，總耗時約等於最慢的那一份。
+    某一份失敗只會標示遺失 (其餘照常回傳)，之後可以在 Stage 2 單獨重新生成。
+    on_file_complete(name, completed_files) / on_progress(files, completed)：每完成一份就呼叫。
+    回傳格式與 generate_blueprint 相同；"_models" 記錄每份文件使用的模型，"_errors" 記錄失敗原因。
+    """
+    api_key = api_key or get_api_key()
+    if not api_key: return {"error": "API Key 遺失"}
+
+    files, models, errors = {}, {}, {}
+    deadline = None     # 有文件因為時間預算用完而失敗時記下預算秒數
+    with telemetry.span("blueprint", mode="parallel"):
+        pool = ThreadPoolExecutor(max_workers=len(BLUEPRINT_FILES), thread_name_prefix="gemini-doc")
+        try:
+            # 每份文件複製一次 contextvars (限流的 session、量測的 span)
+            futures = {
+                pool.submit(contextvars.copy_context().run, generate_document,
+                            full_requirements, name, api_key, cancel_event): name
+                for name in BLUEPRINT_FILES
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                result = future.result()
+                if "error" in result:
+                    errors[name] = result["error"]
+                    deadline = result.get("_deadline", deadline)
+                    continue
+                files[name] = result[name]
+                models[name] = result.get("_model_used")
+                if on_progress is not None:
+                    on_progress(dict(files), [k for k in BLUEPRINT_FILES if k in files])
+                if on_file_complete is not None:
+                    on_file_complete(name, dict(files))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        if not files:
+            error = next(iter(errors.values()), "生成失敗")
+            telemetry.fail(error)
+            return {"error": error, "_deadline": deadline} if deadline else {"error": error}
+        result = _blueprint_files(files)
+        result["_model_used"] = ", ".join(dict.fromkeys(models[k] for k in BLUEPRINT_FILES if k in models))
+        result["_models"] = models
+        if errors:
+            result["_errors"] = errors
+        return result
+
+# ==========================================
+# 👇 功能 3: 生成結構圖 (雙語版)
+# ==========================================
+def _structure_prompt(context_text):
+    return f"""
     你是一位資深全端工程師。根據以下規格：
-    {context_text[:6000]}
+    {context_builder.pack_document(context_text, "structure", MODEL_CANDIDATES)}
     
     請設計實體架構與運作流程。
     請務必使用「繁體中文 + 英文」雙語進行資料夾結構的註解說明。
@@ -187,32 +1119,73 @@ def generate_structure(context_text):
     ====FILE: FLOW.mermaid====
     (Mermaid sequenceDiagram)
     """
-    
+
+STRUCTURE_FILES = ["STRUCTURE.txt", "FLOW.mermaid"]
+
+def _parse_structure(res_json):
+    sections = _parse_sections(_response_text(res_json), STRUCTURE_FILES, "structure")
+    result = {}
+    for k in STRUCTURE_FILES:
+        if k in sections:
+            result[k] = sections[k].replace("```mermaid", "").replace("```", "")
+        else:
+            result[k] = "生成失敗"
+    for k, v in sections.items():
+        if section_parser.is_safe_name(k):
+            result.setdefault(k, v)
+    return result
+
+def _structure_complete(result):
+    return all(v != "生成失敗" for v in result.values())
+
+@telemetry.traced("structure")
+def generate_structure(context_text, api_key=None, cancel_event=None, regenerate=False):
+    """regenerate=True 時略過快取 (使用者再按一次 Step 2)，新的結果仍會寫回快取"""
+    api_key = api_key or get_api_key()
+    if not api_key: return {"STRUCTURE.txt": "Key Error", "FLOW.mermaid": ""}
+
+    prompt = _structure_prompt(context_text)
+    cached = None if regenerate else _cache_lookup("structure", prompt)
+    if cached: return cached
+
     try:
-        res_json, _ = call_gemini_api_robust(prompt, api_key)
-        text = res_json['candidates'][0]['content']['parts'][0]['text']
-        result = {}
-        patterns = {
-            "STRUCTURE.txt": r"====FILE: STRUCTURE\.txt====\n(.*?)(?====FILE:|$)",
-            "FLOW.mermaid": r"====FILE: FLOW\.mermaid====\n(.*?)(?====FILE:|$)",
-        }
-        for k, v in patterns.items():
-            match = re.search(v, text, re.DOTALL)
-            if match:
-                result[k] = match.group(1).strip().replace("```mermaid", "").replace("```", "")
-            else:
-                result[k] = "生成失敗"
+        res_json, _, _ = _call_model(prompt, api_key, cancel_event, _sections_schema(), "structure")
+        result = _parse_structure(res_json)
+        if _structure_complete(result):
+            _cache_store("structure", prompt, result)
         return result
     except Exception as e:
-        return {"STRUCTURE.txt": f"Error: {e}", "FLOW.mermaid": ""}
+        telemetry.fail(_describe(e))
+        return {"STRUCTURE.txt": f"Error: {_describe(e)}", "FLOW.mermaid": ""}
+
+@telemetry.traced("structure")
+async def agenerate_structure(context_text, api_key=None):
+    """generate_structure 的 asyncio 版本"""
+    api_key = api_key or get_api_key()
+    if not api_key: return {"STRUCTURE.txt": "Key Error", "FLOW.mermaid": ""}
+
+    prompt = _structure_prompt(context_text)
+    cached = _cache_lookup("structure", prompt)
+    if cached: return cached
+
+    try:
+        res_json, model = await call_gemini_api_robust_async(prompt, api_key, _sections_schema(), _deadline("structure"))
+        telemetry.annotate(model=model)
+        result = _parse_structure(res_json)
+        if _structure_complete(result):
+            _cache_store("structure", prompt, result)
+        return result
+    except Exception as e:
+        telemetry.fail(_describe(e))
+        return {"STRUCTURE.txt": f"Error: {_describe(e)}", "FLOW.mermaid": ""}
 
 # ==========================================
 # 👇 功能 4: 下載打包
 # ==========================================
-def create_zip_download(files_dict):
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-        for filename, content in files_dict.items():
-            if not filename.startswith("_"): 
-                zip_file.writestr(filename, content)
-    return zip_buffer.getvalue()
+def create_zip_download(files_dict, structure_res=None, fmt="zip"):
+    """
+    打包藍圖文件 (以及架構產出)。內容沒變時直接回傳快取的壓縮檔，
+    只有改過的檔案才會重新壓縮。fmt: zip / zip-store (不壓縮) / tar.gz
+    """
+    files = export_builder.collect_files(files_dict, structure_res)
+    return export_builder.builder.build(files, fmt)
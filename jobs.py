@@ -0,0 +1,205 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# 👇 背景工作佇列 (Job Queue)
+# ==========================================
+# 生成工作 (問卷 / 藍圖 / 架構) 交給整個 process 共用的有限 worker pool 執行，
+# 不再佔用 Streamlit 的 script thread。工作以 (session_id, idempotency token) 為 key：
+# - 同一個 token 重複送出 (rerun、連點) 只會有一個工作
+# - rerun、切換分頁、斷線重連之後，UI 用同一個 key 輪詢就能拿到結果
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """佇列已滿或這個 session 同時進行的工作太多"""
+
+
+class Job:
+    """單一背景工作；progress 由 worker 更新 (整個 dict 替換，讀取端不需要鎖)"""
+
+    def __init__(self, session_id, token, kind, meta=None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.token = token
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def is_finished(self):
+        return self.status in FINISHED
+
+    def to_dict(self):
+        return {
+            "id": self.id, "kind": self.kind, "token": self.token, "status": self.status,
+            "error": self.error, "created": self.created, "started": self.started, "finished": self.finished,
+        }
+
+
+class JobManager:
+    """
+    max_workers：同時執行的工作數 (= 同時對 Gemini 發出的生成數)
+    max_queue：排隊中工作的上限，超過就拒絕 (QueueFull)
+    max_per_session：單一 session 同時排隊 + 執行中的上限
+    retention：完成的工作保留秒數 (讓重連的使用者還拿得到結果)
+    """
+
+    def __init__(self, max_workers=4, max_queue=64, max_per_session=3, retention=3600):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._lock = threading.Lock()
+        self._jobs = {}     # (session_id, token) -> Job
+        self._counters = {"submitted": 0, "deduplicated": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+
+    def submit(self, session_id, kind, token, fn, *args, meta=None, **kwargs):
+        """
+        送出工作；fn(job, *args, **kwargs) 在 worker thread 執行，回傳值即為結果。
+        相同 (session_id, token) 且尚未失敗/取消的工作會直接回傳既有的 Job。
+        """
+        with self._lock:
+            self._collect_garbage()
+            existing = self._jobs.get((session_id, token))
+            if existing is not None and existing.status not in (FAILED, CANCELLED):
+                self._counters["deduplicated"] += 1
+                return existing
+
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if queued >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise QueueFull(f"目前排隊工作已達上限 ({self.max_queue})，請稍後再試")
+            active = sum(1 for j in self._jobs.values() if j.session_id == session_id and not j.is_finished())
+            if active >= self.max_per_session:
+                self._counters["rejected"] += 1
+                raise QueueFull(f"您同時進行的工作已達上限 ({self.max_per_session})，請等待目前的工作完成")
+
+            job = Job(session_id, token, kind, meta)
+            self._jobs[(session_id, token)] = job
+            self._counters["submitted"] += 1
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            result = fn(job, *args, **kwargs)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, CANCELLED if job.cancelled else FAILED)
+            return
+        job.result = result
+        self._finish(job, CANCELLED if job.cancelled else DONE)
+
+    def _finish(self, job, status):
+        job.finished = time.time()
+        job.status = status
+        with self._lock:
+            self._counters[status] += 1
+
+    def get(self, session_id, token):
+        with self._lock:
+            return self._jobs.get((session_id, token))
+
+    def jobs_for(self, session_id, kind=None):
+        """這個 session 的所有工作，新的在前"""
+        with self._lock:
+            jobs = [j for (sid, _), j in self._jobs.items() if sid == session_id and (kind is None or j.kind == kind)]
+        return sorted(jobs, key=lambda j: j.created, reverse=True)
+
+    def latest(self, session_id, kind, status=None):
+        for job in self.jobs_for(session_id, kind):
+            if status is None or job.status == status:
+                return job
+        return None
+
+    def queue_position(self, job):
+        """排隊中的工作前面還有幾個 (1 = 下一個執行)；已開始或結束回傳 None"""
+        if job.status != QUEUED:
+            return None
+        with self._lock:
+            return 1 + sum(1 for j in self._jobs.values() if j.status == QUEUED and j.created < job.created)
+
+    def discard(self, session_id, token):
+        """移除已結束的工作 (之後用同一個 token 送出會重新執行)"""
+        with self._lock:
+            job = self._jobs.get((session_id, token))
+            if job is not None and job.is_finished():
+                del self._jobs[(session_id, token)]
+
+    def cancel(self, session_id, token):
+        job = self.get(session_id, token)
+        if job is not None and not job.is_finished():
+            job.cancel_event.set()
+        return job
+
+    def cancel_session(self, session_id, kind=None):
+        for job in self.jobs_for(session_id, kind):
+            if not job.is_finished():
+                job.cancel_event.set()
+
+    def metrics(self):
+        with self._lock:
+            statuses = [j.status for j in self._jobs.values()]
+            metrics = dict(self._counters)
+        metrics.update(
+            queued=statuses.count(QUEUED),
+            running=statuses.count(RUNNING),
+            max_workers=self.max_workers,
+            max_queue=self.max_queue,
+            retained=len(statuses),
+        )
+        return metrics
+
+    def _collect_garbage(self):
+        now = time.time()
+        expired = [k for k, j in self._jobs.items() if j.is_finished() and now - j.finished > self.retention]
+        for key in expired:
+            del self._jobs[key]
+
+
+# 全域唯一的工作管理器 (整個 process 共用)
+manager = JobManager()
+
+_configured = {}
+
+
+def configure(max_workers=4, max_queue=64, max_per_session=3, retention=3600):
+    """調整上限；worker 數變動時建立新的 pool (進行中的工作不受影響)"""
+    global manager
+    settings = dict(max_workers=max_workers, max_queue=max_queue, max_per_session=max_per_session, retention=retention)
+    if settings == _configured:
+        return manager
+    if manager.max_workers != max_workers:
+        old = manager
+        manager = JobManager(**settings)
+        with old._lock:
+            manager._jobs.update(old._jobs)
+        old._executor.shutdown(wait=False)
+    else:
+        manager.max_queue = max_queue
+        manager.max_per_session = max_per_session
+        manager.retention = retention
+    _configured.clear()
+    _configured.update(settings)
+    return manager
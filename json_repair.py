@@ -0,0 +1,253 @@
+import json
+import re
+import threading
+
+# ==========================================
+# 👇 容錯 JSON 解析 (修復「差一點」的模型回應)
+# ==========================================
+# 模型偶爾會在 JSON 前後加說明文字、多一個逗號、少一個逗號、用單引號 / 全形引號，
+# 或是輸出到一半被截斷。原本 json.loads 一失敗整個生成就算失敗，使用者只能再按一次 (又耗一次額度)。
+# 這裡先照常解析；失敗才在本機修復後再解析，最後還可以只用正規表示式撈出指定欄位。
+
+_FENCE = re.compile(r"^[ \t]*```[a-zA-Z]*[ \t]*$", re.MULTILINE)
+_OPEN_QUOTES = {'"': '"', "'": "'", "“": "”", "”": "”"}
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$")
+_BARE = re.compile(r"[A-Za-z0-9_.+\-$]+")
+
+stats = {"clean": 0, "repaired": 0, "extracted": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+class RepairFailed(ValueError):
+    """修復後仍然無法取得需要的資料 (呼叫端只能重新生成)"""
+
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def snapshot():
+    with _stats_lock:
+        return dict(stats)
+
+
+class _Repairer:
+    """
+    單次掃描重寫成合法 JSON：每一層容器記住目前期待的東西
+    (物件："key" -> "colon" -> "value" -> "comma"；陣列："value" -> "comma")，
+    缺的逗號 / 冒號補上，多的逗號拿掉，沒加引號的 key 或字串補上引號，截斷的結尾補齊。
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.out = []
+        self.stack = []     # [容器類型 "{" 或 "[", 期待狀態]
+
+    def run(self):
+        text = self.text
+        while self.pos < len(text):
+            ch = text[self.pos]
+            if ch.isspace():
+                self.pos += 1
+            elif text.startswith("//", self.pos) or ch == "#":
+                end = text.find("\n", self.pos)
+                self.pos = len(text) if end == -1 else end
+            elif text.startswith("/*", self.pos):
+                end = text.find("*/", self.pos + 2)
+                self.pos = len(text) if end == -1 else end + 2
+            elif ch in "{[":
+                self._before_value()
+                self.out.append(ch)
+                self.stack.append([ch, "key" if ch == "{" else "value"])
+                self.pos += 1
+            elif ch in "}]":
+                self._close()
+                self.pos += 1
+                if not self.stack:
+                    break   # 最外層的值結束了，後面的說明文字不要
+            elif ch == ",":
+                if self.stack and self.stack[-1][1] == "comma":
+                    self.out.append(",")
+                    self.stack[-1][1] = "key" if self.stack[-1][0] == "{" else "value"
+                self.pos += 1
+            elif ch in ":：":
+                if self.stack and self.stack[-1][1] == "colon":
+                    self.out.append(":")
+                    self.stack[-1][1] = "value"
+                self.pos += 1
+            elif ch in _OPEN_QUOTES:
+                self._string(_OPEN_QUOTES[ch])
+            else:
+                match = _BARE.match(text, self.pos)
+                if match is None:
+                    self.pos += 1   # 其他符號：略過
+                    continue
+                self.pos = match.end()
+                self._bare(match.group(0))
+        return self._finish()
+
+    # ---------- 值 ----------
+    def _before_value(self):
+        """準備輸出一個值 (或 key)：補上缺少的逗號 / 冒號"""
+        if not self.stack:
+            return
+        frame = self.stack[-1]
+        if frame[1] == "comma":
+            self.out.append(",")
+            frame[1] = "key" if frame[0] == "{" else "value"
+        elif frame[1] == "colon":
+            self.out.append(":")
+            frame[1] = "value"
+
+    def _after_token(self):
+        if not self.stack:
+            return
+        frame = self.stack[-1]
+        frame[1] = "colon" if frame[1] == "key" else "comma"
+
+    def _emit_scalar(self, json_text):
+        self._before_value()
+        self.out.append(json_text)
+        self._after_token()
+
+    def _string(self, closing):
+        text = self.text
+        self.pos += 1
+        chars = []
+        while self.pos < len(text):
+            ch = text[self.pos]
+            if ch == "\\" and self.pos + 1 < len(text):
+                chars.append(text[self.pos:self.pos + 2])
+                self.pos += 2
+                continue
+            if ch == closing or (closing == "”" and ch == '"'):
+                self.pos += 1
+                break
+            if ch == "\n":
+                chars.append("\\n")
+            elif ch == "\t":
+                chars.append("\\t")
+            elif ch == '"':
+                chars.append('\\"')     # 單引號 / 全形引號字串裡的雙引號
+            else:
+                chars.append(ch)
+            self.pos += 1
+        self._emit_scalar('"' + "".join(chars) + '"')
+
+    def _bare(self, word):
+        expecting_key = self.stack and self.stack[-1][1] in ("key", "comma") and self.stack[-1][0] == "{"
+        if not expecting_key and word in _LITERALS:
+            self._emit_scalar(_LITERALS[word])
+        elif not expecting_key and _NUMBER.match(word):
+            self._emit_scalar(word)
+        else:
+            self._emit_scalar(json.dumps(word))
+
+    # ---------- 容器 ----------
+    def _drop_trailing_comma(self):
+        if self.out and self.out[-1] == ",":
+            self.out.pop()
+
+    def _close(self):
+        if not self.stack:
+            return
+        kind, state = self.stack.pop()
+        if state == "colon":
+            self.out.append(":null")
+        elif state == "value" and kind == "{":
+            self.out.append("null")
+        self._drop_trailing_comma()
+        self.out.append("}" if kind == "{" else "]")
+        self._after_token()
+
+    def _finish(self):
+        # 回應被截斷：把還開著的容器依序關上
+        while self.stack:
+            self._close()
+        return "".join(self.out)
+
+
+def _strip_wrapping(text):
+    """去掉 ``` 標記，從第一個 { 或 [ 開始 (前面的說明文字不要)"""
+    text = _FENCE.sub("", text or "").strip().lstrip("﻿")
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return text[min(starts):] if starts else text
+
+
+def repair(text):
+    """把接近 JSON 的文字修成合法的 JSON 字串"""
+    return _Repairer(_strip_wrapping(text)).run()
+
+
+def loads(text):
+    """
+    回傳 (資料, 是否經過修復)。先照常 json.loads；失敗才修復後再解析。
+    修復後仍無法解析時丟出 RepairFailed。
+    """
+    try:
+        value = json.loads(text)
+        _count("clean")
+        return value, False
+    except (TypeError, ValueError):
+        pass
+    try:
+        value = json.loads(_strip_wrapping(text))
+        _count("clean")
+        return value, False
+    except (TypeError, ValueError):
+        pass
+    try:
+        value = json.loads(repair(text))
+    except ValueError as e:
+        _count("failed")
+        raise RepairFailed(f"JSON 無法修復: {e}") from e
+    _count("repaired")
+    return value, True
+
+
+def extract_fields(text, keys):
+    """
+    最後手段：不管整體結構，直接找出 "key": "value" 形式的欄位 (引號可以是單引號或全形)。
+    回傳找得到的 {key: value}。
+    """
+    found = {}
+    for key in keys:
+        match = re.search(
+            rf"""["'“]?{re.escape(key)}["'”]?\s*[:：]\s*["'“]((?:\\.|[^"'”\\])*)""", text or "",
+        )
+        if match:
+            value = match.group(1)
+            try:
+                value = json.loads(f'"{value}"')
+            except ValueError:
+                pass
+            found[key] = value.strip()
+    if found:
+        _count("extracted")
+    return found
+
+
+def loads_object(text, keys=()):
+    """
+    解析必須包含 keys 的 JSON 物件，回傳 (dict, 是否經過修復)。
+    結構修不好或缺少欄位時改用 extract_fields 補齊；仍缺任何一個欄位就丟出 RepairFailed
+    (不完整的結果不能被快取或當成修復成功)。
+    """
+    try:
+        value, repaired = loads(text)
+    except RepairFailed:
+        value, repaired = None, True
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    if isinstance(value, dict) and all(k in value for k in keys):
+        return value, repaired
+    found = extract_fields(text, keys)
+    merged = dict(value) if isinstance(value, dict) else {}
+    merged.update({k: v for k, v in found.items() if k not in merged})
+    missing = [k for k in keys if k not in merged]
+    if not merged or missing:
+        raise RepairFailed(f"回應中找不到需要的欄位: {', '.join(missing or keys)}")
+    return merged, True
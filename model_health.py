@@ -0,0 +1,178 @@
+import hashlib
+import threading
+import time
+from collections import deque
+
+# ==========================================
+# 👇 模型健康度登錄表 (整個 Process 共用)
+# ==========================================
+# Streamlit 每個 session 都是同一個 Python process 裡的不同 thread，
+# 模組層級的物件只會被 import 一次，所以這裡的狀態會被所有使用者共用。
+# 404 只代表「這組 Key 目前看不到這個模型」(帳號權限、預覽版暫時下架)，所以依 Key 分開記錄，
+# 而且是長時間冷卻而不是永久移除。
+
+NOT_FOUND_COOLDOWN = 3600.0 # 404：這組 Key 冷卻一小時
+RATE_LIMIT_COOLDOWN = 60.0  # 429：額度用完，冷卻 60 秒
+UNAVAILABLE_COOLDOWN = 20.0 # 503：服務忙碌，短暫冷卻
+FAILURE_COOLDOWN = 10.0     # 連續例外 (逾時/斷線) 達門檻後的冷卻
+FAILURE_THRESHOLD = 3
+LATENCY_WINDOW = 50         # 每個模型保留最近 N 筆成功延遲
+
+
+class ModelHealth:
+    """單一模型的健康狀態"""
+
+    def __init__(self, name):
+        self.name = name
+        self.not_found = {}     # Key 指紋 -> 404 冷卻結束時間
+        self.cooldown_until = 0.0
+        self.last_status = None
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def available_at(self, key_id):
+        """這組 Key 什麼時候可以再使用這個模型 (429 / 503 / 例外的冷卻對所有 Key 都有效)"""
+        return max(self.cooldown_until, self.not_found.get(key_id, 0.0))
+
+    def to_dict(self, now):
+        return {
+            "model": self.name,
+            "not_found_keys": sum(1 for until in self.not_found.values() if until > now),
+            "cooldown_left": max(0.0, self.cooldown_until - now) if self.cooldown_until else 0.0,
+            "last_status": self.last_status,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class ModelHealthRegistry:
+    """
+    記住每個模型的呼叫結果，讓 fallback 鏈跳過已知失效的模型。
+    - 404：這組 Key 長時間冷卻 (模型不存在或帳號無權限；其他 Key 不受影響)
+    - 429 / 503：進入冷卻，時間到自動放回候選清單
+    - 成功：記錄延遲 (p50 / p95)，並清除冷卻
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _get(self, name):
+        health = self._models.get(name)
+        if health is None:
+            health = self._models[name] = ModelHealth(name)
+        return health
+
+    def ordered(self, tiers, api_key=None):
+        """
+        依照 tiers (list of list) 的預設優先順序，回傳這次 (用 api_key) 該嘗試的模型清單。
+        同一個 Tier 內，最近連續失敗的模型往後排；不同 Tier 之間的順序不變。
+        若全部都在冷卻中，回傳完整清單、依「最快解除冷卻」排序 (總比一個都不試好)。
+        """
+        now = self._clock()
+        key_id = _key_id(api_key)
+        result = []
+        cooling = []
+        with self._lock:
+            for tier in tiers:
+                available = []
+                for position, name in enumerate(tier):
+                    health = self._get(name)
+                    until = health.available_at(key_id)
+                    if until <= now:
+                        available.append((health.consecutive_failures, position, name))
+                    else:
+                        cooling.append((until, name))
+                available.sort()
+                result.extend(name for _, _, name in available)
+        if not result and cooling:
+            cooling.sort()
+            result = [name for _, name in cooling]
+        return result
+
+    def record_success(self, name, latency):
+        with self._lock:
+            health = self._get(name)
+            health.last_status = 200
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.cooldown_until = 0.0
+            health.latencies.append(latency)
+
+    def record_status(self, name, status_code, retry_after=None, api_key=None):
+        """記錄非 200 的 HTTP 狀態碼，並決定冷卻多久 (404 只影響這組 Key)"""
+        now = self._clock()
+        with self._lock:
+            health = self._get(name)
+            health.last_status = status_code
+            health.failures += 1
+            health.consecutive_failures += 1
+            if status_code == 404:
+                health.not_found[_key_id(api_key)] = now + NOT_FOUND_COOLDOWN
+            elif status_code == 429:
+                health.cooldown_until = now + (retry_after or RATE_LIMIT_COOLDOWN)
+            elif status_code == 503:
+                health.cooldown_until = now + (retry_after or UNAVAILABLE_COOLDOWN)
+
+    def record_failure(self, name, error=None):
+        """記錄例外 (逾時、連線中斷…)，連續失敗達門檻才冷卻"""
+        now = self._clock()
+        with self._lock:
+            health = self._get(name)
+            health.last_status = "error"
+            health.failures += 1
+            health.consecutive_failures += 1
+            if health.consecutive_failures >= FAILURE_THRESHOLD:
+                health.cooldown_until = now + FAILURE_COOLDOWN
+
+    def latency_percentile(self, name, pct, min_samples=1):
+        """最近成功延遲的百分位數；紀錄少於 min_samples 筆時回傳 None (樣本太少不可靠)"""
+        with self._lock:
+            health = self._models.get(name)
+            if health is None or len(health.latencies) < min_samples:
+                return None
+            return health.percentile(pct)
+
+    def snapshot(self):
+        """回傳所有模型目前狀態 (給監控面板使用)"""
+        now = self._clock()
+        with self._lock:
+            return [h.to_dict(now) for h in self._models.values()]
+
+    def reset(self, name=None):
+        with self._lock:
+            if name is None:
+                self._models.clear()
+            else:
+                self._models.pop(name, None)
+
+
+def _key_id(api_key):
+    """登錄表只保存 Key 的指紋，不保存 Key 本身"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else ""
+
+
+def parse_retry_after(value):
+    """解析 Retry-After header (只處理秒數格式)"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds > 0 else None
+
+
+# 全域唯一的登錄表
+registry = ModelHealthRegistry()
@@ -0,0 +1,196 @@
+import hashlib
+
+import generator_engine as engine
+import jobs
+import rate_limiter
+
+# ==========================================
+# 👇 生成流程：背景工作 + 管線模式
+# ==========================================
+# 三個生成步驟都包成背景工作 (jobs.manager)，UI 只負責送出與輪詢。
+# 管線模式：藍圖串流時 SPEC 區塊一結束 (README 在它之前)，就以相同 token 送出架構工作；
+# 使用者進到 Stage 2 按下 Step 2 時，同一個 token 會直接拿到這個 (通常已完成的) 工作。
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def build_requirements(project_name, project_desc, ans_fe, ans_be, ans_db):
+    """訪談結果 -> 藍圖的需求文字 (UI 與批次模式共用，相同回答才會命中同一份快取)"""
+    return f"""
+            專案名稱：{project_name}
+            原始構想：{project_desc}
+            【訪談回答】：
+            1. 前端：{ans_fe}
+            2. 後端：{ans_be}
+            3. 資料庫：{ans_db}
+            """
+
+
+def interview_token(project_name, project_desc, draft=None):
+    """有草稿 (相似構想的問卷) 時 prompt 不同，視為另一個工作"""
+    return "interview:" + (_digest(project_name, project_desc, "draft") if draft else _digest(project_name, project_desc))
+
+
+def blueprint_token(full_requirements, parallel=False):
+    return "blueprint:" + (_digest(full_requirements, "parallel") if parallel else _digest(full_requirements))
+
+
+def document_token(full_requirements, name):
+    return f"document:{name}:" + _digest(full_requirements)
+
+
+def structure_context(files):
+    """Stage 2 與預先生成共用同一份輸入，才能用 token 判斷結果是否可沿用"""
+    return files.get("README.md", "") + "\n" + files.get("SPEC.md", "")
+
+
+def structure_token(files):
+    return "structure:" + _digest(structure_context(files))
+
+
+# ==========================================
+# 👇 Worker 端：在背景 thread 執行 (不能使用 st.session_state，API Key 需明確傳入)
+# ==========================================
+# 每個工作的請求都以 session_id 排隊，限流器才能在不同使用者之間公平輪流
+def _run_interview(job, project_name, project_desc, api_key, draft=None, regenerate=False):
+    with rate_limiter.session(job.session_id):
+        return engine.generate_interview_questions(
+            project_name, project_desc, api_key=api_key, draft=draft, regenerate=regenerate
+        )
+
+
+def _prefetch_callback(job, api_key, prefetch_structure):
+    """README 與 SPEC 都完成時預先送出架構工作 (之後每份文件完成都會再呼叫，相同 token 不會重複送出)"""
+    def on_file_complete(name, completed):
+        if prefetch_structure and {"README.md", "SPEC.md"} <= set(completed) and not job.cancelled:
+            _submit_structure_quietly(job.session_id, completed, api_key)
+    return on_file_complete
+
+
+def _run_blueprint(job, full_requirements, api_key, prefetch_structure):
+    on_file_complete = _prefetch_callback(job, api_key, prefetch_structure)
+
+    stream = engine.generate_blueprint_stream(full_requirements, api_key=api_key, on_file_complete=on_file_complete)
+    with rate_limiter.session(job.session_id):
+        try:
+            for state in stream:
+                if job.cancelled:
+                    # 關閉 generator 會一併關閉串流連線，上游請求立即中止
+                    return None
+                job.progress = {
+                    "files": dict(state["files"]),
+                    "completed": list(state["completed"]),
+                    "model": state["model"],
+                }
+                if state["done"]:
+                    result = state["result"]
+                    if prefetch_structure and "error" not in result:
+                        # 快取命中或 SPEC 缺漏時沒有觸發預先生成，這裡補上 (相同 token 不會重複)
+                        _submit_structure_quietly(job.session_id, result, api_key)
+                    return result
+        finally:
+            stream.close()
+
+
+def _run_blueprint_parallel(job, full_requirements, api_key, prefetch_structure):
+    def on_progress(files, completed):
+        job.progress = {"files": files, "completed": completed, "model": None}
+
+    with rate_limiter.session(job.session_id):
+        result = engine.generate_blueprint_parallel(
+            full_requirements, api_key=api_key, cancel_event=job.cancel_event,
+            on_file_complete=_prefetch_callback(job, api_key, prefetch_structure), on_progress=on_progress,
+        )
+    if prefetch_structure and "error" not in result and not job.cancelled:
+        _submit_structure_quietly(job.session_id, result, api_key)
+    return result
+
+
+def _run_document(job, full_requirements, name, api_key):
+    with rate_limiter.session(job.session_id):
+        return engine.generate_document(
+            full_requirements, name, api_key=api_key, cancel_event=job.cancel_event, regenerate=True
+        )
+
+
+def _run_structure(job, context_text, api_key, regenerate=False):
+    with rate_limiter.session(job.session_id):
+        return engine.generate_structure(
+            context_text, api_key=api_key, cancel_event=job.cancel_event, regenerate=regenerate
+        )
+
+
+def _submit_structure_quietly(session_id, files, api_key):
+    try:
+        submit_structure(session_id, files, api_key)
+    except jobs.QueueFull:
+        # 預先生成只是加速，佇列滿了就略過，使用者按 Step 2 時再生成
+        pass
+
+
+# ==========================================
+# 👇 UI 端：送出工作 (相同 token 重複送出只會得到同一個工作)
+# ==========================================
+def _discard_failed(session_id, token):
+    """上一次同 token 的工作以錯誤收場時，丟棄它讓使用者可以重試"""
+    job = jobs.manager.get(session_id, token)
+    if job is not None and job.is_finished() and (not job.result or "error" in job.result):
+        jobs.manager.discard(session_id, token)
+
+
+def submit_interview(session_id, project_name, project_desc, api_key, draft=None, project_id=None, regenerate=False):
+    """
+    draft：相似構想先前的問卷，讓模型以它為草稿調整。
+    project_id：結果要存進的專案 (記在 meta，重新連線時直接從專案庫重新開啟)
+    regenerate=True：使用者選擇重新分析，已完成的同 token 工作與快取都略過
+    """
+    token = interview_token(project_name, project_desc, draft)
+    if regenerate:
+        jobs.manager.discard(session_id, token)
+    _discard_failed(session_id, token)
+    return jobs.manager.submit(
+        session_id, "interview", token,
+        _run_interview, project_name, project_desc, api_key, draft, regenerate,
+        meta={"project_name": project_name, "project_desc": project_desc, "project_id": project_id},
+    )
+
+
+def submit_blueprint(session_id, full_requirements, api_key, prefetch_structure=True, parallel=False, project_id=None):
+    """parallel=True：四份文件各自一個請求同時生成 (總耗時約等於最慢的一份)；project_id 同 submit_interview"""
+    token = blueprint_token(full_requirements, parallel)
+    _discard_failed(session_id, token)
+    return jobs.manager.submit(
+        session_id, "blueprint", token,
+        _run_blueprint_parallel if parallel else _run_blueprint, full_requirements, api_key, prefetch_structure,
+        meta={"full_requirements": full_requirements, "project_id": project_id},
+    )
+
+
+def submit_document(session_id, full_requirements, name, api_key):
+    """Stage 2 單獨重新生成一份文件 (上一次的結果會被丟棄)"""
+    jobs.manager.discard(session_id, document_token(full_requirements, name))
+    return jobs.manager.submit(
+        session_id, "document", document_token(full_requirements, name),
+        _run_document, full_requirements, name, api_key,
+    )
+
+
+def submit_structure(session_id, files, api_key, regenerate=False):
+    """regenerate=True：已完成的同 token 工作會被丟棄，並略過快取重新生成 (使用者再按一次 Step 2)"""
+    if regenerate:
+        jobs.manager.discard(session_id, structure_token(files))
+    return jobs.manager.submit(
+        session_id, "structure", structure_token(files),
+        _run_structure, structure_context(files), api_key, regenerate,
+    )
+
+
+def cancel(session_id, token):
+    if token:
+        jobs.manager.cancel(session_id, token)
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# ==========================================
+# 👇 專案庫 (SQLite 中繼資料 + 壓縮檔案內容)
+# ==========================================
+# 原本生成的文件 (result_files / structure_res / questions) 整份放在每個 session 的 st.session_state：
+# 記憶體用量 = 使用者數 x 文件大小，而且開新專案或登出後就消失了。
+# 這裡把文件內容以 zlib 壓縮後依內容雜湊存成檔案 (相同內容只存一份)，中繼資料放 SQLite，
+# session_state 只留 Artifacts handle (檔名 -> 雜湊)，真的要顯示時才讀取解壓。
+# 另外以 FTS5 (trigram，中文不需斷詞) 建立全文索引，之前生成過的專案可以搜尋並重新開啟，不必再呼叫 API。
+
+DEFAULT_ROOT = ".project_store"
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS projects ("
+    " id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL,"
+    " full_requirements TEXT, session_id TEXT, created REAL NOT NULL, updated REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS artifacts ("
+    " project_id TEXT NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL,"
+    " digest TEXT NOT NULL, size INTEGER NOT NULL, updated REAL NOT NULL,"
+    " PRIMARY KEY (project_id, kind, name))",
+    "CREATE TABLE IF NOT EXISTS artifact_meta ("
+    " project_id TEXT NOT NULL, kind TEXT NOT NULL, meta TEXT NOT NULL,"
+    " PRIMARY KEY (project_id, kind))",
+    "CREATE INDEX IF NOT EXISTS projects_owner ON projects (session_id, updated)",
+)
+_FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5("
+    " project_id UNINDEXED, kind UNINDEXED, name UNINDEXED, content, tokenize='trigram')"
+)
+
+
+class Artifacts(Mapping):
+    """
+    一組文件的輕量 handle (例如某個專案的藍圖)：只記住檔名與內容雜湊，取值時才從專案庫讀取。
+    以底線開頭的 key (_model_used 等) 是中繼資料，直接放在 handle 裡。
+    內容不可變；更新文件請用 ProjectStore.save 取得新的 handle。
+    """
+
+    __slots__ = ("project_id", "kind", "_digests", "_meta", "_store")
+
+    def __init__(self, store, project_id, kind, digests, meta):
+        self._store = store
+        self.project_id = project_id
+        self.kind = kind
+        self._digests = dict(digests)
+        self._meta = dict(meta)
+
+    def __getitem__(self, key):
+        if key in self._meta:
+            return self._meta[key]
+        return self._store._read(self._digests[key])
+
+    def __iter__(self):
+        yield from self._digests
+        yield from self._meta
+
+    def __len__(self):
+        return len(self._digests) + len(self._meta)
+
+    def __contains__(self, key):
+        return key in self._digests or key in self._meta
+
+    @property
+    def meta(self):
+        return dict(self._meta)
+
+    def __repr__(self):
+        return f"Artifacts({self.project_id}, {self.kind}, {list(self._digests)})"
+
+
+class ProjectStore:
+    """
+    root：專案庫目錄 (projects.sqlite3 + blobs/)
+    cache_size：行程內保留幾份解壓後的文件 (所有 session 共用)
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, cache_size=64, level=6):
+        self.root = root
+        self.cache_size = cache_size
+        self.level = level
+        self.fts = False
+        self._lock = threading.Lock()
+        self._conn = None
+        self._cache = OrderedDict()    # digest -> 文字
+        self.stats = {"reads": 0, "cache_hits": 0, "writes": 0, "dedup": 0}
+
+    # ---------- 連線 (第一次使用時才建立，import 不會動到檔案系統) ----------
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.root, "projects.sqlite3"), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            try:
+                conn.execute(_FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False    # SQLite 沒有 FTS5 (或不支援 trigram)：搜尋退回只比對名稱與構想
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    # ---------- 內容 (zlib 壓縮，依雜湊存放) ----------
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest + ".z")
+
+    def _write(self, text):
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            with self._lock:
+                self.stats["dedup"] += 1
+            return digest, len(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(data, self.level))
+        os.replace(tmp, path)
+        with self._lock:
+            self.stats["writes"] += 1
+        return digest, len(data)
+
+    def _read(self, digest):
+        with self._lock:
+            self.stats["reads"] += 1
+            text = self._cache.get(digest)
+            if text is not None:
+                self._cache.move_to_end(digest)
+                self.stats["cache_hits"] += 1
+                return text
+        with open(self._blob_path(digest), "rb") as f:
+            text = zlib.decompress(f.read()).decode("utf-8")
+        with self._lock:
+            self._cache[digest] = text
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    # ---------- 專案 ----------
+    def create(self, name, description, session_id=None):
+        """建立新專案，回傳專案 id"""
+        project_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT INTO projects (id, name, description, session_id, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (project_id, name or "", description or "", session_id, now, now),
+            )
+            if self.fts:
+                db.execute("INSERT INTO search (project_id, kind, name, content) VALUES (?, 'project', '', ?)",
+                           (project_id, f"{name}\n{description}"))
+            db.commit()
+        return project_id
+
+    def set_requirements(self, project_id, full_requirements):
+        """記下藍圖的需求文字 (重新開啟後單獨重新生成文件要用)"""
+        with self._lock:
+            db = self._db()
+            db.execute("UPDATE projects SET full_requirements = ?, updated = ? WHERE id = ?",
+                       (full_requirements, time.time(), project_id))
+            db.commit()
+
+    def get_project(self, project_id):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT id, name, description, full_requirements, session_id, created, updated FROM projects"
+                " WHERE id = ?",
+                (project_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "name", "description", "full_requirements", "session_id", "created", "updated"), row))
+
+    def save(self, project_id, kind, data):
+        """
+        存入 (或更新) 一組文件，回傳最新的 Artifacts handle。
+        data 中的字串內容逐一存檔 (沒有列出的舊文件保留)；底線開頭的 key 整組取代原本的中繼資料。
+        """
+        files = {k: v for k, v in data.items() if not k.startswith("_") and isinstance(v, str)}
+        meta = {k: v for k, v in data.items() if k.startswith("_")}
+        written = {name: self._write(text) for name, text in files.items()}
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            for name, (digest, size) in written.items():
+                # upsert 保留原本的 rowid，文件順序不會因為重新生成而改變
+                db.execute(
+                    "INSERT INTO artifacts (project_id, kind, name, digest, size, updated) VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (project_id, kind, name) DO UPDATE SET"
+                    " digest = excluded.digest, size = excluded.size, updated = excluded.updated",
+                    (project_id, kind, name, digest, size, now),
+                )
+                if self.fts:
+                    db.execute("DELETE FROM search WHERE project_id = ? AND kind = ? AND name = ?",
+                               (project_id, kind, name))
+                    db.execute("INSERT INTO search (project_id, kind, name, content) VALUES (?, ?, ?, ?)",
+                               (project_id, kind, name, files[name]))
+            db.execute("INSERT OR REPLACE INTO artifact_meta (project_id, kind, meta) VALUES (?, ?, ?)",
+                       (project_id, kind, json.dumps(meta, ensure_ascii=False)))
+            db.execute("UPDATE projects SET updated = ? WHERE id = ?", (now, project_id))
+            db.commit()
+            return self._artifacts(project_id, kind)
+
+    def _artifacts(self, project_id, kind):
+        db = self._db()
+        digests = db.execute(
+            "SELECT name, digest FROM artifacts WHERE project_id = ? AND kind = ? ORDER BY rowid",
+            (project_id, kind),
+        ).fetchall()
+        row = db.execute("SELECT meta FROM artifact_meta WHERE project_id = ? AND kind = ?",
+                         (project_id, kind)).fetchone()
+        if not digests and row is None:
+            return None
+        return Artifacts(self, project_id, kind, digests, json.loads(row[0]) if row else {})
+
+    def artifacts(self, project_id, kind):
+        """專案某一種文件的 handle (questions / files / structure)；沒有就回傳 None"""
+        with self._lock:
+            return self._artifacts(project_id, kind)
+
+    def list_projects(self, query=None, limit=20, session_id=None):
+        """
+        最近更新的專案；query 有值時以全文索引搜尋名稱、構想與所有文件內容。
+        還沒有任何文件的專案 (問卷仍在生成或生成失敗) 不列出。
+        session_id：只列出這個 session 建立的專案 (多人共用同一個部署時，彼此看不到對方的專案)；
+        None 代表全部 (批次工具、管理用途)。
+        """
+        columns = "p.id, p.name, p.description, p.updated, (SELECT COUNT(*) FROM artifacts a" \
+                  " WHERE a.project_id = p.id AND a.kind = 'files')"
+        has_artifacts = "EXISTS (SELECT 1 FROM artifacts a WHERE a.project_id = p.id)"
+        owner, owner_args = ("", ()) if session_id is None else (" AND p.session_id = ?", (session_id,))
+        with self._lock:
+            db = self._db()
+            if not query:
+                rows = db.execute(
+                    f"SELECT {columns} FROM projects p WHERE {has_artifacts}{owner} ORDER BY p.updated DESC LIMIT ?",
+                    (*owner_args, limit),
+                ).fetchall()
+            else:
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                if self.fts:
+                    # trigram 索引讓 LIKE '%...%' 不必掃過全部內容 (三個字以上)
+                    matched = "SELECT project_id FROM search WHERE content LIKE ? ESCAPE '\\'"
+                else:
+                    matched = "SELECT id FROM projects WHERE name || ' ' || description LIKE ? ESCAPE '\\'"
+                rows = db.execute(
+                    f"SELECT {columns} FROM projects p WHERE p.id IN ({matched}) AND {has_artifacts}{owner}"
+                    " ORDER BY p.updated DESC LIMIT ?",
+                    (pattern, *owner_args, limit),
+                ).fetchall()
+        return [dict(zip(("id", "name", "description", "updated", "documents"), row)) for row in rows]
+
+    def delete(self, project_id):
+        """刪除專案；沒有其他專案共用的內容檔一併刪除"""
+        with self._lock:
+            db = self._db()
+            digests = {r[0] for r in db.execute("SELECT digest FROM artifacts WHERE project_id = ?", (project_id,))}
+            for table in ("artifacts", "artifact_meta"):
+                db.execute(f"DELETE FROM {table} WHERE project_id = ?", (project_id,))
+            if self.fts:
+                db.execute("DELETE FROM search WHERE project_id = ?", (project_id,))
+            db.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+            shared = {r[0] for r in db.execute(
+                f"SELECT digest FROM artifacts WHERE digest IN ({','.join('?' * len(digests))})", tuple(digests)
+            )} if digests else set()
+            db.commit()
+            for digest in digests - shared:
+                self._cache.pop(digest, None)
+                try:
+                    os.remove(self._blob_path(digest))
+                except OSError:
+                    pass
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cached"] = len(self._cache)
+            stats["projects"] = self._db().execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+        return stats
+
+
+# 全域唯一的專案庫
+store = ProjectStore()
+
+_configured = {"root": DEFAULT_ROOT}
+
+
+def configure(root=DEFAULT_ROOT, cache_size=64):
+    """切換專案庫目錄 (app.py 每次 rerun 都會呼叫；目錄相同時沿用)"""
+    global store
+    if root != _configured["root"]:
+        store = ProjectStore(root, cache_size)
+        _configured["root"] = root
+    store.cache_size = cache_size
+    return store
@@ -0,0 +1,312 @@
+import asyncio
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+# ==========================================
+# 👇 共用限流器 (Token Bucket + 公平排隊 + 多組 API Key)
+# ==========================================
+# 所有 session 共用同一組 API Key，各自狂送請求的結果就是 429，
+# 而 fallback 鏈遇到 429 只會一路換成較弱的模型。這裡在送出請求之前先排隊取得額度：
+# - 每個 (API Key, 模型) 一個 token bucket，依每分鐘請求數 (RPM) 補充
+# - 等待中的請求依 session 公平輪流 (已被服務次數少的 session 優先)，不會被單一使用者佔滿
+# - 多組 API Key 時挑選該模型剩餘額度最多的 Key
+# - 預估等待超過 max_wait 才放棄這個模型 (換下一個)，一般情況是排隊而不是降級
+# 預設不限流 (rpm = None)：各帳號的配額不同，由設定檔 / --rpm 指定後才開始排隊；
+# 不限流的模型仍會記住上游回的 429，暫停期間改用其他 Key 或換下一個模型。
+
+DEFAULT_RPM = None
+DEFAULT_BURST = 5
+DEFAULT_MAX_WAIT = 20.0
+
+_current_session = contextvars.ContextVar("rate_limit_session", default=None)
+
+
+class RateLimited(Exception):
+    """這個模型的額度在 max_wait 內都不會恢復 (呼叫端應改用下一個模型)"""
+
+
+@contextmanager
+def session(session_id):
+    """在這個範圍內送出的請求都算在 session_id 名下 (公平排隊與排隊位置用)"""
+    token = _current_session.set(session_id)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+class TokenBucket:
+    """rate：每秒補充的 token 數；capacity：最多可累積 (允許的瞬間爆量)"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+        self.blocked_until = 0.0   # 上游回 429 時暫停到這個時間
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now=None):
+        now = self.clock() if now is None else now
+        self._refill(now)
+        return 0.0 if now < self.blocked_until else self.tokens
+
+    def wait_time(self, now=None):
+        """距離可以取得一個 token 還要幾秒"""
+        now = self.clock() if now is None else now
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds, now=None):
+        now = self.clock() if now is None else now
+        self._refill(now)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class _Ticket:
+    __slots__ = ("seq", "model", "session_id")
+
+    def __init__(self, seq, model, session_id):
+        self.seq = seq
+        self.model = model
+        self.session_id = session_id
+
+
+class RateLimiter:
+    """
+    keys：API Key 清單 (空的就使用呼叫端傳入的 Key)
+    rpm：每組 Key 每個模型的每分鐘請求數 (None = 不限流)；model_rpm 可針對個別模型覆寫
+    burst：bucket 容量；max_wait：最多為一個模型等多久
+    """
+
+    def __init__(self, keys=(), rpm=DEFAULT_RPM, model_rpm=None, burst=DEFAULT_BURST,
+                 max_wait=DEFAULT_MAX_WAIT, clock=time.monotonic):
+        self.keys = [k for k in keys if k]
+        self.rpm = rpm
+        self.model_rpm = dict(model_rpm or {})
+        self.burst = burst
+        self.max_wait = max_wait
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._buckets = {}          # (key, model) -> TokenBucket
+        self._waiting = []          # 等待中的 _Ticket
+        self._served = {}           # session_id -> 已取得額度的次數 (佇列清空時歸零)
+        self._seq = itertools.count()
+        self.stats = {"granted": 0, "waited": 0, "wait_seconds": 0.0, "rejected": 0, "penalized": 0}
+
+    # ---------- bucket ----------
+    def _rpm(self, model):
+        return self.model_rpm.get(model, self.rpm)
+
+    def _bucket(self, key, model):
+        bucket = self._buckets.get((key, model))
+        if bucket is None:
+            # 不限流的模型只用 bucket 記住上游 429 的暫停時間
+            rpm = max(1, self._rpm(model) or 60)
+            bucket = self._buckets[(key, model)] = TokenBucket(rpm / 60.0, max(1, self.burst), self.clock)
+        return bucket
+
+    def _keys(self, default_key):
+        return self.keys or [default_key]
+
+    def _best_key(self, model, default_key):
+        """剩餘額度最多的 Key；全部用完就回傳 (None, 最短等待秒數)"""
+        now = self.clock()
+        best, best_tokens, wait = None, 0.0, float("inf")
+        for key in self._keys(default_key):
+            bucket = self._bucket(key, model)
+            tokens = bucket.available(now)
+            if tokens >= 1 and tokens > best_tokens:
+                best, best_tokens = key, tokens
+            wait = min(wait, bucket.wait_time(now))
+        return best, (0.0 if best else wait)
+
+    def _open_key(self, model, default_key):
+        """不限流的模型：輪流使用沒被上游限流的 Key；全部暫停中就丟出 RateLimited"""
+        now = self.clock()
+        keys = self._keys(default_key)
+        start = next(self._seq)
+        for i in range(len(keys)):
+            key = keys[(start + i) % len(keys)]
+            bucket = self._buckets.get((key, model))
+            if bucket is None or now >= bucket.blocked_until:
+                self.stats["granted"] += 1
+                return key
+        self.stats["rejected"] += 1
+        raise RateLimited(f"{model} 被上游限流中")
+
+    # ---------- 公平排隊 ----------
+    def _priority(self, ticket):
+        return (self._served.get(ticket.session_id, 0), ticket.seq)
+
+    def _is_next(self, ticket):
+        rivals = [t for t in self._waiting if t.model == ticket.model]
+        return min(rivals, key=self._priority) is ticket
+
+    def _poll(self, ticket, default_key):
+        """輪到這張號碼牌而且有額度就取得 Key；否則回傳 (None, 建議等待秒數)"""
+        if not self._is_next(ticket):
+            return None, None
+        key, wait = self._best_key(ticket.model, default_key)
+        if key is None:
+            return None, wait
+        self._bucket(key, ticket.model).take()
+        self._waiting.remove(ticket)
+        self._served[ticket.session_id] = self._served.get(ticket.session_id, 0) + 1
+        self._prune()
+        self.stats["granted"] += 1
+        self._cond.notify_all()
+        return key, 0.0
+
+    def _prune(self):
+        """沒有人在排隊時，服務次數也不再需要比較 (否則每個 session 都會永久留在字典裡)"""
+        if not self._waiting:
+            self._served.clear()
+
+    def _limit(self, max_wait):
+        return self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+
+    def _register(self, model, default_key, max_wait=None):
+        ticket = _Ticket(next(self._seq), model, _current_session.get())
+        # 預估等待：前面排隊的人數 / 補充速度，超過上限就不排了
+        rate = sum(self._bucket(k, model).rate for k in self._keys(default_key))
+        ahead = sum(1 for t in self._waiting if t.model == model)
+        _, wait = self._best_key(model, default_key)
+        if wait + ahead / rate > self._limit(max_wait):
+            self.stats["rejected"] += 1
+            raise RateLimited(f"{model} 額度不足 (預估需等待 {wait + ahead / rate:.0f} 秒)")
+        self._waiting.append(ticket)
+        return ticket
+
+    def _abandon(self, ticket):
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            self._prune()
+            self._cond.notify_all()
+
+    def acquire(self, model, default_key=None, cancel_event=None, max_wait=None):
+        """
+        排隊取得一次請求額度，回傳要使用的 API Key。
+        預估等待超過 max_wait 時丟出 RateLimited；cancel_event 被設定時丟出 InterruptedError。
+        max_wait：這次呼叫自己的等待上限 (例如生成剩下的時間預算)，不會超過 limiter 的設定；
+        實際等待超過它也會丟出 RateLimited。
+        """
+        started = self.clock()
+        with self._cond:
+            if self._rpm(model) is None:
+                return self._open_key(model, default_key)
+            ticket = self._register(model, default_key, max_wait)
+            try:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise InterruptedError("排隊已取消")
+                    if max_wait is not None and self.clock() - started > max_wait:
+                        self.stats["rejected"] += 1
+                        raise RateLimited(f"{model} 額度不足 (等待超過 {max_wait:.0f} 秒)")
+                    key, wait = self._poll(ticket, default_key)
+                    if key is not None:
+                        self._record_wait(self.clock() - started)
+                        return key
+                    # 沒輪到：等別人取得額度後通知；輪到但沒額度：等 bucket 補充
+                    self._cond.wait(0.5 if wait is None else min(max(wait, 0.01), 0.5))
+            except BaseException:
+                self._abandon(ticket)
+                raise
+
+    async def acquire_async(self, model, default_key=None, max_wait=None):
+        """acquire 的 asyncio 版本 (輪詢，不佔用 thread)"""
+        started = self.clock()
+        with self._cond:
+            if self._rpm(model) is None:
+                return self._open_key(model, default_key)
+            ticket = self._register(model, default_key, max_wait)
+        try:
+            while True:
+                if max_wait is not None and self.clock() - started > max_wait:
+                    with self._cond:
+                        self.stats["rejected"] += 1
+                    raise RateLimited(f"{model} 額度不足 (等待超過 {max_wait:.0f} 秒)")
+                with self._cond:
+                    key, wait = self._poll(ticket, default_key)
+                if key is not None:
+                    with self._cond:
+                        self._record_wait(self.clock() - started)
+                    return key
+                await asyncio.sleep(0.05 if wait is None else min(max(wait, 0.01), 0.5))
+        except BaseException:
+            with self._cond:
+                self._abandon(ticket)
+            raise
+
+    def _record_wait(self, waited):
+        if waited > 0.01:
+            self.stats["waited"] += 1
+            self.stats["wait_seconds"] += waited
+
+    # ---------- 上游回饋 ----------
+    def penalize(self, key, model, retry_after=None):
+        """上游回 429：這組 Key 的這個模型暫停到 Retry-After (預設一分鐘)"""
+        with self._cond:
+            self._bucket(key, model).block(retry_after or 60.0)
+            self.stats["penalized"] += 1
+
+    def exhausted(self, model, default_key=None):
+        """所有 Key 的這個模型都被上游限流中"""
+        with self._cond:
+            now = self.clock()
+            return all(now < self._bucket(k, model).blocked_until for k in self._keys(default_key))
+
+    # ---------- 狀態 ----------
+    def queue_position(self, session_id):
+        """這個 session 最前面的請求排在第幾位 (1 = 下一個)；沒有在排隊回傳 None"""
+        with self._cond:
+            best = None
+            for ticket in self._waiting:
+                if ticket.session_id != session_id:
+                    continue
+                rivals = sorted((t for t in self._waiting if t.model == ticket.model), key=self._priority)
+                position = rivals.index(ticket) + 1
+                best = position if best is None else min(best, position)
+            return best
+
+    def reset(self):
+        """清除所有 bucket (含上游 429 的暫停) 與統計 (基準測試用)"""
+        with self._cond:
+            self._buckets.clear()
+            self._served.clear()
+            self.stats = dict.fromkeys(self.stats, 0)
+            self.stats["wait_seconds"] = 0.0
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats.update(waiting=len(self._waiting), keys=max(1, len(self.keys)), limited=self.rpm is not None or bool(self.model_rpm))
+        return stats
+
+
+limiter = RateLimiter()
+
+_configured = {}
+
+
+def configure(keys=(), rpm=DEFAULT_RPM, model_rpm=None, burst=DEFAULT_BURST, max_wait=DEFAULT_MAX_WAIT):
+    """設定有變動才重建 (app.py 每次 rerun 都會呼叫)；排隊中的請求留在舊的 limiter 完成"""
+    global limiter
+    settings = dict(keys=list(keys or ()), rpm=rpm, model_rpm=dict(model_rpm or {}), burst=burst, max_wait=max_wait)
+    if settings != _configured:
+        limiter = RateLimiter(**settings)
+        _configured.clear()
+        _configured.update(settings)
+    return limiter
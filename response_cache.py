@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# ==========================================
+# 👇 內容定址回應快取 (Content-Addressed Response Cache)
+# ==========================================
+# 相同的專案名稱 + 描述 (例如預設的 PolyGlotBook AI 範例) 會被不同使用者一再送出。
+# 以「生成種類 + prompt 全文」的 SHA-256 當 key，命中時幾毫秒就回傳，不耗額度。
+# 生成時走 fallback 鏈，送出前還不知道會由哪個模型回答，所以 model 一律是 "auto"
+# (實際產生內容的模型記在結果的 _model_used)；使用者要求重新生成時由呼叫端略過快取。
+# 後端可替換：記憶體 LRU / SQLite 檔案 / 目錄 (一個 key 一個 JSON 檔)。
+
+
+def make_key(kind, prompt_text, model="auto"):
+    digest = hashlib.sha256()
+    for part in (kind, model, prompt_text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class MemoryLRUBackend:
+    """行程內 LRU (重啟即清空)"""
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data.move_to_end(key)
+            return item
+
+    def set(self, key, value, created):
+        with self._lock:
+            self._data[key] = (value, created)
+            self._data.move_to_end(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def evict(self, max_entries):
+        """刪掉最久沒用到的項目，回傳刪除筆數"""
+        with self._lock:
+            removed = 0
+            while len(self._data) > max_entries:
+                self._data.popitem(last=False)
+                removed += 1
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """單一 SQLite 檔案 (多個 process / 重啟後都能共用)"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE response_cache SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0]), row[1]
+
+    def set(self, key, value, created):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), created, time.time()),
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self, max_entries):
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                " SELECT key FROM response_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class DirectoryBackend:
+    """一個 key 一個 JSON 檔，方便直接檢視或用 rsync 在機器間同步"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), "r", encoding="utf-8") as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(self._file(key))  # 以 mtime 當作最後存取時間
+        return item["value"], item["created"]
+
+    def set(self, key, value, created):
+        tmp = self._file(key) + f".{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"value": value, "created": created}, f, ensure_ascii=False)
+        os.replace(tmp, self._file(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def _entries(self):
+        for name in os.listdir(self.path):
+            if name.endswith(".json"):
+                full = os.path.join(self.path, name)
+                try:
+                    yield os.path.getmtime(full), full
+                except OSError:
+                    continue
+
+    def evict(self, max_entries):
+        entries = sorted(self._entries(), reverse=True)
+        removed = 0
+        for _, full in entries[max_entries:]:
+            try:
+                os.remove(full)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def clear(self):
+        for _, full in list(self._entries()):
+            try:
+                os.remove(full)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return sum(1 for _ in self._entries())
+
+
+class ResponseCache:
+    """
+    快取前端：負責 key 計算、TTL 過期、數量上限淘汰，以及命中率統計。
+    ttl=None 代表永不過期；max_entries=None 代表不限數量。
+    """
+
+    def __init__(self, backend=None, ttl=24 * 3600, max_entries=256, clock=time.time):
+        self.backend = backend if backend is not None else MemoryLRUBackend()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def get(self, kind, prompt_text, model="auto"):
+        key = make_key(kind, prompt_text, model)
+        item = self.backend.get(key)
+        if item is None:
+            self._count("misses")
+            return None
+        value, created = item
+        if self.ttl is not None and self._clock() - created > self.ttl:
+            self.backend.delete(key)
+            self._count("expired")
+            self._count("misses")
+            return None
+        self._count("hits")
+        return value
+
+    def put(self, kind, prompt_text, value, model="auto"):
+        self.backend.set(make_key(kind, prompt_text, model), value, self._clock())
+        self._count("stores")
+        if self.max_entries is not None:
+            removed = self.backend.evict(self.max_entries)
+            if removed:
+                self._count("evictions", removed)
+
+    def clear(self):
+        self.backend.clear()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = len(self.backend)
+        return stats
+
+
+def build_backend(kind="memory", path=None):
+    """依照設定字串建立後端：memory / sqlite / dir"""
+    if kind == "memory":
+        return MemoryLRUBackend()
+    if kind == "sqlite":
+        return SQLiteBackend(path or "response_cache.sqlite3")
+    if kind == "dir":
+        return DirectoryBackend(path or ".response_cache")
+    raise ValueError(f"未知的快取後端: {kind}")
+
+
+# 全域唯一的快取 (預設：記憶體 LRU)
+cache = ResponseCache()
+
+_configured = {"backend": "memory", "path": None}
+
+
+def configure(backend="memory", path=None, ttl=24 * 3600, max_entries=256):
+    """切換快取後端與上限；後端設定相同時沿用既有資料"""
+    global cache
+    if (backend, path) != (_configured["backend"], _configured["path"]):
+        cache = ResponseCache(build_backend(backend, path), ttl=ttl, max_entries=max_entries)
+        _configured.update(backend=backend, path=path)
+    else:
+        cache.ttl = ttl
+        cache.max_entries = max_entries
+    return cache
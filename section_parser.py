@@ -0,0 +1,256 @@
+import re
+from functools import lru_cache
+
+# ==========================================
+# 👇 ====FILE: X==== 檔案區塊協定的解析器
+# ==========================================
+# 模型會把多個檔案串在同一段回應裡：
+#   ====FILE: README.md====
+#   (內容...)
+#   ====FILE: SPEC.md====
+#   (內容...)
+# parse_sections：完整回應，一次掃描 (線性時間) 切出所有區塊，包含預期之外的額外檔案。
+# StreamingSectionParser：串流回應，逐段餵入；標記可能被切在兩個 chunk 之間，
+# 只在確定不是標記的一部分時才輸出內容。兩者共用同一個標頭判斷邏輯。
+
+MARKER = "====FILE:"
+HEADER_END = "===="
+MAX_HEADER = 256    # 標頭 (檔名) 最長長度；超過就不當作標頭，避免長距離搜尋
+MAX_NAME = 100      # 可以保留下來的額外檔名長度上限
+
+_BYTES_MARKER = MARKER.encode()
+_BYTES_HEADER_END = HEADER_END.encode()
+_WHITESPACE = frozenset(b" \t\r\n\f\v")
+
+OK, INVALID, PARTIAL = "ok", "invalid", "partial"
+
+# 檔名會成為專案庫的 key、壓縮檔成員與批次輸出的檔案路徑：只接受單純的檔名
+_UNSAFE_NAME = re.compile(r"[/\\:\x00-\x1f\x7f]")
+
+
+def is_safe_name(name):
+    """模型給的檔名是否可以保留：不含路徑分隔 (/ \\)、磁碟代號、控制字元，不是 . / ..，不以 _ 開頭 (內部資訊)"""
+    return (
+        isinstance(name, str) and 0 < len(name) <= MAX_NAME and name.strip() == name
+        and name not in (".", "..") and not name.startswith("_") and not _UNSAFE_NAME.search(name)
+    )
+
+
+def _scan_header(buf, idx, final=True):
+    """
+    檢查 buf[idx] 開始的標記是不是合法標頭 `====FILE: 名稱====` + 換行。
+    回傳 (OK, 名稱起點, 名稱終點, 內容起點) / (INVALID, ...) / (PARTIAL, ...)。
+    PARTIAL 只會在 final=False (串流中，後面還有資料) 時出現。
+    """
+    is_bytes = not isinstance(buf, str)
+    header_end_token = _BYTES_HEADER_END if is_bytes else HEADER_END
+    newline = b"\n" if is_bytes else "\n"
+
+    name_start = idx + len(MARKER)
+    limit = min(len(buf), name_start + MAX_HEADER + len(HEADER_END))
+    header_end = buf.find(header_end_token, name_start, limit)
+    line_break = buf.find(newline, name_start, header_end if header_end != -1 else limit)
+    if line_break != -1:
+        return INVALID, None, None, line_break + 1
+    if header_end == -1:
+        if not final and limit == len(buf) and len(buf) - name_start < MAX_HEADER + len(HEADER_END):
+            return PARTIAL, None, None, idx
+        return INVALID, None, None, name_start
+
+    body_start = header_end + len(HEADER_END)
+    if body_start >= len(buf):
+        if not final:
+            return PARTIAL, None, None, idx
+        return OK, name_start, header_end, body_start
+    # 標頭後面的換行不算內容 (\r\n 也接受)
+    if buf[body_start:body_start + 2] == (b"\r\n" if is_bytes else "\r\n"):
+        body_start += 2
+    elif buf[body_start:body_start + 1] == newline:
+        body_start += 1
+    elif not final and body_start + 1 == len(buf) and buf[body_start:] == (b"\r" if is_bytes else "\r"):
+        return PARTIAL, None, None, idx
+    return OK, name_start, header_end, body_start
+
+
+def _strip_span(buf, start, end):
+    """回傳去掉前後空白後的 (start, end)，不複製字串"""
+    if isinstance(buf, str):
+        while start < end and buf[start].isspace():
+            start += 1
+        while end > start and buf[end - 1].isspace():
+            end -= 1
+    else:
+        while start < end and buf[start] in _WHITESPACE:
+            start += 1
+        while end > start and buf[end - 1] in _WHITESPACE:
+            end -= 1
+    return start, end
+
+
+def _decode_name(buf, start, end):
+    name = buf[start:end]
+    if not isinstance(name, str):
+        name = bytes(name).decode("utf-8", errors="replace")
+    return name.strip()
+
+
+def iter_sections(buf):
+    """
+    單次掃描，依序產生 (檔名, 內容起點, 內容終點)；位置已去除前後空白。
+    buf 可以是 str 或 bytes / bytearray。第一個標頭之前的文字 (開場白) 會被略過。
+    """
+    marker = MARKER if isinstance(buf, str) else _BYTES_MARKER
+    current = None
+    pos = buf.find(marker)
+    while pos != -1:
+        status, name_start, name_end, resume = _scan_header(buf, pos)
+        if status == OK:
+            if current is not None:
+                yield (current[0],) + _strip_span(buf, current[1], pos)
+            current = (_decode_name(buf, name_start, name_end), resume)
+        pos = buf.find(marker, resume)
+    if current is not None:
+        yield (current[0],) + _strip_span(buf, current[1], len(buf))
+
+
+def parse_sections(buf):
+    """
+    回傳 {檔名: 內容}，依出現順序；同名區塊以第一個為準 (與舊版 re.search 相同)。
+    str 輸入回傳 str；bytes 輸入回傳指向原始緩衝區的 memoryview (零複製)。
+    """
+    view = None if isinstance(buf, str) else memoryview(buf)
+    sections = {}
+    for name, start, end in iter_sections(buf):
+        if name in sections:
+            continue
+        sections[name] = buf[start:end] if view is None else view[start:end]
+    return sections
+
+
+# ==========================================
+# 👇 標記修復：模型把標記寫歪時 (本機修好，不必重新生成)
+# ==========================================
+# 常見的變形：`==== FILE: README.md ====`、`**====FILE: README.md====**`、`=== File：README.md ===`，
+# 或乾脆只寫一行 `## README.md` / `**README.md**` 當標題。
+_LOOSE_MARKER = re.compile(
+    r"^[ \t>*#`_]*={2,}\s*FILE\s*[:：]\s*(?P<name>[^\n=*`]+?)\s*={2,}[ \t*`_]*$", re.MULTILINE | re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=32)
+def _bare_marker(expected):
+    """只寫檔名的標題行；同一組檔名的 pattern 只編譯一次 (整個 process 共用)"""
+    names = "|".join(re.escape(name) for name in expected)
+    return re.compile(rf"^[ \t]*(?:#{{1,6}}[ \t]*)?[*_`]*(?P<name>{names})[*_`]*[ \t:：]*$", re.MULTILINE)
+
+
+def normalize_markers(text, expected=()):
+    """
+    把寫歪的標記改回標準的 `====FILE: 名稱====`；expected 中的檔名單獨成行 (可帶 Markdown 標題 / 粗體) 也視為標記。
+    回傳 (修正後的文字, 修正了幾個標記)。
+    """
+    fixed = 0
+
+    def canonical(match):
+        nonlocal fixed
+        header = f"{MARKER} {match.group('name').strip()}{HEADER_END}"
+        if match.group(0) != header:
+            fixed += 1
+        return header
+
+    text = _LOOSE_MARKER.sub(canonical, text)
+    if expected:
+        bare = _bare_marker(tuple(expected))
+        # 已經有標準標記的檔名就不再動 (內文提到檔名的標題不能被當成新區塊)
+        present = set(parse_sections(text))
+        text = bare.sub(lambda m: m.group(0) if m.group("name") in present else canonical(m), text)
+    return text, fixed
+
+
+class StreamingSectionParser:
+    """
+    增量解析器：feed(chunk) 回傳這一段產生的事件列表，
+    事件為 ("start", name) / ("delta", name, text) / ("end", name)。
+    close() 會結束最後一個檔案區塊。同名區塊以第一個為準，後續重複的內容會被略過。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._current = None
+        self._parts = {}
+        self.order = []
+        self.completed = []
+
+    def feed(self, chunk, final=False):
+        self._buffer += chunk
+        events = []
+        scan_from = 0
+        while True:
+            idx = self._buffer.find(MARKER, scan_from)
+            if idx == -1:
+                # 保留結尾可能是「半個標記」的字元，其餘都可以安全輸出
+                keep = 0 if final else self._partial_marker_len()
+                self._emit(self._buffer[:len(self._buffer) - keep], events)
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                return events
+
+            status, name_start, name_end, resume = _scan_header(self._buffer, idx, final)
+            if status == PARTIAL:
+                # 標頭還沒收完整，先輸出標記之前的內容，等下一段
+                self._emit(self._buffer[:idx], events)
+                self._buffer = self._buffer[idx:]
+                return events
+            if status == INVALID:
+                # 不是合法的標頭，當成一般內容繼續往後找
+                scan_from = resume
+                continue
+
+            self._emit(self._buffer[:idx], events)
+            self._finish_current(events)
+            self._start(self._buffer[name_start:name_end].strip(), events)
+            self._buffer = self._buffer[resume:]
+            scan_from = 0
+
+    def close(self):
+        events = self.feed("", final=True)
+        self._finish_current(events)
+        return events
+
+    def text(self, name):
+        """目前為止收到的內容 (尚未 strip)"""
+        return "".join(self._parts.get(name, ()))
+
+    def sections(self):
+        """所有已出現的檔案區塊 (已 strip)，依出現順序"""
+        return {name: self.text(name).strip() for name in self.order}
+
+    def _start(self, name, events):
+        if name in self._parts:
+            self._current = None
+            return
+        self._current = name
+        self._parts[name] = []
+        self.order.append(name)
+        events.append(("start", name))
+
+    def _partial_marker_len(self):
+        tail = self._buffer[-(len(MARKER) - 1):]
+        for size in range(len(tail), 0, -1):
+            if MARKER.startswith(tail[-size:]):
+                return size
+        return 0
+
+    def _emit(self, text, events):
+        # 第一個標記之前的文字 (模型的開場白) 與重複區塊直接丟掉
+        if text and self._current is not None:
+            self._parts[self._current].append(text)
+            events.append(("delta", self._current, text))
+
+    def _finish_current(self, events):
+        if self._current is not None:
+            parts = self._parts[self._current]
+            # 合併成單一字串，避免保留大量小片段
+            self._parts[self._current] = ["".join(parts)]
+            self.completed.append(self._current)
+            events.append(("end", self._current))
+            self._current = None
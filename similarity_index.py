@@ -0,0 +1,204 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# ==========================================
+# 👇 相似構想索引 (字元 n-gram MinHash + LSH)
+# ==========================================
+# 使用者在 Stage 0 輸入的構想常常只是之前某個構想換句話說，完全相同才命中的回應快取抓不到。
+# 這裡把過去的 (專案名稱, 構想) 轉成字元 n-gram 集合 (中文不需要斷詞，也不需要外部 embedding 服務)，
+# 以 MinHash 簽章 + LSH 分桶快速找出候選，再用實際的 Jaccard 相似度確認。
+# 索引只放在記憶體，筆數有上限，太舊的紀錄會被淘汰。
+# 每筆紀錄都記下擁有者 (app 的 session_id)：查詢只會找到同一個擁有者的構想，不會把別人的專案內容給出去。
+
+NUM_PERM = 64
+BANDS = 16                  # 16 個 band x 4 列：相似度約 0.5 以上的組合很容易落在同一個桶
+ROWS = NUM_PERM // BANDS
+NGRAM = 2
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+
+
+def _permutations(count, seed=1):
+    """固定種子的 (a, b) 參數，讓不同 process 算出來的簽章一致"""
+    params = []
+    for i in range(count):
+        digest = hashlib.blake2b(f"minhash:{seed}:{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "big") % (_PRIME - 1) + 1
+        b = int.from_bytes(digest[8:], "big") % _PRIME
+        params.append((a, b))
+    return params
+
+
+_PARAMS = _permutations(NUM_PERM)
+
+
+def normalize(text):
+    """全形轉半形、轉小寫、去掉空白與標點 (「做一個網站」和「做個網站！」差異才會變小)"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"[\W_]+", "", text)
+
+
+def shingles(text, n=NGRAM):
+    text = normalize(text)
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def signature(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in shingle_set]
+    if not hashes:
+        return (_MASK,) * NUM_PERM
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PARAMS)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("key", "owner", "project_name", "project_desc", "shingles", "signature", "results", "updated")
+
+    def __init__(self, key, owner, project_name, project_desc, shingle_set, sig):
+        self.key = key
+        self.owner = owner
+        self.project_name = project_name
+        self.project_desc = project_desc
+        self.shingles = shingle_set
+        self.signature = sig
+        self.results = {}       # kind ("interview" / "blueprint") -> 結果
+        self.updated = 0.0
+
+
+class SimilarityIndex:
+    """
+    threshold：Jaccard 相似度門檻 (0~1)
+    max_entries：最多保留幾個構想 (超過就淘汰最久沒更新的)
+    max_age：紀錄保留秒數
+    """
+
+    def __init__(self, threshold=0.6, max_entries=1000, max_age=7 * 24 * 3600, clock=time.time):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (擁有者, 正規化文字) -> _Entry (越後面越新)
+        self._buckets = {}              # (band, band 簽章) -> set(key)
+        self.stats = {"queries": 0, "matches": 0, "candidates": 0, "evictions": 0}
+
+    @staticmethod
+    def _text(project_name, project_desc):
+        return f"{project_name}\n{project_desc}"
+
+    @staticmethod
+    def _bands(sig):
+        return [(band, sig[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for band in self._bands(entry.signature):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def _evict(self):
+        now = self.clock()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - entry.updated <= self.max_age:
+                break
+            self._remove(key)
+            self.stats["evictions"] += 1
+
+    def add(self, project_name, project_desc, kind, result, owner=None):
+        """記錄一次成功的生成結果；同一個擁有者的同一個構想 (正規化後相同) 會更新既有紀錄"""
+        text = self._text(project_name, project_desc)
+        normalized = normalize(text)
+        if not normalized:
+            return
+        key = (owner, normalized)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                shingle_set = shingles(text)
+                entry = _Entry(key, owner, project_name, project_desc, shingle_set, signature(shingle_set))
+                self._entries[key] = entry
+                for band in self._bands(entry.signature):
+                    self._buckets.setdefault(band, set()).add(key)
+            entry.results[kind] = result
+            entry.updated = self.clock()
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def query(self, project_name, project_desc, kind=None, owner=None):
+        """
+        找出 owner 最相似的過去構想，回傳 {"similarity", "project_name", "project_desc", "results"}；
+        kind 有指定時只考慮有該種結果的紀錄。沒有超過門檻的就回傳 None。
+        """
+        text = self._text(project_name, project_desc)
+        shingle_set = shingles(text)
+        if not shingle_set:
+            return None
+        sig = signature(shingle_set)
+        with self._lock:
+            self._evict()
+            self.stats["queries"] += 1
+            candidates = set()
+            for band in self._bands(sig):
+                candidates |= self._buckets.get(band, set())
+            self.stats["candidates"] += len(candidates)
+
+            best, best_score = None, 0.0
+            for key in candidates:
+                entry = self._entries[key]
+                if entry.owner != owner or (kind is not None and kind not in entry.results):
+                    continue
+                score = jaccard(shingle_set, entry.shingles)
+                if score > best_score:
+                    best, best_score = entry, score
+            if best is None or best_score < self.threshold:
+                return None
+            self.stats["matches"] += 1
+            return {
+                "similarity": round(best_score, 3),
+                "project_name": best.project_name,
+                "project_desc": best.project_desc,
+                "results": dict(best.results),
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update(entries=len(self._entries), buckets=len(self._buckets))
+        return stats
+
+
+index = SimilarityIndex()
+
+_configured = {}
+
+
+def configure(threshold=0.6, max_entries=1000, max_age=7 * 24 * 3600):
+    """調整門檻與上限 (不會清掉既有紀錄)"""
+    settings = dict(threshold=threshold, max_entries=max_entries, max_age=max_age)
+    if settings != _configured:
+        index.threshold = float(threshold)
+        index.max_entries = int(max_entries)
+        index.max_age = max_age
+        _configured.clear()
+        _configured.update(settings)
+    return index
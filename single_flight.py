@@ -0,0 +1,138 @@
+import hashlib
+import threading
+
+# ==========================================
+# 👇 Single-flight：相同的請求同時只送出一次
+# ==========================================
+# 展示現場大家同時用預設構想按下「開始諮詢」時，每個 session 都會各自跑一條 fallback 鏈。
+# 回應快取只能擋住「之後」的重複請求；這裡處理「同時」的重複：
+# 相同 (生成種類, 正規化後的 prompt) 的呼叫共用同一個上游請求，所有人拿到同一份結果 (或同一個錯誤)。
+# 上游請求直接在第一個呼叫者的 thread 執行 (不另外開 thread，span 與限流 session 自然沿用)；
+# 某個呼叫者取消不影響其他人，所有呼叫者都取消時才取消上游請求。
+
+POLL_INTERVAL = 0.2     # 等待者檢查自己是否被取消的間隔 (秒)
+
+
+def make_key(kind, prompt_text, *variant):
+    """prompt 的空白差異 (縮排、換行) 不影響結果，正規化後再雜湊"""
+    digest = hashlib.sha256()
+    for part in (kind, " ".join(prompt_text.split()), *map(str, variant)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Flight:
+    __slots__ = ("done", "abandoned", "waiters", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.abandoned = False  # 所有呼叫者都取消了，上游請求應該停止
+        self.waiters = 0        # 包含正在執行上游請求的第一個呼叫者
+        self.result = None
+        self.error = None
+
+
+class _FlightCancel:
+    """交給上游請求的取消旗標 (介面同 threading.Event.is_set)：第一個呼叫者取消、而且沒有其他人在等時成立"""
+
+    def __init__(self, group, key, flight, cancel_event):
+        self._group = group
+        self._key = key
+        self._flight = flight
+        self._cancel_event = cancel_event
+
+    def is_set(self):
+        flight = self._flight
+        if not flight.abandoned and self._cancel_event is not None and self._cancel_event.is_set():
+            self._group._abandon(self._key, flight)
+        return flight.abandoned
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}      # key -> _Flight
+        self.stats = {"calls": 0, "upstream": 0, "shared": 0, "abandoned": 0, "errors": 0}
+
+    def _lead(self, key, flight, fn, cancel_event):
+        """第一個呼叫者：在自己的 thread 執行 fn，結果 (或例外) 交給所有等待者"""
+        try:
+            flight.result = fn(_FlightCancel(self, key, flight, cancel_event))
+        except BaseException as e:
+            flight.error = e
+            if not flight.abandoned:
+                with self._lock:
+                    self.stats["errors"] += 1
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+        if flight.error is not None:
+            raise flight.error
+        if cancel_event is not None and cancel_event.is_set():
+            # 因為還有其他人在等而做完了，但這個呼叫者自己已經不需要結果
+            raise InterruptedError("已取消等待")
+        return flight.result
+
+    def do(self, key, fn, cancel_event=None):
+        """
+        執行 fn(shared_cancel) 並回傳 (結果, 是否共用了別人的請求)；shared_cancel 只提供 is_set()。
+        相同 key 已經在進行中就等待它的結果；fn 的例外會傳給所有等待者。
+        cancel_event 被設定時這個呼叫者先離開 (丟出 InterruptedError)；
+        執行 fn 的第一個呼叫者無法先離開，沒有其他人在等時 shared_cancel 才會成立、讓 fn 停止。
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._flights.get(key)
+            shared = flight is not None
+            if not shared:
+                flight = self._flights[key] = _Flight()
+                self.stats["upstream"] += 1
+            else:
+                self.stats["shared"] += 1
+            flight.waiters += 1
+        if not shared:
+            return self._lead(key, flight, fn, cancel_event), False
+
+        try:
+            while not flight.done.wait(None if cancel_event is None else POLL_INTERVAL):
+                if cancel_event.is_set():
+                    raise InterruptedError("已取消等待")
+        except BaseException:
+            self._leave(key, flight)
+            raise
+        with self._lock:
+            flight.waiters -= 1
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, shared
+
+    def _leave(self, key, flight):
+        with self._lock:
+            flight.waiters -= 1
+
+    def _abandon(self, key, flight):
+        """第一個呼叫者已取消：只剩它自己時放棄上游請求，之後相同的呼叫重新開始"""
+        with self._lock:
+            if flight.abandoned or flight.waiters > 1 or flight.done.is_set():
+                return
+            flight.abandoned = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self.stats["abandoned"] += 1
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self._flights)
+        return stats
+
+
+group = SingleFlight()
@@ -0,0 +1,379 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# ==========================================
+# 👇 效能量測 (Instrumentation)
+# ==========================================
+# 兩層 span：
+#   generation：一次 generate_* 呼叫 (含快取命中、fallback 次數、最終模型)
+#   attempt   ：fallback 鏈中對單一模型的一次請求 (狀態碼、延遲、prompt/回應大小、token 數)
+# 事件送到所有已註冊的 sink：記憶體環狀緩衝 (監控面板用)、JSONL 檔案、Prometheus 文字格式。
+
+_current_span = contextvars.ContextVar("telemetry_span", default=None)
+_sinks = []
+_sinks_lock = threading.Lock()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def usage_tokens(res_json):
+    """從 Gemini 回應的 usageMetadata 取出 token 數 (沒有就回傳空 dict)"""
+    usage = (res_json or {}).get("usageMetadata") if isinstance(res_json, dict) else None
+    if not usage:
+        return {}
+    return {
+        "prompt_tokens": usage.get("promptTokenCount"),
+        "response_tokens": usage.get("candidatesTokenCount"),
+        "total_tokens": usage.get("totalTokenCount"),
+    }
+
+
+class GenerationSpan:
+    """一次生成呼叫；attempt 事件會自動掛在目前的 span 底下"""
+
+    def __init__(self, generator, attrs):
+        self.generator = generator
+        self.attrs = dict(attrs)
+        self.started = time.monotonic()
+        self.attempts = []
+        self.status = "ok"
+        self.error = None
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        self.status = "error"
+        self.error = str(error)[:500]
+
+    def add_attempt(self, event):
+        with self._lock:
+            event["retry"] = len(self.attempts)
+            self.attempts.append(event)
+
+    def to_event(self):
+        with self._lock:
+            attempts = list(self.attempts)
+        tokens = defaultdict(int)
+        for attempt in attempts:
+            for key in ("prompt_tokens", "response_tokens", "total_tokens"):
+                tokens[key] += attempt.get(key) or 0
+        event = {
+            "type": "generation",
+            "ts": time.time(),
+            "generator": self.generator,
+            "status": self.status,
+            "error": self.error,
+            "latency": round(time.monotonic() - self.started, 4),
+            "attempts": len(attempts),
+            "fallbacks": sum(1 for a in attempts if a["status"] != 200),
+        }
+        event.update(tokens)
+        event.update(self.attrs)
+        return event
+
+
+@contextmanager
+def span(generator, **attrs):
+    """包住一次 generate_* 呼叫；結束時送出 generation 事件"""
+    current = GenerationSpan(generator, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except GeneratorExit:
+        # 串流被呼叫端中途關閉 (例如工作被取消)
+        current.status = "cancelled"
+        raise
+    except Exception as e:
+        current.fail(e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 串流 generator 在另一個 context 被關閉時無法 reset，直接清掉即可
+            _current_span.set(None)
+        emit(current.to_event())
+
+
+def traced(generator):
+    """decorator：整個函式 (同步或 async) 包在一個 generation span 裡"""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(generator, mode="async"):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(generator, mode="sync"):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def annotate(**attrs):
+    """在目前的 generation span 加上屬性 (例如 cache_hit、model)；不在 span 裡就忽略"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def fail(error):
+    """把目前的 generation span 標記為失敗 (生成函式會吃掉例外、改回傳錯誤 dict)"""
+    current = _current_span.get()
+    if current is not None:
+        current.fail(error)
+
+
+def record_attempt(model, status, latency, prompt_chars=0, response_chars=0, usage=None, error=None, mode="sync"):
+    """fallback 鏈中對單一模型的一次請求"""
+    current = _current_span.get()
+    event = {
+        "type": "attempt",
+        "ts": time.time(),
+        "generator": current.generator if current else None,
+        "model": model,
+        "status": status,
+        "latency": round(latency, 4),
+        "prompt_chars": prompt_chars,
+        "response_chars": response_chars,
+        "mode": mode,
+        "error": str(error)[:300] if error else None,
+    }
+    event.update(usage or {})
+    if current is not None:
+        current.add_attempt(event)
+    else:
+        event["retry"] = 0
+    emit(event)
+
+
+# ==========================================
+# 👇 Sinks
+# ==========================================
+def add_sink(sink):
+    with _sinks_lock:
+        if sink not in _sinks:
+            _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def emit(event):
+    with _sinks_lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        try:
+            sink.write(event)
+        except Exception:
+            # 量測失敗不能影響生成本身
+            pass
+
+
+class RingBufferSink:
+    """保留最近 N 筆事件 (監控面板的資料來源)"""
+
+    def __init__(self, capacity=2000):
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        with self._lock:
+            self._events.append(event)
+
+    def events(self, type_=None):
+        with self._lock:
+            events = list(self._events)
+        return [e for e in events if type_ is None or e["type"] == type_]
+
+    def summary(self):
+        """依生成種類與模型彙整 p50 / p95 延遲、fallback 率、錯誤率"""
+        generators = defaultdict(list)
+        for event in self.events("generation"):
+            generators[event["generator"]].append(event)
+        models = defaultdict(list)
+        for event in self.events("attempt"):
+            models[event["model"]].append(event)
+
+        gen_rows = []
+        for name, events in sorted(generators.items(), key=lambda kv: str(kv[0])):
+            latencies = [e["latency"] for e in events if not e.get("cache_hit")]
+            gen_rows.append({
+                "generator": name,
+                "calls": len(events),
+                "p50": _percentile(latencies, 50),
+                "p95": _percentile(latencies, 95),
+                "fallback_rate": sum(1 for e in events if e["fallbacks"]) / len(events),
+                "error_rate": sum(1 for e in events if e["status"] != "ok") / len(events),
+                "cache_hit_rate": sum(1 for e in events if e.get("cache_hit")) / len(events),
+            })
+        model_rows = []
+        for name, events in sorted(models.items()):
+            ok = [e["latency"] for e in events if e["status"] == 200]
+            model_rows.append({
+                "model": name,
+                "attempts": len(events),
+                "success_rate": len(ok) / len(events),
+                "p50": _percentile(ok, 50),
+                "p95": _percentile(ok, 95),
+                "statuses": dict(sorted(_count_by(events, "status").items(), key=lambda kv: str(kv[0]))),
+            })
+        return {"generators": gen_rows, "models": model_rows}
+
+
+def _count_by(events, key):
+    counts = defaultdict(int)
+    for event in events:
+        counts[event[key]] += 1
+    return counts
+
+
+class JsonlFileSink:
+    """每個事件一行 JSON，方便離線分析"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class PrometheusSink:
+    """彙整成 Prometheus 文字格式的 counter / histogram"""
+
+    BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+    def write(self, event):
+        with self._lock:
+            if event["type"] == "attempt":
+                labels = (("generator", event["generator"] or "none"), ("model", event["model"]),
+                          ("status", str(event["status"])))
+                self._counters[("polyglot_attempts_total", labels)] += 1
+                self._observe("polyglot_attempt_latency_seconds", labels[:2], event["latency"])
+                for key in ("prompt_tokens", "response_tokens"):
+                    if event.get(key):
+                        self._counters[(f"polyglot_{key}_total", labels[:2])] += event[key]
+            elif event["type"] == "generation":
+                labels = (("generator", event["generator"]), ("status", event["status"]))
+                self._counters[("polyglot_generations_total", labels)] += 1
+                self._counters[("polyglot_fallbacks_total", labels[:1])] += event["fallbacks"]
+                if event.get("cache_hit"):
+                    self._counters[("polyglot_cache_hits_total", labels[:1])] += 1
+                self._observe("polyglot_generation_latency_seconds", labels[:1], event["latency"])
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+            seen = set()
+            for (name, labels), value in counters:
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{self._labels(labels)} {value:g}")
+            for (name, labels), hist in histograms:
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                for bound, count in zip(self.BUCKETS, hist["buckets"]):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{self._labels(labels)} {hist['sum']:.4f}")
+                lines.append(f"{name}_count{self._labels(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics_server = {}
+
+
+def start_metrics_server(port, sink=None, host="127.0.0.1"):
+    """
+    在背景 thread 提供 GET /metrics (Prometheus 抓取用)；同一個 port 只會啟動一次。
+    預設只聽 127.0.0.1；要讓其他機器抓取時明確傳入 host="0.0.0.0"
+    """
+    if port in _metrics_server:
+        return _metrics_server[port]
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    sink = sink or prometheus
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = sink.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    _metrics_server[port] = server
+    return server
+
+
+# 預設 sink：記憶體環狀緩衝 + Prometheus 彙整 (JSONL 由 app 依設定加入)
+ring = add_sink(RingBufferSink())
+prometheus = add_sink(PrometheusSink())
+
+_jsonl_sinks = {}
+
+
+def enable_jsonl(path):
+    if path and path not in _jsonl_sinks:
+        _jsonl_sinks[path] = add_sink(JsonlFileSink(path))
+    return _jsonl_sinks.get(path)
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+import batch_runner
+
+BLUEPRINT = {
+    "README.md": "# 專案", "SPEC.md": "規格", "REPORT.md": "報告", "TODOLIST.md": "待辦",
+    "../../escaped.md": "x", "/tmp/escaped-absolute.md": "x", "_model_used": "gemini",
+}
+
+
+def test_malicious_section_names_stay_inside_project_dir(tmp_path):
+    out = tmp_path / "out"
+    project = {"id": "demo-1234", "name": "demo", "description": "d",
+               "answers": {"frontend": "", "backend": "", "database": ""}}
+    project_dir = out / project["id"]
+    project_dir.mkdir(parents=True)
+    # 各階段都已完成 (不需要 API)：只剩把檔案寫出去
+    state = {"blueprint": BLUEPRINT, "structure": {"STRUCTURE.txt": "tree", "FLOW.mermaid": "graph TD",
+                                                   "../structure-escape.txt": "x"}}
+    (project_dir / "state.json").write_text(json.dumps(state), encoding="utf-8")
+
+    record = batch_runner.run_project(project, str(out), api_key="unused", archive="zip")
+
+    assert record["status"] == "ok"
+    assert sorted(os.listdir(project_dir)) == sorted([
+        "README.md", "SPEC.md", "REPORT.md", "TODOLIST.md", "STRUCTURE.txt", "FLOW.mermaid",
+        "state.json", "demo-1234.zip",
+    ])
+    assert sorted(os.listdir(out)) == ["demo-1234"]
+    assert not (tmp_path / "escaped.md").exists() and not os.path.exists("/tmp/escaped-absolute.md")
+
+
+@pytest.mark.parametrize("name", ["../x.md", "/tmp/x.md", "sub/x.md", ".."])
+def test_output_path_rejects_unsafe_names(tmp_path, name):
+    with pytest.raises(batch_runner.StageFailed):
+        batch_runner._output_path(str(tmp_path), name)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_run_batch_against_mock_server(tmp_path, use_async):
+    pytest.importorskip("aiohttp")
+    import generator_engine
+    import transport
+    from benchmarks.mock_gemini_server import MockGeminiServer
+
+    server = MockGeminiServer(latency="const:0.01").start()
+    base_url = transport.POOL_SETTINGS["base_url"]
+    try:
+        transport.configure_pool(base_url=server.base_url)
+        generator_engine.configure_cache(backend="memory")
+        projects = [{"id": f"p{i}", "name": f"P{i}", "description": f"app {i}",
+                     "answers": {"frontend": "", "backend": "", "database": ""}} for i in range(3)]
+
+        summary = batch_runner.run_batch(projects, str(tmp_path), "k", concurrency=3, use_async=use_async)
+    finally:
+        transport.configure_pool(base_url=base_url)
+        server.stop()
+
+    assert summary["ok"] == 3 and summary["failed"] == 0
+    for project in projects:
+        assert (tmp_path / project["id"] / "README.md").exists()
+        assert (tmp_path / project["id"] / "STRUCTURE.txt").exists()
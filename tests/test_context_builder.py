@@ -0,0 +1,40 @@
+import context_builder
+
+DOC = """# 專案
+簡介
+
+## 部署
+```bash
+# 安裝套件
+pip install -r requirements.txt
+# 啟動
+streamlit run app.py
+```
+
+## 架構
+```mermaid
+graph TD
+  A --> B
+```
+"""
+
+
+def test_heading_inside_fence_is_not_a_section():
+    chunks = context_builder._split_document(DOC)
+    assert [c.heading for c in chunks if c.kind == "diagram"] == ["## 部署\n", "## 架構\n"]
+    assert len({c.section for c in chunks}) == 3
+    assert "# 安裝套件" in chunks[1].text and "streamlit run app.py" in chunks[1].text
+
+
+def test_unclosed_fence_swallows_following_headings():
+    text = "# A\n```python\n# not a heading\nx = 1\n"
+    chunks = context_builder._split_document(text)
+    assert len({c.section for c in chunks}) == 1
+    assert "".join(c.heading + c.text for c in chunks) == text
+
+
+def test_packed_document_keeps_fence_intact():
+    text = DOC + "\n".join(f"## 其他 {i}\n" + "內容" * 200 for i in range(20))
+    packed = context_builder.pack_document(text, kind="structure")
+    assert packed.count("```") % 2 == 0
+    assert "# 安裝套件\npip install" in packed
@@ -0,0 +1,56 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+import export_builder
+
+FILES = {"README.md": "# 專案\n" * 50, "SPEC.md": "規格", "FLOW.mermaid": "graph TD\n  A --> B\n"}
+
+
+def _zip_contents(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        return {info.filename: archive.read(info).decode("utf-8") for info in archive.infolist()}
+
+
+def _tar_contents(data):
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as archive:
+        return {member.name: archive.extractfile(member).read().decode("utf-8") for member in archive.getmembers()}
+
+
+@pytest.mark.parametrize("fmt", ["zip", "zip-store"])
+def test_zip_round_trip(fmt):
+    builder = export_builder.ExportBuilder()
+    data = builder.build(FILES, fmt)
+    assert _zip_contents(data) == FILES
+    assert builder.build(FILES, fmt) is data    # 內容沒變：直接回傳快取
+
+
+def test_tar_gz_round_trip():
+    assert _tar_contents(export_builder.ExportBuilder().build(FILES, "tar.gz")) == FILES
+
+
+def test_bundle_round_trip():
+    files = export_builder.bundle({"p1": FILES, "p2": {"README.md": "另一個"}})
+    assert set(_zip_contents(export_builder.ExportBuilder().build(files))) == {
+        "p1/README.md", "p1/SPEC.md", "p1/FLOW.mermaid", "p2/README.md",
+    }
+
+
+def test_collect_files_drops_unsafe_names():
+    blueprint = dict(FILES, **{"../../x.md": "x", "/tmp/x.md": "x", "_model_used": "m"})
+    structure = {"STRUCTURE.txt": "tree", "..\\evil.txt": "x"}
+    files = export_builder.collect_files(blueprint, structure)
+    assert list(files) == ["README.md", "SPEC.md", "FLOW.mermaid", "STRUCTURE.txt"]
+    for fmt, read in (("zip", _zip_contents), ("tar.gz", _tar_contents)):
+        for name in read(export_builder.ExportBuilder().build(files, fmt)):
+            assert not name.startswith("/") and ".." not in name.split("/") and "\\" not in name
+
+
+@pytest.mark.parametrize("name", ["../../x.md", "/tmp/x.md", "p1/../x.md", "p1//x.md", "C:x.md"])
+@pytest.mark.parametrize("fmt", ["zip", "tar.gz"])
+def test_unsafe_member_names_are_rejected(name, fmt):
+    with pytest.raises(ValueError):
+        export_builder.ExportBuilder().build({name: "x"}, fmt)
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+
+
+def _wait_finished(job, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not job.is_finished():
+        assert time.monotonic() < deadline, "工作一直沒有結束"
+        time.sleep(0.005)
+    return job
+
+
+@pytest.fixture
+def manager():
+    m = jobs.JobManager(max_workers=1, max_queue=4, max_per_session=2)
+    yield m
+    m._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _blocking(job, release):
+    """直到 release 或工作被取消才結束"""
+    while not release.wait(0.01):
+        if job.cancelled:
+            raise RuntimeError("已取消")
+    return "ok"
+
+
+def test_same_token_is_deduplicated_and_result_is_kept(manager):
+    job = manager.submit("s1", "interview", "t", lambda job, x: x * 2, 21)
+    assert manager.submit("s1", "interview", "t", lambda job, x: 0, 1) is job
+    assert _wait_finished(job).status == jobs.DONE and job.result == 42
+    assert manager.get("s1", "t") is job
+    assert manager.metrics()["deduplicated"] == 1
+
+
+def test_cancel_running_job(manager):
+    release = threading.Event()
+    job = manager.submit("s1", "blueprint", "t", _blocking, release)
+
+    assert manager.cancel("s1", "t") is job
+    assert _wait_finished(job).status == jobs.CANCELLED
+    # 取消的工作可以用同一個 token 重新送出
+    release.set()
+    retry = manager.submit("s1", "blueprint", "t", _blocking, release)
+    assert retry is not job and _wait_finished(retry).status == jobs.DONE
+
+
+def test_cancelled_job_never_starts(manager):
+    release = threading.Event()
+    first = manager.submit("s1", "blueprint", "a", _blocking, release)
+    while first.status == jobs.QUEUED:
+        time.sleep(0.005)
+    queued = manager.submit("s2", "structure", "b", lambda job: pytest.fail("不應該執行"))
+    assert queued.status == jobs.QUEUED and manager.queue_position(queued) == 1
+
+    manager.cancel_session("s2")
+    release.set()
+    assert _wait_finished(first).status == jobs.DONE
+    assert _wait_finished(queued).status == jobs.CANCELLED and queued.started is None
+
+
+def test_max_per_session_limits_only_that_session(manager):
+    release = threading.Event()
+    manager.submit("s1", "blueprint", "a", _blocking, release)
+    manager.submit("s1", "structure", "b", _blocking, release)
+
+    with pytest.raises(jobs.QueueFull):
+        manager.submit("s1", "document", "c", _blocking, release)
+    other = manager.submit("s2", "interview", "d", _blocking, release)
+    assert manager.metrics()["rejected"] == 1
+
+    release.set()
+    _wait_finished(other)
+    # 之前的工作都結束後，同一個 session 又可以送出
+    assert _wait_finished(manager.submit("s1", "document", "c", _blocking, release)).status == jobs.DONE
+
+
+def test_queue_limit_rejects_new_work(manager):
+    release = threading.Event()
+    manager.submit("s0", "blueprint", "running", _blocking, release)
+    for i in range(4):
+        manager.submit(f"s{i + 1}", "interview", "t", _blocking, release)
+
+    with pytest.raises(jobs.QueueFull):
+        manager.submit("s9", "interview", "t", _blocking, release)
+    release.set()
+
+
+def test_discard_only_removes_finished_jobs(manager):
+    release = threading.Event()
+    job = manager.submit("s1", "document", "t", _blocking, release)
+    manager.discard("s1", "t")
+    assert manager.get("s1", "t") is job
+
+    release.set()
+    _wait_finished(job)
+    manager.discard("s1", "t")
+    assert manager.get("s1", "t") is None
+
+
+def test_failure_keeps_the_error_message(manager):
+    def boom(job):
+        raise ValueError("壞掉了")
+
+    job = _wait_finished(manager.submit("s1", "interview", "t", boom))
+    assert job.status == jobs.FAILED and job.error == "壞掉了"
@@ -0,0 +1,30 @@
+import pytest
+
+import json_repair
+
+KEYS = ("q_frontend", "q_backend", "q_database")
+EXPECTED = {"q_frontend": "前端？", "q_backend": "後端？", "q_database": "資料庫？"}
+
+CASES = [
+    ("clean", '{"q_frontend": "前端？", "q_backend": "後端？", "q_database": "資料庫？"}', False),
+    ("trailing_comma", '{"q_frontend": "前端？", "q_backend": "後端？", "q_database": "資料庫？",}', True),
+    ("fenced_block", '```json\n{"q_frontend": "前端？", "q_backend": "後端？", "q_database": "資料庫？"}\n```', False),
+    ("prose_before", '好的，以下是問卷：\n{"q_frontend": "前端？", "q_backend": "後端？", "q_database": "資料庫？"}', False),
+    ("truncated_object", '{"q_frontend": "前端？", "q_backend": "後端？", "q_database": "資料庫？', True),
+    ("missing_comma", '{"q_frontend": "前端？" "q_backend": "後端？", "q_database": "資料庫？"}', True),
+]
+
+
+@pytest.mark.parametrize("text, repaired", [c[1:] for c in CASES], ids=[c[0] for c in CASES])
+def test_loads_object_recovers(text, repaired):
+    assert json_repair.loads_object(text, KEYS) == (EXPECTED, repaired)
+
+
+@pytest.mark.parametrize("text", [
+    '{"q_frontend": "前端？", "q_backend": "後端？"}',
+    '{"q_frontend": "前端？", "q_back',
+    "抱歉，我無法產生問卷。",
+], ids=["missing_key", "truncated_before_last_key", "no_json"])
+def test_loads_object_rejects_partial(text):
+    with pytest.raises(json_repair.RepairFailed):
+        json_repair.loads_object(text, KEYS)
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+import generator_engine as engine
+import telemetry
+import transport
+from benchmarks.mock_gemini_server import MockGeminiServer
+
+MODEL = engine.MODEL_TIERS[0][0]
+
+
+@pytest.fixture
+def server():
+    srv = MockGeminiServer(latency="const:0.3").start()
+    base_url = transport.POOL_SETTINGS["base_url"]
+    transport.configure_pool(base_url=srv.base_url)
+    try:
+        yield srv
+    finally:
+        transport.configure_pool(base_url=base_url)
+        srv.stop()
+
+
+def _sent(srv):
+    return sum(sum(counts.values()) for counts in srv.snapshot().values())
+
+
+def test_cancelled_attempt_is_not_sent(server):
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(engine.GenerationCancelled):
+        engine._attempt_model(MODEL, "hello", "k", cancel_event=cancel)
+    assert _sent(server) == 0
+
+
+def test_in_flight_attempt_is_closed_when_cancelled(server):
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    with pytest.raises(engine.GenerationCancelled):
+        engine._attempt_model(MODEL, "hello", "k", cancel_event=cancel)
+    assert _sent(server) == 1
+
+
+def test_racing_closes_the_loser(server):
+    delays = iter([0.6, 0.05])
+    server.latency = lambda rng: next(delays, 0.05)   # 第一個送出的模型比較慢，備援請求勝出
+    events = []
+    sink = telemetry.add_sink(type("Sink", (), {"write": lambda self, event: events.append(event)})())
+    try:
+        res_json, model_name, report = engine.call_gemini_api_racing("hello", "k", fanout=2, hedge_after=0.1)
+        time.sleep(0.8)
+    finally:
+        telemetry.remove_sink(sink)
+
+    assert res_json["candidates"] and report["winner"] == model_name
+    loser = [e for e in events if e.get("type") == "attempt" and e["model"] != model_name]
+    assert [e["status"] for e in loser] == ["cancelled"]
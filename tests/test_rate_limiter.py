@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+
+MODEL = "gemini-2.5-pro"
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "條件一直沒有成立"
+        time.sleep(0.005)
+
+
+def test_sessions_take_turns_instead_of_first_come_first_served():
+    limiter = rate_limiter.RateLimiter(keys=["k"], rpm=600, burst=1)
+    limiter.acquire(MODEL)     # 先用掉 burst，之後每 0.1 秒補一個
+    order = []
+
+    def request(session_id):
+        with rate_limiter.session(session_id):
+            limiter.acquire(MODEL)
+        order.append(session_id)
+
+    heavy = [threading.Thread(target=request, args=("heavy",)) for _ in range(3)]
+    for t in heavy:
+        t.start()
+    _wait_for(lambda: limiter.snapshot()["waiting"] == 3)
+    light = threading.Thread(target=request, args=("light",))
+    light.start()
+    _wait_for(lambda: limiter.snapshot()["waiting"] == 4)
+
+    for t in heavy + [light]:
+        t.join(5)
+
+    assert order == ["heavy", "light", "heavy", "heavy"]
+    assert limiter._served == {}       # 佇列清空後不再保留每個 session 的紀錄
+    assert limiter.snapshot()["waited"] == 4
+
+
+def test_rejects_when_estimated_wait_exceeds_max_wait():
+    limiter = rate_limiter.RateLimiter(keys=["k"], rpm=60, burst=1, max_wait=5)
+    assert limiter.acquire(MODEL) == "k"
+
+    with pytest.raises(rate_limiter.RateLimited):
+        limiter.acquire(MODEL, max_wait=0.2)    # 下一個 token 要一秒後才補充
+    assert limiter.snapshot()["rejected"] == 1
+    assert limiter.snapshot()["waiting"] == 0
+
+
+def test_cancel_leaves_the_queue():
+    limiter = rate_limiter.RateLimiter(keys=["k"], rpm=6, burst=1)
+    limiter.acquire(MODEL)
+    cancel_event = threading.Event()
+    threading.Timer(0.1, cancel_event.set).start()
+
+    with pytest.raises(InterruptedError):
+        limiter.acquire(MODEL, cancel_event=cancel_event)
+    assert limiter.snapshot()["waiting"] == 0
+
+
+def test_picks_the_key_with_most_remaining_quota():
+    limiter = rate_limiter.RateLimiter(keys=["a", "b"], rpm=60, burst=3)
+    granted = [limiter.acquire(MODEL) for _ in range(6)]
+    assert sorted(granted) == ["a", "a", "a", "b", "b", "b"]
+
+
+def test_unlimited_mode_rotates_keys_and_skips_penalized_ones():
+    limiter = rate_limiter.RateLimiter(keys=["a", "b"])
+    assert not limiter.snapshot()["limited"]
+    assert {limiter.acquire(MODEL) for _ in range(4)} == {"a", "b"}
+
+    limiter.penalize("a", MODEL, retry_after=60)
+    assert {limiter.acquire(MODEL) for _ in range(4)} == {"b"}
+    assert not limiter.exhausted(MODEL)
+
+    limiter.penalize("b", MODEL, retry_after=60)
+    assert limiter.exhausted(MODEL)
+    with pytest.raises(rate_limiter.RateLimited):
+        limiter.acquire(MODEL)
+    assert limiter.acquire("gemini-2.5-flash") in ("a", "b")    # 其他模型不受影響
+
+
+def test_configure_rebuilds_only_when_settings_change():
+    first = rate_limiter.configure(keys=["a"], rpm=30)
+    try:
+        assert rate_limiter.configure(keys=["a"], rpm=30) is first
+        assert rate_limiter.configure(keys=["a"], rpm=60) is not first
+    finally:
+        rate_limiter.configure()
@@ -0,0 +1,101 @@
+import pytest
+
+import generator_engine as engine
+import section_parser
+
+
+@pytest.mark.parametrize("name, safe", [
+    ("README.md", True),
+    ("FLOW.mermaid", True),
+    ("API 說明.md", True),
+    ("../../x.md", False),
+    ("/tmp/x.md", False),
+    ("docs/x.md", False),
+    ("docs\\x.md", False),
+    ("C:x.md", False),
+    ("..", False),
+    ("_model_used", False),
+    ("x" * (section_parser.MAX_NAME + 1), False),
+])
+def test_is_safe_name(name, safe):
+    assert section_parser.is_safe_name(name) is safe
+
+
+def test_blueprint_drops_path_like_sections():
+    text = "".join(f"====FILE: {name}====\n{name} 內容\n" for name in (
+        "README.md", "SPEC.md", "REPORT.md", "TODOLIST.md", "../../x.md", "/tmp/x.md", "EXTRA.md",
+    ))
+    files = engine._blueprint_files(section_parser.parse_sections(text))
+    assert list(files) == engine.BLUEPRINT_FILES + ["EXTRA.md"]
+
+
+STREAM_SAMPLES = [
+    # 一般回應：開場白 + 四個檔案
+    "好的，以下是文件：\n" + "".join(f"====FILE: {n}====\n# {n}\n內容 {n}\n\n" for n in engine.BLUEPRINT_FILES),
+    # \r\n 換行、最後一個區塊沒有結尾換行
+    "====FILE: README.md====\r\nhello\r\n====FILE: SPEC.md====\r\nworld",
+    # 內文出現不完整 / 跨行的標記、只有等號的分隔線
+    "====FILE: README.md====\n看 ====FILE: 沒有結尾\n========\n====FILE:\nSPEC.md====\n尾巴\n",
+    # 同名區塊以第一個為準
+    "====FILE: A.md====\n第一\n====FILE: B.md====\nb\n====FILE: A.md====\n第二\n",
+    # 標頭太長就不是標頭
+    "====FILE: " + "x" * 300 + "====\n內容\n====FILE: OK.md====\nok\n",
+    # 檔案最後剛好停在標頭上
+    "前言\n====FILE: A.md====\na\n====FILE: EMPTY.md====",
+]
+
+
+def _stream(text, size):
+    parser = section_parser.StreamingSectionParser()
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    events.extend(parser.close())
+    return parser, events
+
+
+@pytest.mark.parametrize("text", STREAM_SAMPLES)
+def test_streaming_matches_batch_parser_for_any_chunking(text):
+    expected = section_parser.parse_sections(text)
+    for size in list(range(1, 12)) + [len(text)]:
+        parser, _ = _stream(text, size)
+        assert parser.sections() == expected, f"chunk size {size}"
+        assert list(parser.sections()) == list(expected)
+
+
+@pytest.mark.parametrize("text", STREAM_SAMPLES)
+def test_streaming_events_are_well_formed(text):
+    parser, events = _stream(text, 7)
+    open_name = None
+    deltas = {}
+    for event in events:
+        if event[0] == "start":
+            assert open_name is None
+            open_name = event[1]
+        elif event[0] == "delta":
+            assert event[1] == open_name
+            deltas[open_name] = deltas.get(open_name, "") + event[2]
+        else:
+            assert event == ("end", open_name)
+            open_name = None
+    assert open_name is None
+    assert [e[1] for e in events if e[0] == "end"] == parser.completed
+    for name, text_so_far in deltas.items():
+        assert text_so_far == parser.text(name)
+
+
+def test_streaming_never_emits_part_of_a_marker():
+    parser = section_parser.StreamingSectionParser()
+    assert parser.feed("====FILE: README.md====\n內容 ====FI") == [
+        ("start", "README.md"), ("delta", "README.md", "內容 "),
+    ]
+    assert parser.feed("LE: SPEC.md====\nspec") == [
+        ("end", "README.md"), ("start", "SPEC.md"), ("delta", "SPEC.md", "spec"),
+    ]
+    assert parser.close() == [("end", "SPEC.md")]
+
+
+def test_bytes_input_matches_str():
+    text = STREAM_SAMPLES[0]
+    as_bytes = section_parser.parse_sections(text.encode("utf-8"))
+    assert {k: bytes(v).decode("utf-8") for k, v in as_bytes.items()} == section_parser.parse_sections(text)
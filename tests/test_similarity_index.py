@@ -0,0 +1,31 @@
+import similarity_index
+
+NAME, DESC = "PolyGlotBook AI", "我想做一個網站，可以自動把文章變成中英對照的電子書，還要有語音朗讀功能。"
+SIMILAR = "我想做個網站，自動把文章變成中英對照電子書，也要有語音朗讀！"
+
+
+def test_query_finds_paraphrase_of_own_project():
+    index = similarity_index.SimilarityIndex()
+    index.add(NAME, DESC, "interview", {"q_frontend": "?"}, owner="alice")
+
+    found = index.query(NAME, SIMILAR, owner="alice")
+
+    assert found["project_name"] == NAME and found["results"] == {"interview": {"q_frontend": "?"}}
+
+
+def test_query_never_returns_other_owners_projects():
+    index = similarity_index.SimilarityIndex()
+    index.add(NAME, DESC, "blueprint", {"files": {"README.md": "alice 的專案"}}, owner="alice")
+
+    assert index.query(NAME, DESC, owner="bob") is None
+    assert index.query(NAME, DESC) is None
+
+
+def test_same_idea_is_kept_separately_per_owner():
+    index = similarity_index.SimilarityIndex()
+    index.add(NAME, DESC, "project", "alice-project", owner="alice")
+    index.add(NAME, DESC, "project", "bob-project", owner="bob")
+
+    assert len(index) == 2
+    assert index.query(NAME, DESC, owner="alice")["results"] == {"project": "alice-project"}
+    assert index.query(NAME, DESC, owner="bob")["results"] == {"project": "bob-project"}
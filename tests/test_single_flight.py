@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pytest
+
+import single_flight
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "條件一直沒有成立"
+        time.sleep(0.005)
+
+
+def _concurrent_calls(group, key, fn, followers=4):
+    """先讓第一個呼叫者進入 fn，其餘呼叫者都在等待時才放行；回傳每個呼叫者的 (結果或例外)"""
+    results = []
+    lock = threading.Lock()
+
+    def call():
+        try:
+            outcome = group.do(key, fn)
+        except Exception as e:
+            outcome = e
+        with lock:
+            results.append(outcome)
+
+    threads = [threading.Thread(target=call) for _ in range(followers + 1)]
+    threads[0].start()
+    _wait_for(lambda: group.in_flight() == 1)
+    for t in threads[1:]:
+        t.start()
+    _wait_for(lambda: group.snapshot()["shared"] == followers)
+    return threads, results
+
+
+def test_make_key_ignores_whitespace_but_not_variant():
+    assert single_flight.make_key("interview", "a  b\n c") == single_flight.make_key("interview", "a b c")
+    assert single_flight.make_key("interview", "a", "key1") != single_flight.make_key("interview", "a", "key2")
+    assert single_flight.make_key("interview", "a") != single_flight.make_key("blueprint", "a")
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    group = single_flight.SingleFlight()
+    release = threading.Event()
+    upstream = []
+
+    def fn(cancel):
+        upstream.append(threading.current_thread())
+        release.wait(2)
+        return {"answer": 42}
+
+    threads, results = _concurrent_calls(group, "k", fn)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(upstream) == 1 and upstream[0] is threads[0]   # 第一個呼叫者自己執行上游請求
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(result == {"answer": 42} for result, _ in results)
+    assert group.snapshot() == {"calls": 5, "upstream": 1, "shared": 4, "abandoned": 0, "errors": 0, "in_flight": 0}
+
+
+def test_error_is_propagated_to_every_waiter():
+    group = single_flight.SingleFlight()
+    release = threading.Event()
+
+    def fn(cancel):
+        release.wait(2)
+        raise RuntimeError("上游失敗")
+
+    threads, results = _concurrent_calls(group, "k", fn)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 5 and all(isinstance(r, RuntimeError) and str(r) == "上游失敗" for r in results)
+    assert group.snapshot()["errors"] == 1 and group.in_flight() == 0
+
+    # 失敗不會被記住：下一次呼叫重新送出
+    assert group.do("k", lambda cancel: "ok") == ("ok", False)
+
+
+def test_leader_cancel_without_waiters_abandons_upstream():
+    group = single_flight.SingleFlight()
+    cancel_event = threading.Event()
+
+    def fn(cancel):
+        cancel_event.set()
+        assert cancel.is_set()
+        raise InterruptedError("上游停止")
+
+    with pytest.raises(InterruptedError):
+        group.do("k", fn, cancel_event)
+    assert group.snapshot()["abandoned"] == 1 and group.in_flight() == 0
+
+
+def test_leader_cancel_keeps_running_for_other_waiters():
+    group = single_flight.SingleFlight()
+    leader_cancel = threading.Event()
+    release = threading.Event()
+    seen = {}
+
+    def fn(cancel):
+        release.wait(2)
+        seen["cancelled"] = cancel.is_set()
+        return "done"
+
+    outcome = {}
+
+    def leader():
+        try:
+            outcome["leader"] = group.do("k", fn, leader_cancel)
+        except InterruptedError:
+            outcome["leader"] = "interrupted"
+
+    lead = threading.Thread(target=leader)
+    lead.start()
+    _wait_for(lambda: group.in_flight() == 1)
+    follower = threading.Thread(target=lambda: outcome.setdefault("follower", group.do("k", fn)))
+    follower.start()
+    _wait_for(lambda: group.snapshot()["shared"] == 1)
+    leader_cancel.set()
+    release.set()
+    lead.join()
+    follower.join()
+
+    assert seen["cancelled"] is False      # 還有人在等，上游請求不能停
+    assert outcome == {"leader": "interrupted", "follower": ("done", True)}
+    assert group.snapshot()["abandoned"] == 0
+
+
+def test_waiter_cancel_leaves_without_affecting_the_flight():
+    group = single_flight.SingleFlight()
+    release = threading.Event()
+    waiter_cancel = threading.Event()
+    outcome = {}
+
+    def fn(cancel):
+        release.wait(2)
+        return "done"
+
+    lead = threading.Thread(target=lambda: outcome.setdefault("leader", group.do("k", fn)))
+    lead.start()
+    _wait_for(lambda: group.in_flight() == 1)
+
+    def waiter():
+        try:
+            group.do("k", fn, waiter_cancel)
+        except InterruptedError:
+            outcome["waiter"] = "interrupted"
+
+    wait_thread = threading.Thread(target=waiter)
+    wait_thread.start()
+    _wait_for(lambda: group.snapshot()["shared"] == 1)
+    waiter_cancel.set()
+    wait_thread.join(2)
+    release.set()
+    lead.join()
+
+    assert outcome == {"leader": ("done", False), "waiter": "interrupted"}
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import re
+import threading
+import weakref
+
+# ==========================================
+# 👇 共用連線層：連線池 + Keep-Alive
+# ==========================================
+# 原本每次嘗試都呼叫 requests.post，等於每個模型、每個使用者都重新做一次 TLS 握手。
+# 這裡改成整個 process 共用一個 Session，由連線池重複使用同一條 HTTPS 連線。
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+
+POOL_SETTINGS = {
+    "pool_size": 32,          # 同一個 host 最多保留幾條 keep-alive 連線
+    "base_url": GEMINI_API_BASE,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure_pool(pool_size=None, base_url=None):
+    """調整連線池大小或 API 位址；有變動時，下一次取用會重建 Session"""
+    global _session
+    with _session_lock:
+        changed = False
+        if pool_size and int(pool_size) != POOL_SETTINGS["pool_size"]:
+            POOL_SETTINGS["pool_size"] = int(pool_size)
+            changed = True
+        if base_url and base_url.rstrip("/") != POOL_SETTINGS["base_url"]:
+            POOL_SETTINGS["base_url"] = base_url.rstrip("/")
+            changed = True
+        # 設定沒變就沿用原本的連線 (app.py 每次 rerun 都會呼叫這裡)
+        if changed and _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session():
+    """取得整個 process 共用的 requests.Session (第一次呼叫時才建立)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # requests 在第一次送出請求時才載入 (匯入本模組不必付出這段時間)
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                size = POOL_SETTINGS["pool_size"]
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size, pool_block=False)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Content-Type": "application/json"})
+                _session = session
+    return _session
+
+
+# API Key 放在 x-goog-api-key header，不放在網址：
+# requests / aiohttp 的例外訊息會帶上完整網址，錯誤訊息、量測記錄與 UI 才不會出現 Key
+def model_url(model_name, method="generateContent"):
+    return f"{POOL_SETTINGS['base_url']}/{model_name}:{method}"
+
+
+def auth_headers(api_key):
+    return {"x-goog-api-key": api_key}
+
+
+_KEY_PATTERNS = (
+    re.compile(r"([?&]key=)[^&\s'\"]+"),
+    re.compile(r"AIza[0-9A-Za-z_\-]{8,}"),
+)
+
+
+def redact(text):
+    """把文字中的 API Key (網址參數 key=... 或 AIza 開頭的 Key) 遮蔽 (錯誤訊息顯示或記錄前使用)"""
+    text = str(text)
+    text = _KEY_PATTERNS[0].sub(r"\1***", text)
+    return _KEY_PATTERNS[1].sub("AIza***", text)
+
+
+def post_json(model_name, api_key, payload, timeout=60, method="generateContent", stream=False):
+    """透過共用連線池送出請求，回傳 requests.Response"""
+    return get_session().post(
+        model_url(model_name, method), json=payload, headers=auth_headers(api_key), timeout=timeout, stream=stream
+    )
+
+
+def open_stream(model_name, api_key, payload, timeout=60):
+    """開啟 streamGenerateContent (Server-Sent Events) 串流，回傳尚未讀取內容的 Response"""
+    return get_session().post(
+        model_url(model_name, "streamGenerateContent") + "?alt=sse",
+        json=payload, headers=auth_headers(api_key), timeout=timeout, stream=True,
+    )
+
+
+def iter_stream_text(response, usage=None):
+    """
+    逐段讀取 SSE 回應，產生每個 chunk 的文字。
+    usage：傳入 dict 時會填入最後一個事件的 usageMetadata (token 數)。
+    """
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        event = json.loads(line[len("data:"):].strip())
+        if usage is not None and event.get("usageMetadata"):
+            usage.update(event["usageMetadata"])
+        for candidate in event.get("candidates", [])[:1]:
+            for part in candidate.get("content", {}).get("parts", []):
+                if part.get("text"):
+                    yield part["text"]
+
+
+# ==========================================
+# 👇 非同步版本 (asyncio + aiohttp)
+# ==========================================
+class AsyncGeminiClient:
+    """
+    以 asyncio 為基礎的客戶端：一個 event loop 就能同時維持大量在途請求，
+    不需要每個使用者各佔一條 thread。aiohttp 只有在第一次使用時才載入。
+    """
+
+    def __init__(self, pool_size=None):
+        self.pool_size = pool_size or POOL_SETTINGS["pool_size"]
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            try:
+                import aiohttp
+            except ImportError as e:
+                raise RuntimeError("非同步模式需要安裝 aiohttp (pip install aiohttp)") from e
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector, headers={"Content-Type": "application/json"}
+            )
+        return self._session
+
+    async def post_json(self, model_name, api_key, payload, timeout=60, method="generateContent"):
+        """回傳 (status_code, headers, body)；200 時 body 為 dict，其他狀態為文字"""
+        import aiohttp
+
+        session = await self._get_session()
+        async with session.post(
+            model_url(model_name, method),
+            json=payload,
+            headers=auth_headers(api_key),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            if response.status == 200:
+                body = await response.json(content_type=None)
+            else:
+                body = await response.text()
+            return response.status, dict(response.headers), body
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """每個 event loop 共用一個 AsyncGeminiClient (aiohttp 的 Session 不能跨 loop 使用)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncGeminiClient()
+    return client
+
+
+async def close_async_client():
+    """關閉目前 event loop 的共用客戶端 (在 asyncio.run 結束前呼叫，避免連線洩漏)"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()